@@ -0,0 +1,339 @@
+"""
+Benchmark offline do pipeline, sem gastar cota: roda `processar_csv_streaming`, a rota `/process`
+do wow-parser e o `distribuir_analise` da funcao-orquestradora contra os fakes de `fakes.py`,
+variando tamanho do arquivo, concorrência e tamanho do lote.
+
+Relata linhas/s, s/MB, latência por linha (p50/p95/p99), pico de RSS e bytes copiados
+(enviados/baixados do Storage e publicados no Pub/Sub).
+
+Uso (com as dependências do requirements.txt instaladas):
+    python benchmark/executar.py --linhas 200,2000 --concorrencia 4,8,16 --lote 1,5
+    python benchmark/executar.py --cenarios streaming --latencia-ms 800 --taxa-throttle 0.05 --saida resultado.json
+"""
+import gc
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import threading
+import importlib.util
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+from gerar_csv import gerar_csv
+
+
+# --- Medições ---
+
+class AmostradorRSS:
+    """Amostra o RSS do processo em uma thread para achar o pico durante um cenário."""
+
+    def __init__(self, intervalo: float = 0.02):
+        self.intervalo = intervalo
+        self.pico = 0
+        self._parar = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def rss_atual() -> int:
+        try:
+            with open('/proc/self/status') as status:
+                for linha in status:
+                    if linha.startswith('VmRSS:'):
+                        return int(linha.split()[1]) * 1024
+        except OSError:
+            pass
+        # Sem /proc: pico do processo inteiro (KB no Linux, bytes no macOS)
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico if sys.platform == 'darwin' else pico * 1024
+
+    def _loop(self):
+        while not self._parar.is_set():
+            self.pico = max(self.pico, self.rss_atual())
+            self._parar.wait(self.intervalo)
+
+    def __enter__(self):
+        self.inicial = self.rss_atual()
+        self.pico = self.inicial
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._parar.set()
+        self._thread.join()
+
+
+class RegistroLatencias:
+    def __init__(self):
+        self.valores = []
+        self._lock = threading.Lock()
+
+    def adicionar(self, segundos: float, linhas: int = 1):
+        with self._lock:
+            self.valores.extend([segundos] * linhas)
+
+    def percentil(self, p: float) -> float:
+        with self._lock:
+            valores = sorted(self.valores)
+        if not valores:
+            return 0.0
+        return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+def carregar_modulo(nome: str, caminho: str):
+    spec = importlib.util.spec_from_file_location(nome, caminho)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nome] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+# --- Requisição falsa para a rota /process ---
+
+class ArquivoEnviado:
+    def __init__(self, dados: bytes, nome: str):
+        self.stream = io.BytesIO(dados)
+        self.filename = nome
+
+    def seek(self, *args):
+        return self.stream.seek(*args)
+
+    def tell(self):
+        return self.stream.tell()
+
+
+class RequisicaoFake:
+    def __init__(self, method: str, path: str, files: dict = None, form: dict = None):
+        self.method = method
+        self.path = path
+        self.url = f"http://localhost{path}"
+        self.files = files or {}
+        self.form = form or {}
+        self.args = {}
+        self.headers = {}
+
+    def get_json(self, silent: bool = False):
+        return None
+
+
+# --- Cenários ---
+
+def preparar_wow(wow, args, concorrencia: int, lote: int):
+    """Zera o estado compartilhado do wow-parser e aplica as configurações da rodada."""
+    wow.vertex_limiter = sys.modules['limitador'].LimitadorVertex(
+        max_rps=args.max_rps, max_concorrencia=args.vertex_concorrencia
+    )
+    wow.scheduler = sys.modules['escalonador'].EscalonadorJusto(args.vertex_concorrencia)
+    wow.classification_cache = None
+    sys.modules['motor_classificacao'].MAX_CONCORRENCIA = concorrencia
+    wow.LOTE_MAX_ITENS = lote
+
+
+def medir_chamadas_wow(wow, registro: RegistroLatencias):
+    """Envolve as funções de classificação para medir a latência por linha; retorna a função que desfaz."""
+    original_um, original_lote = wow.analisar_interacao, wow.analisar_lote
+
+    def analisar_interacao(texto, contador_cache=None, medidor=None, contador_respostas=None):
+        inicio = time.perf_counter()
+        try:
+            return original_um(texto, contador_cache, medidor, contador_respostas)
+        finally:
+            registro.adicionar(time.perf_counter() - inicio)
+
+    def analisar_lote(textos, contador_cache=None, medidor=None, contador_respostas=None):
+        inicio = time.perf_counter()
+        try:
+            return original_lote(textos, contador_cache, medidor, contador_respostas)
+        finally:
+            registro.adicionar(time.perf_counter() - inicio, sum(1 for texto in textos if texto))
+
+    wow.analisar_interacao, wow.analisar_lote = analisar_interacao, analisar_lote
+
+    def desfazer():
+        wow.analisar_interacao, wow.analisar_lote = original_um, original_lote
+    return desfazer
+
+
+def cenario_streaming(wow, dados: bytes, sessao: str, concorrencia: int, lote: int) -> dict:
+    bucket = wow.get_storage_client().bucket(wow.BUCKET_NAME)
+    saida = bucket.blob(f"benchmark/{sessao}.csv").open('w', encoding='utf-8', newline='')
+    _, _, _, stats = wow.processar_csv_streaming(
+        io.BytesIO(dados), sessao, max_concorrencia=concorrencia, tamanho_lote=lote,
+        output_stream=saida, total_bytes=len(dados)
+    )
+    saida.close()
+    return {'linhas_saida': stats['total_rows'], 'erros': stats.get('error_count', 0)}
+
+
+def cenario_process(wow, dados: bytes, sessao: str, concorrencia: int, lote: int) -> dict:
+    requisicao = RequisicaoFake('POST', '/process', files={'file': ArquivoEnviado(dados, 'benchmark.csv')},
+                                form={'session_id': sessao})
+    corpo, status, _ = wow.upload_service(requisicao)
+    resposta = json.loads(corpo)
+    if status != 200:
+        raise RuntimeError(f"/process respondeu {status}: {resposta.get('message')}")
+    stats = resposta.get('statistics', {})
+    return {'linhas_saida': stats.get('total_rows', 0), 'erros': stats.get('error_count', 0)}
+
+
+def preparar_distribuir(orquestradora, dados: bytes, sessao: str) -> tuple:
+    """Coloca o CSV no bucket falso antes da medição (o gatilho do Storage recebe um arquivo já salvo)."""
+    bucket_nome = 'benchmark-entrada'
+    nome = f"benchmark/{sessao}.csv"
+    orquestradora.storage_client.bucket(bucket_nome).blob(nome).upload_from_string(dados)
+    return bucket_nome, nome
+
+
+def cenario_distribuir(orquestradora, bucket_nome: str, nome: str, registro: RegistroLatencias) -> dict:
+    publisher = orquestradora.publisher
+    original = publisher.publish
+
+    def publish(topico, data, **atributos):
+        inicio = time.perf_counter()
+        futuro = original(topico, data, **atributos)
+        futuro.add_done_callback(lambda _: registro.adicionar(time.perf_counter() - inicio))
+        return futuro
+
+    publisher.publish = publish
+    try:
+        resumo = orquestradora.distribuir_analise({'bucket': bucket_nome, 'name': nome}, None)
+    finally:
+        publisher.publish = original
+    return {'linhas_saida': resumo['publicadas'], 'erros': resumo['falhas']}
+
+
+# --- Execução ---
+
+def rodar(nome_cenario: str, executar, registro: RegistroLatencias, dados: bytes, linhas: int,
+          concorrencia, lote, limitador=None) -> dict:
+    gc.collect()
+    fakes.METRICAS.zerar()
+    with AmostradorRSS() as rss:
+        inicio = time.perf_counter()
+        resultado = executar()
+        duracao = time.perf_counter() - inicio
+    mb = len(dados) / (1024 * 1024)
+    estado_limitador = limitador.estado() if limitador is not None else {}
+    return {
+        'cenario': nome_cenario,
+        'linhas': linhas,
+        'mb': round(mb, 2),
+        'concorrencia': concorrencia,
+        'lote': lote,
+        'duracao_s': round(duracao, 2),
+        'linhas_por_s': round(linhas / duracao, 1) if duracao else 0,
+        's_por_mb': round(duracao / mb, 2) if mb else 0,
+        'p50_ms': round(registro.percentil(50) * 1000, 1),
+        'p95_ms': round(registro.percentil(95) * 1000, 1),
+        'p99_ms': round(registro.percentil(99) * 1000, 1),
+        'rss_pico_mb': round(rss.pico / (1024 * 1024), 1),
+        'rss_delta_mb': round((rss.pico - rss.inicial) / (1024 * 1024), 1),
+        'throttles': estado_limitador.get('throttle_count', 0),
+        'novas_tentativas': estado_limitador.get('retry_count', 0),
+        **resultado,
+        **fakes.METRICAS.como_dict()
+    }
+
+
+COLUNAS_TABELA = [
+    ('cenario', 10), ('linhas', 7), ('mb', 6), ('concorrencia', 5), ('lote', 4), ('duracao_s', 8),
+    ('linhas_por_s', 8), ('s_por_mb', 8), ('p50_ms', 8), ('p95_ms', 8), ('p99_ms', 8),
+    ('rss_pico_mb', 8), ('rss_delta_mb', 8), ('bytes_enviados', 12), ('bytes_baixados', 12),
+    ('bytes_publicados', 12), ('throttles', 6), ('erros', 5)
+]
+
+
+def imprimir_linha(resultado: dict = None):
+    if resultado is None:
+        print(' '.join(nome[:largura].rjust(largura) for nome, largura in COLUNAS_TABELA))
+        return
+    print(' '.join(str(resultado.get(nome, '-'))[:largura].rjust(largura) for nome, largura in COLUNAS_TABELA))
+
+
+def lista_inteiros(texto: str) -> list:
+    return [int(valor) for valor in texto.split(',') if valor.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline do pipeline WoW com Vertex AI, Storage e Pub/Sub falsos")
+    parser.add_argument('--cenarios', default='streaming,process,distribuir', help="streaming, process e/ou distribuir")
+    parser.add_argument('--linhas', default='200,1000', help="Tamanhos de arquivo (linhas), separados por vírgula")
+    parser.add_argument('--concorrencia', default='4,8,16', help="Valores de MAX_CONCORRENCIA")
+    parser.add_argument('--lote', default='1', help="Valores de LOTE_MAX_ITENS")
+    parser.add_argument('--latencia-ms', type=float, default=300, help="Mediana da latência do modelo")
+    parser.add_argument('--dispersao', type=float, default=0.5, help="Sigma do log da latência (cauda)")
+    parser.add_argument('--ms-por-1k', type=float, default=20, help="Latência extra por 1000 caracteres enviados")
+    parser.add_argument('--taxa-erro', type=float, default=0.0, help="Fração de chamadas com 503")
+    parser.add_argument('--taxa-throttle', type=float, default=0.0, help="Fração de chamadas com 429")
+    parser.add_argument('--pubsub-latencia-ms', type=float, default=5)
+    parser.add_argument('--max-rps', type=float, default=1000, help="Teto do limitador do Vertex AI")
+    parser.add_argument('--vertex-concorrencia', type=int, default=64, help="Teto global de chamadas em voo")
+    parser.add_argument('--backoff-base', type=float, default=0.05, help="Base do backoff das novas tentativas (s)")
+    parser.add_argument('--duplicadas', type=float, default=0.0, help="Fração de conversas repetidas no CSV")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--saida', help="Arquivo JSON com todos os resultados")
+    parser.add_argument('--verbose', action='store_true', help="Mantém os logs INFO das funções")
+    args = parser.parse_args()
+
+    fakes.instalar(
+        fakes.PerfilLatencia(args.latencia_ms, args.dispersao, args.ms_por_1k, args.taxa_erro, args.taxa_throttle, args.seed),
+        fakes.PerfilLatencia(args.pubsub_latencia_ms, 0.3, seed=args.seed)
+    )
+    os.environ.setdefault('CACHE_BACKEND', 'none')
+    os.environ.setdefault('PROGRESSO_BACKEND', 'memoria')
+
+    cenarios = [nome.strip() for nome in args.cenarios.split(',') if nome.strip()]
+    wow = orquestradora = None
+    if {'streaming', 'process'} & set(cenarios):
+        sys.path.insert(0, os.path.join(RAIZ, 'wow-parser'))
+        wow = carregar_modulo('wow_parser_main', os.path.join(RAIZ, 'wow-parser', 'main.py'))
+        sys.modules['limitador'].BACKOFF_BASE = args.backoff_base
+    if 'distribuir' in cenarios:
+        orquestradora = carregar_modulo('orquestradora_main', os.path.join(RAIZ, 'funcao-orquestradora', 'main.py'))
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger('wow_parser_main').setLevel(logging.WARNING)
+
+    resultados = []
+    imprimir_linha()
+    for linhas in lista_inteiros(args.linhas):
+        dados = gerar_csv(linhas, seed=args.seed, taxa_duplicadas=args.duplicadas)
+        for cenario in cenarios:
+            if cenario == 'distribuir':
+                registro = RegistroLatencias()
+                bucket_nome, nome = preparar_distribuir(orquestradora, dados, f"dist-{linhas}")
+                resultado = rodar(cenario, lambda: cenario_distribuir(orquestradora, bucket_nome, nome, registro),
+                                  registro, dados, linhas, '-', '-')
+                resultados.append(resultado)
+                imprimir_linha(resultado)
+                continue
+            funcao = cenario_streaming if cenario == 'streaming' else cenario_process
+            for concorrencia in lista_inteiros(args.concorrencia):
+                for lote in lista_inteiros(args.lote):
+                    preparar_wow(wow, args, concorrencia, lote)
+                    registro = RegistroLatencias()
+                    desfazer = medir_chamadas_wow(wow, registro)
+                    sessao = f"bench-{cenario}-{linhas}-{concorrencia}-{lote}"
+                    try:
+                        resultado = rodar(cenario, lambda: funcao(wow, dados, sessao, concorrencia, lote),
+                                          registro, dados, linhas, concorrencia, lote, wow.vertex_limiter)
+                    finally:
+                        desfazer()
+                    resultados.append(resultado)
+                    imprimir_linha(resultado)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump({'parametros': vars(args), 'resultados': resultados}, arquivo, ensure_ascii=False, indent=1)
+        print(f"Resultados gravados em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
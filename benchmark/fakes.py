@@ -0,0 +1,437 @@
+"""
+Fakes em processo do Vertex AI (GenerativeModel), do Cloud Storage e do publisher do Pub/Sub,
+usados pelo benchmark offline. Nada aqui sai da máquina nem gasta cota.
+
+`instalar()` registra os fakes em `sys.modules` (google.cloud.storage, google.cloud.pubsub_v1,
+vertexai, vertexai.generative_models) ANTES de importar as funções, que então os usam sem mudança.
+"""
+import io
+import sys
+import json
+import math
+import time
+import zlib
+import types
+import random
+import datetime
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# --- Erros com os mesmos nomes/códigos das bibliotecas do Google (o limitador classifica pelo nome) ---
+
+class ResourceExhausted(Exception):
+    code = 429
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class NotFound(Exception):
+    code = 404
+
+
+# --- Perfis de latência e falhas ---
+
+class PerfilLatencia:
+    """
+    Latência lognormal com mediana `mediana_ms` e espalhamento `dispersao` (sigma do log),
+    mais `ms_por_1k_caracteres` proporcional ao tamanho do conteúdo.
+    `taxa_erro` sorteia erros transitórios (503) e `taxa_throttle` erros de cota (429).
+    """
+
+    def __init__(self, mediana_ms: float = 800, dispersao: float = 0.4, ms_por_1k_caracteres: float = 0,
+                 taxa_erro: float = 0.0, taxa_throttle: float = 0.0, seed: int = None):
+        self.mediana_ms = mediana_ms
+        self.dispersao = dispersao
+        self.ms_por_1k_caracteres = ms_por_1k_caracteres
+        self.taxa_erro = taxa_erro
+        self.taxa_throttle = taxa_throttle
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def amostrar(self, caracteres: int = 0) -> float:
+        """Latência sorteada, em segundos."""
+        with self._lock:
+            fator = math.exp(self._rng.gauss(0, self.dispersao)) if self.dispersao else 1.0
+        return (self.mediana_ms * fator + self.ms_por_1k_caracteres * caracteres / 1000) / 1000
+
+    def sortear_falha(self):
+        """Exceção a levantar nesta chamada (ou None)."""
+        with self._lock:
+            sorteio = self._rng.random()
+        if sorteio < self.taxa_throttle:
+            return ResourceExhausted("429 Quota exceeded (fake)")
+        if sorteio < self.taxa_throttle + self.taxa_erro:
+            return ServiceUnavailable("503 Service unavailable (fake)")
+        return None
+
+
+class MetricasFakes:
+    """Contadores globais dos fakes (bytes copiados, chamadas) para o relatório."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self.bytes_enviados = 0
+            self.bytes_baixados = 0
+            self.bytes_publicados = 0
+            self.mensagens_publicadas = 0
+            self.chamadas_modelo = 0
+            self.falhas_modelo = 0
+
+    def somar(self, campo: str, valor: int = 1):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + valor)
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            return {
+                'bytes_enviados': self.bytes_enviados,
+                'bytes_baixados': self.bytes_baixados,
+                'bytes_publicados': self.bytes_publicados,
+                'mensagens_publicadas': self.mensagens_publicadas,
+                'chamadas_modelo': self.chamadas_modelo,
+                'falhas_modelo': self.falhas_modelo
+            }
+
+
+METRICAS = MetricasFakes()
+
+
+# --- Vertex AI ---
+
+# Distribuição dos rótulos devolvidos (determinística pelo texto, para o cache funcionar)
+DISTRIBUICAO_ROTULOS = [('Normal', 0.70), ('Bom', 0.22), ('WoW', 0.08)]
+MARCADOR_LOTE = 'Interações para Análise:\n'
+
+
+def rotulo_para(texto: str) -> str:
+    posicao = (zlib.crc32(texto.encode('utf-8')) % 10000) / 10000
+    acumulado = 0.0
+    for rotulo, fatia in DISTRIBUICAO_ROTULOS:
+        acumulado += fatia
+        if posicao < acumulado:
+            return rotulo
+    return DISTRIBUICAO_ROTULOS[-1][0]
+
+
+class Part:
+    @staticmethod
+    def from_text(texto: str) -> str:
+        return texto
+
+
+class RespostaFake:
+    def __init__(self, texto: str, tokens_entrada: int):
+        self.text = texto
+        tokens_saida = len(texto) // 4 + 1
+        self.usage_metadata = types.SimpleNamespace(
+            prompt_token_count=tokens_entrada,
+            candidates_token_count=tokens_saida,
+            total_token_count=tokens_entrada + tokens_saida
+        )
+
+
+class FakeGenerativeModel:
+    """Responde no formato que as funções esperam (objeto único ou array do modo em lote)."""
+
+    perfil = PerfilLatencia()
+
+    def __init__(self, nome: str, system_instruction=None, **kwargs):
+        self.nome = nome
+        self.system_instruction = system_instruction
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        texto = ''.join(str(parte) for parte in contents)
+        METRICAS.somar('chamadas_modelo')
+        falha = self.perfil.sortear_falha()
+        time.sleep(self.perfil.amostrar(len(texto)))
+        if falha is not None:
+            METRICAS.somar('falhas_modelo')
+            raise falha
+
+        tokens_entrada = len(texto) // 4 + 1
+        if MARCADOR_LOTE in texto:
+            try:
+                itens = json.loads(texto.split(MARCADOR_LOTE, 1)[1])
+            except ValueError:
+                itens = None
+            if isinstance(itens, list):
+                resposta = [{'id': item['id'], 'raciocinio': 'fake', 'classificacao_final': rotulo_para(item['interacao'])}
+                            for item in itens]
+                return RespostaFake(json.dumps(resposta, ensure_ascii=False), tokens_entrada)
+        resposta = {'raciocinio': 'fake', 'classificacao_final': rotulo_para(texto)}
+        return RespostaFake(json.dumps(resposta, ensure_ascii=False), tokens_entrada)
+
+
+# --- Cloud Storage ---
+
+class _LeitorBlob(io.RawIOBase):
+    def __init__(self, dados: bytes):
+        self._dados = memoryview(dados)
+        self._posicao = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        tamanho = min(len(buffer), len(self._dados) - self._posicao)
+        buffer[:tamanho] = self._dados[self._posicao:self._posicao + tamanho]
+        self._posicao += tamanho
+        METRICAS.somar('bytes_baixados', tamanho)
+        return tamanho
+
+
+class _EscritorBlob(io.RawIOBase):
+    def __init__(self, blob):
+        self._blob = blob
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        dados = bytes(dados)
+        self._partes.append(dados)
+        METRICAS.somar('bytes_enviados', len(dados))
+        return len(dados)
+
+    def close(self):
+        if not self.closed:
+            self._blob._gravar(b''.join(self._partes))
+        super().close()
+
+
+class FakeBlob:
+    def __init__(self, bucket, nome: str):
+        self.bucket = bucket
+        self.name = nome
+        self.content_type = None
+        self.cache_control = None
+
+    def _gravar(self, dados: bytes):
+        with self.bucket._lock:
+            self.bucket._objetos[self.name] = (dados, datetime.datetime.now(datetime.timezone.utc))
+
+    def _dados(self) -> bytes:
+        with self.bucket._lock:
+            if self.name not in self.bucket._objetos:
+                raise NotFound(f"404 {self.bucket.name}/{self.name}")
+            return self.bucket._objetos[self.name][0]
+
+    @property
+    def size(self):
+        return len(self._dados()) if self.exists() else None
+
+    @property
+    def updated(self):
+        with self.bucket._lock:
+            objeto = self.bucket._objetos.get(self.name)
+        return objeto[1] if objeto else None
+
+    @property
+    def public_url(self):
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+    def exists(self) -> bool:
+        with self.bucket._lock:
+            return self.name in self.bucket._objetos
+
+    def reload(self):
+        self._dados()
+
+    def upload_from_string(self, dados, content_type=None, **kwargs):
+        dados = dados.encode('utf-8') if isinstance(dados, str) else bytes(dados)
+        METRICAS.somar('bytes_enviados', len(dados))
+        self._gravar(dados)
+
+    def upload_from_file(self, arquivo, size=None, content_type=None, **kwargs):
+        partes = []
+        while True:
+            bloco = arquivo.read(1024 * 1024)
+            if not bloco:
+                break
+            partes.append(bloco)
+        self.upload_from_string(b''.join(partes))
+
+    def upload_from_filename(self, caminho, content_type=None, **kwargs):
+        with open(caminho, 'rb') as arquivo:
+            self.upload_from_file(arquivo)
+
+    def download_as_bytes(self, start=None, end=None, **kwargs) -> bytes:
+        dados = self._dados()
+        if start is not None or end is not None:
+            dados = dados[start or 0:None if end is None else end + 1]  # `end` inclusivo, como na API
+        METRICAS.somar('bytes_baixados', len(dados))
+        return dados
+
+    def download_as_text(self, encoding='utf-8', **kwargs) -> str:
+        return self.download_as_bytes().decode(encoding)
+
+    def compose(self, fontes):
+        # Compose acontece no servidor: não conta como bytes copiados pela função
+        self._gravar(b''.join(fonte._dados() for fonte in fontes))
+
+    def make_public(self):
+        pass
+
+    def delete(self):
+        with self.bucket._lock:
+            if self.bucket._objetos.pop(self.name, None) is None:
+                raise NotFound(f"404 {self.bucket.name}/{self.name}")
+
+    def open(self, mode='r', encoding=None, newline=None, **kwargs):
+        if 'r' in mode:
+            binario = io.BufferedReader(_LeitorBlob(self._dados()), buffer_size=256 * 1024)
+            return binario if 'b' in mode else io.TextIOWrapper(binario, encoding=encoding or 'utf-8', newline=newline)
+        binario = io.BufferedWriter(_EscritorBlob(self), buffer_size=kwargs.get('chunk_size') or 256 * 1024)
+        return binario if 'b' in mode else io.TextIOWrapper(binario, encoding=encoding or 'utf-8', newline=newline)
+
+
+class FakeBucket:
+    def __init__(self, nome: str):
+        self.name = nome
+        self._objetos = {}
+        self._lock = threading.Lock()
+
+    def blob(self, nome: str, **kwargs) -> FakeBlob:
+        return FakeBlob(self, nome)
+
+    def get_blob(self, nome: str):
+        blob = FakeBlob(self, nome)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix: str = '', **kwargs):
+        with self._lock:
+            nomes = sorted(nome for nome in self._objetos if nome.startswith(prefix or ''))
+        return [FakeBlob(self, nome) for nome in nomes]
+
+
+class FakeStorageClient:
+    """Todos os clientes enxergam os mesmos buckets (como no serviço real)."""
+
+    _buckets = {}
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, nome: str) -> FakeBucket:
+        with self._lock:
+            if nome not in self._buckets:
+                self._buckets[nome] = FakeBucket(nome)
+            return self._buckets[nome]
+
+    get_bucket = bucket
+
+    def list_blobs(self, nome_bucket, prefix: str = '', **kwargs):
+        return self.bucket(nome_bucket).list_blobs(prefix)
+
+
+# --- Pub/Sub ---
+
+class LimitExceededBehavior:
+    IGNORE = 'ignore'
+    BLOCK = 'block'
+    ERROR = 'error'
+
+
+def _tipo(nome: str):
+    def construir(**kwargs):
+        return types.SimpleNamespace(_tipo=nome, **kwargs)
+    construir.__name__ = nome
+    return construir
+
+
+class FakePublisherClient:
+    """Publica de forma assíncrona (futures) com latência sorteada e, se pedido, controle de fluxo BLOCK."""
+
+    perfil = PerfilLatencia(mediana_ms=20, dispersao=0.3)
+
+    def __init__(self, batch_settings=None, publisher_options=None, **kwargs):
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='fake-pubsub')
+        fluxo = getattr(publisher_options, 'flow_control', None)
+        limite = getattr(fluxo, 'message_limit', None)
+        bloquear = getattr(fluxo, 'limit_exceeded_behavior', None) == LimitExceededBehavior.BLOCK
+        self._pendencias = threading.BoundedSemaphore(limite) if limite and bloquear else None
+
+    def topic_path(self, projeto: str, topico: str) -> str:
+        return f"projects/{projeto}/topics/{topico}"
+
+    def _enviar(self, futuro: Future, dados: bytes):
+        falha = self.perfil.sortear_falha()
+        time.sleep(self.perfil.amostrar())
+        if self._pendencias is not None:
+            self._pendencias.release()
+        if falha is not None:
+            futuro.set_exception(falha)
+        else:
+            METRICAS.somar('mensagens_publicadas')
+            METRICAS.somar('bytes_publicados', len(dados))
+            futuro.set_result(str(id(futuro)))
+
+    def publish(self, topico: str, data: bytes, **atributos) -> Future:
+        if self._pendencias is not None:
+            self._pendencias.acquire()
+        futuro = Future()
+        self._executor.submit(self._enviar, futuro, data)
+        return futuro
+
+
+# --- Instalação ---
+
+def _modulo(nome: str, pacote: bool = False):
+    modulo = sys.modules.get(nome)
+    if modulo is None:
+        modulo = types.ModuleType(nome)
+        if pacote:
+            modulo.__path__ = []
+        sys.modules[nome] = modulo
+    return modulo
+
+
+def instalar(perfil_modelo: PerfilLatencia = None, perfil_publisher: PerfilLatencia = None):
+    """Registra os fakes em `sys.modules`; chame antes de importar as funções."""
+    if perfil_modelo is not None:
+        FakeGenerativeModel.perfil = perfil_modelo
+    if perfil_publisher is not None:
+        FakePublisherClient.perfil = perfil_publisher
+
+    google = _modulo('google', pacote=True)
+    cloud = _modulo('google.cloud', pacote=True)
+    google.cloud = cloud
+
+    storage = types.ModuleType('google.cloud.storage')
+    storage.Client = FakeStorageClient
+    storage.Bucket = FakeBucket
+    storage.Blob = FakeBlob
+    sys.modules['google.cloud.storage'] = storage
+    cloud.storage = storage
+
+    pubsub_tipos = types.ModuleType('google.cloud.pubsub_v1.types')
+    pubsub_tipos.BatchSettings = _tipo('BatchSettings')
+    pubsub_tipos.PublisherOptions = _tipo('PublisherOptions')
+    pubsub_tipos.PublishFlowControl = _tipo('PublishFlowControl')
+    pubsub_tipos.LimitExceededBehavior = LimitExceededBehavior
+    pubsub = types.ModuleType('google.cloud.pubsub_v1')
+    pubsub.__path__ = []
+    pubsub.PublisherClient = FakePublisherClient
+    pubsub.types = pubsub_tipos
+    sys.modules['google.cloud.pubsub_v1'] = pubsub
+    sys.modules['google.cloud.pubsub_v1.types'] = pubsub_tipos
+    cloud.pubsub_v1 = pubsub
+
+    vertexai = types.ModuleType('vertexai')
+    vertexai.__path__ = []
+    vertexai.init = lambda **kwargs: None
+    generative_models = types.ModuleType('vertexai.generative_models')
+    generative_models.GenerativeModel = FakeGenerativeModel
+    generative_models.Part = Part
+    vertexai.generative_models = generative_models
+    sys.modules['vertexai'] = vertexai
+    sys.modules['vertexai.generative_models'] = generative_models
@@ -0,0 +1,121 @@
+"""
+Gerador de CSVs sintéticos no formato do `teste.csv` (id, ordered_messages, canal).
+
+Uso:
+    python benchmark/gerar_csv.py --linhas 10000 --saida sintetico.csv
+    python benchmark/gerar_csv.py --mb 20 --duplicadas 0.2 --saida grande.csv
+"""
+import io
+import csv
+import random
+import argparse
+
+FALAS_CLIENTE = [
+    "Oi preciso de ajuda com meu cartão.",
+    "Bom dia quero cancelar minha conta.",
+    "Meu cartão está bloqueado.",
+    "Não reconheço uma compra na fatura.",
+    "Quero aumentar meu limite.",
+    "O aplicativo não abre desde ontem.",
+    "Recebi uma cobrança em duplicidade.",
+    "Mudei de banco.",
+    "Estou comemorando meu aniversário hoje!",
+    "Meu filho nasceu semana passada e quero abrir uma conta para ele.",
+    "Obrigado pela rapidez!",
+    "Obrigado.",
+    "Vocês são demais, resolveram em minutos!",
+    "Ainda não entendi o que aconteceu.",
+]
+
+FALAS_AGENTE = [
+    "Olá! Claro posso te ajudar sim. Qual é o problema?",
+    "Bom dia! Entendo sua solicitação. Posso saber o motivo?",
+    "Vou desbloquear para você agora mesmo.",
+    "Já abri uma contestação, o valor volta em até 5 dias úteis.",
+    "Tudo bem realizarei o cancelamento.",
+    "Parabéns! Que notícia incrível, vou deixar tudo pronto para vocês.",
+    "Sinto muito pelo transtorno, já estou verificando.",
+    "Consegui aumentar seu limite, já está disponível no app.",
+    "Posso ajudar em mais alguma coisa?",
+    "Fico feliz em ajudar! Tenha um ótimo dia.",
+]
+
+CANAIS = [('chat', 0.55), ('telefone', 0.25), ('email', 0.12), ('whatsapp', 0.08)]
+
+
+def _sortear_canal(rng: random.Random) -> str:
+    sorteio, acumulado = rng.random(), 0.0
+    for canal, fatia in CANAIS:
+        acumulado += fatia
+        if sorteio < acumulado:
+            return canal
+    return CANAIS[-1][0]
+
+
+def gerar_conversa(rng: random.Random, turnos_medio: float = 3, quebras: bool = False) -> str:
+    """Conversa alternando 'Cliente:' e 'Agente:' com número de turnos em torno de `turnos_medio`."""
+    turnos = max(1, int(rng.expovariate(1 / turnos_medio)) + 1)
+    falas = []
+    for _ in range(turnos):
+        falas.append(f"Cliente: {rng.choice(FALAS_CLIENTE)}")
+        falas.append(f"Agente: {rng.choice(FALAS_AGENTE)}")
+    return ('\n' if quebras else ' ').join(falas)
+
+
+def gerar_linhas(linhas: int, seed: int = 42, turnos_medio: float = 3, taxa_duplicadas: float = 0.0,
+                 taxa_vazias: float = 0.0, taxa_quebras: float = 0.0):
+    """Gera as linhas (dicts) de forma incremental."""
+    rng = random.Random(seed)
+    anteriores = []
+    for indice in range(1, linhas + 1):
+        if taxa_vazias and rng.random() < taxa_vazias:
+            mensagem = ''
+        elif anteriores and taxa_duplicadas and rng.random() < taxa_duplicadas:
+            # Conversas repetidas (ex.: mensagens automáticas) exercitam o cache de classificações
+            mensagem = rng.choice(anteriores)
+        else:
+            mensagem = gerar_conversa(rng, turnos_medio, rng.random() < taxa_quebras)
+            if len(anteriores) < 1000:
+                anteriores.append(mensagem)
+        yield {'id': indice, 'ordered_messages': mensagem, 'canal': _sortear_canal(rng)}
+
+
+def gerar_csv(linhas: int, **opcoes) -> bytes:
+    """CSV completo em memória (utf-8)."""
+    saida = io.StringIO()
+    writer = csv.DictWriter(saida, fieldnames=['id', 'ordered_messages', 'canal'])
+    writer.writeheader()
+    writer.writerows(gerar_linhas(linhas, **opcoes))
+    return saida.getvalue().encode('utf-8')
+
+
+def linhas_para_mb(mb: float, **opcoes) -> int:
+    """Quantas linhas dão aproximadamente `mb` megabytes (estimado por uma amostra)."""
+    amostra = gerar_csv(500, **opcoes)
+    return max(1, int(mb * 1024 * 1024 / (len(amostra) / 500)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera um CSV sintético no formato do teste.csv")
+    parser.add_argument('--linhas', type=int, help="Quantidade de linhas")
+    parser.add_argument('--mb', type=float, help="Tamanho aproximado em MB (alternativa a --linhas)")
+    parser.add_argument('--turnos', type=float, default=3, help="Média de turnos Cliente/Agente por conversa")
+    parser.add_argument('--duplicadas', type=float, default=0.0, help="Fração de conversas repetidas")
+    parser.add_argument('--vazias', type=float, default=0.0, help="Fração de linhas sem mensagem")
+    parser.add_argument('--quebras', type=float, default=0.0, help="Fração de conversas com quebra de linha dentro do campo")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--saida', default='sintetico.csv')
+    args = parser.parse_args()
+
+    opcoes = {'seed': args.seed, 'turnos_medio': args.turnos, 'taxa_duplicadas': args.duplicadas,
+              'taxa_vazias': args.vazias, 'taxa_quebras': args.quebras}
+    linhas = args.linhas or linhas_para_mb(args.mb or 1, **opcoes)
+    with open(args.saida, 'w', encoding='utf-8', newline='') as arquivo:
+        writer = csv.DictWriter(arquivo, fieldnames=['id', 'ordered_messages', 'canal'])
+        writer.writeheader()
+        writer.writerows(gerar_linhas(linhas, **opcoes))
+    print(f"{linhas} linhas gravadas em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Perfil do cold start do wow-parser: importa `main.py` num processo novo com `python -X importtime`
+e mede o primeiro `GET /` (página servida da memória depois do primeiro pedido).
+
+Relata o tempo total do import, os módulos importados diretamente por `main` que mais pesam e se
+algum SDK pesado (vertexai, google.cloud.storage, ...) foi importado antes de qualquer requisição.
+Sai com código 1 se um SDK pesado aparecer no import ou se o import passar de `--limite-ms`,
+para poder rodar em CI a cada mudança.
+
+Uso (com as dependências do requirements.txt instaladas; não usa os fakes, mede as bibliotecas reais):
+    python benchmark/perfil_importacao.py
+    python benchmark/perfil_importacao.py --top 15 --limite-ms 800 --saida perfil.json
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WOW_PARSER = os.path.join(RAIZ, 'wow-parser')
+
+# Módulos que só devem ser importados na primeira rota que precisa deles
+PROIBIDOS_NO_IMPORT = ('vertexai', 'google.cloud.aiplatform', 'google.cloud.storage', 'grpc', 'brotli', 'pyarrow', 'redis')
+
+# Roda no processo filho: importa o main e serve a página três vezes (primeiro pedido, da memória e revalidação com 304)
+SCRIPT_FILHO = """
+import sys, json, time
+inicio = time.perf_counter()
+import main
+import_s = time.perf_counter() - inicio
+
+class Requisicao:
+    method = 'GET'
+    path = '/'
+    url = '/'
+    def __init__(self, headers):
+        self.headers = headers
+
+tempos = []
+for _ in range(2):
+    inicio = time.perf_counter()
+    corpo, status, headers = main.upload_service(Requisicao({'Accept-Encoding': 'gzip, br'}))
+    tempos.append(time.perf_counter() - inicio)
+inicio = time.perf_counter()
+_, status_304, _ = main.upload_service(Requisicao({'If-None-Match': headers['ETag']}))
+tempos.append(time.perf_counter() - inicio)
+
+carregados = sorted(nome for nome in sys.modules if nome.split('.')[0] in {'vertexai', 'google', 'grpc', 'brotli', 'pyarrow', 'redis'})
+print('@@' + json.dumps({
+    'import_s': import_s, 'primeiro_get_s': tempos[0], 'get_memoria_s': tempos[1], 'get_304_s': tempos[2],
+    'status_304': status_304, 'bytes_pagina': len(corpo), 'content_encoding': headers.get('Content-Encoding'),
+    'modulos_sdk_apos_get': carregados
+}))
+"""
+
+_LINHA_IMPORTTIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def ler_importtime(stderr: str) -> list:
+    """[(módulo, profundidade, self_us, cumulativo_us)] na ordem em que o -X importtime imprime."""
+    modulos = []
+    for linha in stderr.splitlines():
+        casou = _LINHA_IMPORTTIME.match(linha)
+        if casou:
+            self_us, cumulativo_us, recuo, nome = casou.groups()
+            modulos.append((nome, (len(recuo) - 1) // 2, int(self_us), int(cumulativo_us)))
+    return modulos
+
+
+def importados_por_main(modulos: list) -> tuple:
+    """(cumulativo do main, filhos diretos do main, módulos importados até o fim do import do main).
+    O importtime imprime os filhos antes do pai."""
+    for posicao, (nome, profundidade, _, cumulativo) in enumerate(modulos):
+        if nome == 'main':
+            filhos = []
+            for nome_filho, profundidade_filho, self_us, cumulativo_filho in reversed(modulos[:posicao]):
+                if profundidade_filho <= profundidade:
+                    break
+                if profundidade_filho == profundidade + 1:
+                    filhos.append((nome_filho, self_us, cumulativo_filho))
+            return cumulativo, filhos, modulos[:posicao + 1]
+    raise RuntimeError("O módulo 'main' não apareceu no -X importtime")
+
+
+def proibidos_importados(modulos: list, proibidos: tuple) -> list:
+    return sorted({nome for nome, _, _, _ in modulos
+                   if any(nome == p or nome.startswith(p + '.') for p in proibidos)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=10, help='módulos importados pelo main a listar')
+    parser.add_argument('--limite-ms', type=float, default=0, help='falha se o import do main passar disso (0 = sem limite)')
+    parser.add_argument('--saida', help='grava o perfil em JSON')
+    args = parser.parse_args()
+
+    ambiente = dict(os.environ, CACHE_BACKEND=os.environ.get('CACHE_BACKEND', 'none'))
+    processo = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT_FILHO],
+        cwd=WOW_PARSER, env=ambiente, capture_output=True, text=True
+    )
+    if processo.returncode != 0:
+        print(processo.stderr[-4000:], file=sys.stderr)
+        sys.exit(processo.returncode)
+
+    modulos = ler_importtime(processo.stderr)
+    total_us, filhos, ate_main = importados_por_main(modulos)
+    proibidos = proibidos_importados(ate_main, PROIBIDOS_NO_IMPORT)
+    medicoes = json.loads(next(linha[2:] for linha in processo.stdout.splitlines() if linha.startswith('@@')))
+
+    print(f"import main: {total_us / 1000:.1f} ms (medido no processo: {medicoes['import_s'] * 1000:.1f} ms)")
+    print(f"GET /: primeiro {medicoes['primeiro_get_s'] * 1000:.1f} ms, da memória {medicoes['get_memoria_s'] * 1000:.2f} ms, "
+          f"304 {medicoes['get_304_s'] * 1000:.2f} ms ({medicoes['bytes_pagina']} bytes, {medicoes['content_encoding'] or 'sem compressão'})")
+    print(f"\n{'módulo':40} {'cumulativo ms':>14} {'próprio ms':>11}")
+    for nome, self_us, cumulativo_us in sorted(filhos, key=lambda filho: -filho[2])[:args.top]:
+        print(f"{nome:40} {cumulativo_us / 1000:14.1f} {self_us / 1000:11.1f}")
+    print(f"\nSDKs pesados no import: {', '.join(proibidos) or 'nenhum'}")
+    print(f"Módulos de SDK carregados depois do GET /: {', '.join(medicoes['modulos_sdk_apos_get']) or 'nenhum'}")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump({
+                'import_main_ms': total_us / 1000,
+                'modulos': [{'modulo': nome, 'cumulativo_ms': c / 1000, 'proprio_ms': s / 1000} for nome, s, c in filhos],
+                'proibidos_no_import': proibidos,
+                **medicoes
+            }, arquivo, indent=2, ensure_ascii=False)
+
+    falhou = bool(proibidos) or (args.limite_ms and total_us / 1000 > args.limite_ms)
+    sys.exit(1 if falhou else 0)
+
+
+if __name__ == '__main__':
+    main()
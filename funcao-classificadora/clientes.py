@@ -0,0 +1,125 @@
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Tamanho do pool de conexões HTTP compartilhado pelas threads de processamento
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '32'))
+
+# Erros de transporte que justificam descartar o cliente e criar outro na próxima chamada
+ERROS_TRANSPORTE = {
+    'ConnectionError', 'ConnectionResetError', 'ConnectionAbortedError', 'BrokenPipeError',
+    'RemoteDisconnected', 'ProtocolError', 'ChunkedEncodingError', 'SSLError',
+    'TransportError', 'ServiceUnavailable', 'RetryError'
+}
+
+
+def erro_de_transporte(erro: Exception) -> bool:
+    """Indica se o erro veio da camada de conexão (e não da resposta do serviço)."""
+    atual = erro
+    while atual is not None:
+        if type(atual).__name__ in ERROS_TRANSPORTE:
+            return True
+        atual = atual.__cause__ or atual.__context__
+    return False
+
+
+class GerenciadorClientes:
+    """
+    Guarda os clientes do Storage e do Vertex AI do processo e os reaproveita entre requisições e threads.
+    - Cada cliente é criado uma única vez (sob lock) e compartilhado.
+    - O cliente do Storage usa uma sessão HTTP com pool de conexões dimensionado para os workers.
+    - Um cliente só é reconstruído depois que uma chamada falha por erro de transporte.
+    """
+
+    def __init__(self, project: str = None, location: str = None):
+        self.project = project
+        self.location = location
+        self._lock = threading.Lock()
+        self._storage = None
+        self._modelos = {}
+        self._vertex_inicializado = False
+        self._criados = {'storage': 0, 'modelo': 0}
+
+    # --- Storage ---
+
+    def _criar_sessao_http(self):
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+
+        credentials, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+        sessao = AuthorizedSession(credentials)
+        adaptador = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        sessao.mount('https://', adaptador)
+        return credentials, sessao
+
+    def storage(self):
+        """Retorna o cliente do Storage do processo, criando-o se necessário.
+        O atributo é lido uma vez só: um `reportar_falha` concorrente não faz esta chamada devolver None,
+        e a criação (cliente + pool HTTP) só acontece sob o lock, uma vez para todas as threads."""
+        cliente = self._storage
+        if cliente is None:
+            with self._lock:
+                cliente = self._storage
+                if cliente is None:
+                    from google.cloud import storage
+                    try:
+                        credentials, sessao = self._criar_sessao_http()
+                        cliente = storage.Client(project=self.project, credentials=credentials, _http=sessao)
+                    except Exception as e:
+                        logger.warning(f"Sessão HTTP com pool indisponível, usando cliente padrão: {e}")
+                        cliente = storage.Client(project=self.project)
+                    self._storage = cliente
+                    self._criados['storage'] += 1
+                    logger.info(f"Cliente do Storage criado (total no processo: {self._criados['storage']})")
+        return cliente
+
+    # --- Vertex AI ---
+
+    def _inicializar_vertex(self):
+        if not self._vertex_inicializado:
+            import vertexai
+            vertexai.init(project=self.project, location=self.location)
+            self._vertex_inicializado = True
+
+    def modelo(self, nome: str, system_instruction: str):
+        """Retorna o GenerativeModel para (nome, system_instruction), criando-o uma única vez."""
+        chave = (nome, system_instruction)
+        modelo = self._modelos.get(chave)
+        if modelo is None:
+            with self._lock:
+                modelo = self._modelos.get(chave)
+                if modelo is None:
+                    from vertexai.generative_models import GenerativeModel
+                    self._inicializar_vertex()
+                    modelo = GenerativeModel(nome, system_instruction=[system_instruction])
+                    self._modelos[chave] = modelo
+                    self._criados['modelo'] += 1
+                    logger.info(f"Modelo {nome} criado (total no processo: {self._criados['modelo']})")
+        return modelo
+
+    # --- Ciclo de vida ---
+
+    def reportar_falha(self, tipo: str, erro: Exception):
+        """Descarta o cliente de `tipo` ('storage' ou 'modelo') se a falha foi de transporte."""
+        if not erro_de_transporte(erro):
+            return False
+        with self._lock:
+            if tipo == 'storage':
+                self._storage = None
+            elif tipo == 'modelo':
+                self._modelos.clear()
+        logger.warning(f"Falha de transporte no cliente '{tipo}', será recriado na próxima chamada: {erro}")
+        return True
+
+    def contagem(self) -> dict:
+        """Quantos clientes de cada tipo já foram construídos neste processo."""
+        with self._lock:
+            return dict(self._criados)
+
+    def criados_desde(self, contagem_anterior: dict) -> dict:
+        """Clientes construídos desde `contagem_anterior` (use no início e no fim de uma requisição)."""
+        atual = self.contagem()
+        return {tipo: atual[tipo] - contagem_anterior.get(tipo, 0) for tipo in atual}
@@ -0,0 +1,439 @@
+import io
+import os
+import csv
+import json
+import time
+import uuid
+import logging
+import threading
+import argparse
+import traceback
+import functions_framework
+from clientes import GerenciadorClientes
+from limitador import LimitadorVertex
+from lote_classificacao import agrupar_em_lotes, classificar_em_lote, estimar_tokens
+from motor_classificacao import MotorClassificacao
+from resposta_modelo import ESQUEMA_LOTE, ContadorRespostas, RespostaInvalida, config_geracao, normalizar_resultado, obter_resultado
+
+# Configuração de logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+PROJECT_ID = "iteng-itsystems"
+LOCATION = "us-central1"
+MODEL_NAME = "gemini-2.5-flash-lite"
+BUCKET_NAME = os.environ.get('BUCKET_NAME', 'iteng-entrada-analise')
+PUBSUB_SUBSCRIPTION = os.environ.get('PUBSUB_SUBSCRIPTION', 'topico-wow-classificadora')
+PULL_MAX_MENSAGENS = int(os.environ.get('PULL_MAX_MENSAGENS', '200'))    # mensagens por pull
+MICROLOTE_MAX = int(os.environ.get('MICROLOTE_MAX', '20'))               # interações por chamada ao modelo
+TEMPO_MAXIMO_S = int(os.environ.get('TEMPO_MAXIMO_S', '480'))            # para de puxar mensagens depois disso
+ACK_PRAZO_S = int(os.environ.get('ACK_PRAZO_S', '600'))                  # prazo de ack renovado enquanto o pull é classificado
+ACK_RENOVAR_S = int(os.environ.get('ACK_RENOVAR_S', '120'))              # intervalo entre renovações
+ENTREGAS_MAX = int(os.environ.get('ENTREGAS_MAX', '5'))                  # entregas de um item com 'Erro' antes de gravá-lo assim
+RESULTADOS_DIR_LOCAL = os.environ.get('RESULTADOS_DIR_LOCAL', '')        # diretório no lugar do bucket (testes)
+
+# Prefixos usados no bucket
+PREFIXO_RESULTADOS = 'resultados'
+PREFIXO_PROCESSADOS = 'processados'
+
+# Clientes e limitador compartilhados pelo processo
+client_manager = GerenciadorClientes(PROJECT_ID, LOCATION)
+contador_respostas = ContadorRespostas()  # respostas válidas/reparadas/re-pedidas desde o início da instância
+vertex_limiter = LimitadorVertex()
+
+# --- Prompt para Análise (o mesmo do wow-parser) ---
+PROMPT = """
+Atue como um Analista de Qualidade (QA) de Atendimento ao Cliente, sênior e meticuloso.
+Seu objetivo é garantir a consistência e a excelência na avaliação de interações, aplicando os critérios definidos com rigor.
+Tarefa Principal
+    - Analise a Interação para Análise fornecida abaixo e classifique-a em UMA das três categorias a seguir: Normal, Bom ou WoW. Siga o processo de raciocínio e os critérios detalhados.
+        Critérios de Classificação
+        ## Categoria 1: Normal
+            * A interação é puramente informativa ou rotineira.
+            * Não há elementos pessoais ou emocionais significativos.
+            * O agente segue o protocolo padrão sem personalização extra.
+            * A resolução não envolve criatividade ou empatia além do esperado.
+        ## Categoria 2: Bom
+            * O serviço é eficiente e está dentro dos padrões de resolução.
+            * O agente demonstra proatividade, clareza ou paciência notável.
+            * O cliente expressa satisfação, feedback positivo ou sentimentos bons sobre o atendimento.
+        ## Categoria 3: WoW
+            * A interação se destaca por uma conexão humana significativa e única.
+            * Contém elementos pessoais ou demonstração clara de empatia (ex: hobbies, celebrações, interesses em comum).
+            * O agente fornece uma solução criativa ou personalizada que vai além do protocolo padrão, gerando surpresa positiva.
+            * A resolução é inspiradora ou inesperada, resultando em uma experiência diferenciada.
+            * Um momento de vida importante do cliente é mencionado e reconhecido na interação (ex: casamento, aniversário, nascimento de filho, gravidez, conquista pessoal, viagem, mudança de endereço, mudança de nome social, desenvolvimento profissional).
+
+        ### Regra de Exclusão Crítica
+            - Atenção: Interações com temas sensíveis (fraude, golpe, morte, deficiência, flerte) NUNCA devem ser classificadas como Bom ou WoW, mesmo que o atendimento tenha sido excelente. 
+            - Nesses casos, a classificação final deve ser obrigatoriamente Normal.
+
+        ### Processo de Raciocínio (Chain of Thought)
+            - Antes de fornecer a classificação final, siga estes passos mentais:
+            - Análise Inicial: Leia a interação e identifique o problema principal e o tom geral da conversa.
+            - Verificação Sequencial:
+            - A interação se enquadra em Normal? Se sim, sua análise pode parar aqui, a menos que haja algo excepcional.
+            - Se não for Normal, ela atinge os critérios de Bom?
+            - Se for Bom, verifique se existem elementos que a elevam para WoW.
+            - Verificação Final (Obrigatória): A Regra de Exclusão Crítica se aplica a esta interação? Se sim, ignore as análises anteriores e classifique como Normal.
+            - Justificativa: Formule uma breve justificativa para sua escolha com base nos critérios.
+        
+        Formato da Saída
+        Sua resposta sera um objeto JSON contendo dois campos:
+            1 - Raciocinio: Uma breve explicação (1-2 frases) de por que a interação recebeu tal classificação, baseada no seu processo de raciocínio.
+            2 - Classificacao_final: A palavra final: Normal, Bom ou WoW.
+"""
+
+
+class Armazenamento:
+    """Acesso ao bucket de trabalho, ou a um diretório local que faz o papel dele (testes com o emulador)."""
+
+    def __init__(self, bucket=None, diretorio: str = None):
+        self.bucket = bucket
+        self.diretorio = diretorio
+
+    @classmethod
+    def padrao(cls):
+        if RESULTADOS_DIR_LOCAL:
+            return cls(diretorio=RESULTADOS_DIR_LOCAL)
+        return cls(bucket=client_manager.storage().bucket(BUCKET_NAME))
+
+    def _caminho_local(self, nome: str) -> str:
+        return os.path.join(self.diretorio, nome)
+
+    def gravar(self, nome: str, dados: str, content_type: str = 'application/x-ndjson'):
+        if self.bucket is not None:
+            self.bucket.blob(nome).upload_from_string(dados, content_type=content_type)
+            return
+        caminho = self._caminho_local(nome)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            f.write(dados)
+        os.replace(temporario, caminho)
+
+    def listar(self, prefixo: str) -> list:
+        if self.bucket is not None:
+            return sorted(blob.name for blob in self.bucket.list_blobs(prefix=prefixo))
+        base = self._caminho_local(prefixo)
+        if not os.path.isdir(base):
+            return []
+        return sorted(os.path.join(prefixo, nome) for nome in os.listdir(base) if not nome.endswith('.tmp'))
+
+    def ler_texto(self, nome: str) -> str:
+        if self.bucket is not None:
+            return self.bucket.blob(nome).download_as_text(encoding='utf-8')
+        with open(self._caminho_local(nome), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def abrir_leitura(self, nome: str):
+        """Stream binário do objeto (lido sob demanda)."""
+        if self.bucket is not None:
+            return self.bucket.blob(nome).open('rb')
+        return open(self._caminho_local(nome), 'rb')
+
+    def abrir_escrita_csv(self, nome: str):
+        """Stream de texto para gravar um CSV (upload resumível no GCS)."""
+        if self.bucket is not None:
+            return self.bucket.blob(nome).open('w', content_type='text/csv', encoding='utf-8', newline='')
+        caminho = self._caminho_local(nome)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        return open(caminho, 'w', encoding='utf-8', newline='')
+
+
+# --- Classificação ---
+
+def classificar_microlote(itens: list) -> dict:
+    """
+    Classifica [(id, texto)] com uma chamada ao Gemini por micro-lote e retorna {id: resultado}.
+    As chamadas usam `response_schema`; cada resultado sai canônico do parser de `resposta_modelo`
+    e um item com rótulo inválido é refeito sozinho.
+    """
+    from vertexai.generative_models import Part
+    model = client_manager.modelo(MODEL_NAME, PROMPT)
+
+    def gerar(conteudo, esquema=ESQUEMA_LOTE):
+        try:
+            response = vertex_limiter.executar(lambda: model.generate_content(
+                [Part.from_text(conteudo)],
+                generation_config=config_geracao(esquema)
+            ))
+            return response.text
+        except Exception as e:
+            client_manager.reportar_falha('modelo', e)
+            raise
+
+    individuais = set()  # resultados que já vieram de classificar_um (canônicos e contados)
+
+    def classificar_um(texto):
+        try:
+            resultado = obter_resultado(lambda: gerar(f"Interação para Análise: {texto}", esquema=None), contador_respostas)
+        except Exception as e:
+            logger.error(f"Erro Gemini: {e}")
+            resultado = {"raciocinio": "Erro no processamento da IA", "classificacao_final": "Erro"}
+        individuais.add(id(resultado))
+        return resultado
+
+    resultados = classificar_em_lote(itens, gerar, classificar_um, contador_respostas)
+    textos = dict(itens)
+    for id_item, resultado in resultados.items():
+        if id(resultado) in individuais:
+            continue
+        try:
+            resultados[id_item] = normalizar_resultado(resultado)
+            contador_respostas.registrar('valida')
+        except RespostaInvalida as e:
+            logger.warning(f"LOTE - Item {id_item} com resposta inválida, refazendo sozinho: {e}")
+            contador_respostas.registrar('repedida')
+            resultados[id_item] = classificar_um(textos[id_item])
+    return resultados
+
+
+# --- Consumo da fila ---
+
+def _arquivo_da_mensagem(payload: dict) -> str:
+    # Mensagens antigas do orquestrador não têm 'arquivo': o id é "{arquivo}-{n}"
+    return payload.get('arquivo') or payload['id'].rsplit('-', 1)[0]
+
+def processar_mensagens(recebidas: list, armazenamento: Armazenamento, classificar=None) -> tuple:
+    """
+    Classifica as mensagens recebidas em micro-lotes e grava um shard JSONL por micro-lote em
+    `resultados/{arquivo}/`. Retorna (ack_ids confirmáveis, ack_ids para reentrega, totais).
+    Uma mensagem só entra na lista de ack depois que o shard com o seu resultado foi gravado.
+    Item com 'Erro' (ex.: 429/5xx do modelo) fica fora do shard e volta para a fila, até a mensagem
+    chegar a ENTREGAS_MAX entregas: daí em diante o 'Erro' é gravado no shard e a mensagem confirmada.
+    O número de entregas vem de `delivery_attempt`, que o Pub/Sub só preenche quando a assinatura tem
+    política de dead-letter (sem ela o item é reentregue até dar certo).
+    """
+    classificar = classificar or classificar_microlote
+    totais = {'classificadas': 0, 'descartadas': 0, 'shards': 0, 'falhas': 0, 'esgotadas': 0}
+    confirmar, reentregar = [], []
+    entregas = {}  # ack_id -> delivery_attempt
+
+    # Separar por arquivo de origem; payload inválido é confirmado (não adianta reentregar)
+    por_arquivo = {}
+    for recebida in recebidas:
+        try:
+            payload = json.loads(recebida.message.data.decode('utf-8'))
+            item = (payload['id'], payload['ordered_messages'], recebida.ack_id)
+            por_arquivo.setdefault(_arquivo_da_mensagem(payload), []).append(item)
+            entregas[recebida.ack_id] = getattr(recebida, 'delivery_attempt', 0) or 0
+        except Exception as e:
+            logger.error(f"Mensagem inválida descartada ({recebida.message.message_id}): {e}")
+            confirmar.append(recebida.ack_id)
+            totais['descartadas'] += 1
+
+    lotes = []
+    for arquivo, itens in por_arquivo.items():
+        for lote in agrupar_em_lotes(itens, lambda item: estimar_tokens(item[1]), max_itens=MICROLOTE_MAX):
+            lotes.append((arquivo, lote))
+
+    def classificar_e_gravar(entrada):
+        """Grava o shard com os resultados válidos e os esgotados; retorna (nome do shard ou None, ids com erro, ids esgotados)."""
+        arquivo, lote = entrada
+        resultados = classificar([(id_item, texto) for id_item, texto, _ in lote])
+        linhas, com_erro, esgotados = [], set(), set()
+        for id_item, _, ack_id in lote:
+            resultado = resultados.get(id_item)
+            if not resultado or resultado.get('classificacao_final') == 'Erro':
+                if entregas[ack_id] < ENTREGAS_MAX:
+                    # Sem gravar: um 'Erro' no shard seria confirmado e perderia a linha de vez
+                    com_erro.add(id_item)
+                    continue
+                # Entregas esgotadas: grava o 'Erro' para a linha parar de voltar para a fila
+                resultado = resultado or {'raciocinio': 'Erro no processamento da IA', 'classificacao_final': 'Erro'}
+                esgotados.add(id_item)
+            linhas.append(json.dumps({'id': id_item, **resultado}, ensure_ascii=False))
+        if not linhas:
+            return None, com_erro, esgotados
+        nome = f"{PREFIXO_RESULTADOS}/{arquivo}/shard-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.jsonl"
+        armazenamento.gravar(nome, '\n'.join(linhas) + '\n')
+        return nome, com_erro, esgotados
+
+    motor = MotorClassificacao()
+    executar = lambda entrada: _tentar(classificar_e_gravar, entrada)
+    for (arquivo, lote), (gravado, erro) in motor.mapear(executar, lotes):
+        if erro is None:
+            nome, com_erro, esgotados = gravado
+            for id_item, _, ack_id in lote:
+                (reentregar if id_item in com_erro else confirmar).append(ack_id)
+            totais['classificadas'] += len(lote) - len(com_erro) - len(esgotados)
+            totais['falhas'] += len(com_erro)
+            totais['esgotadas'] += len(esgotados)
+            totais['shards'] += 1 if nome else 0
+            if com_erro:
+                logger.warning(f"{len(com_erro)} itens de {arquivo} com erro do modelo serão reentregues")
+            if esgotados:
+                logger.error(f"FILA - {len(esgotados)} itens de {arquivo} gravados como 'Erro' após {ENTREGAS_MAX} entregas")
+        else:
+            logger.error(f"Falha ao classificar/gravar micro-lote de {arquivo}, mensagens serão reentregues: {erro}")
+            reentregar.extend(ack_id for _, _, ack_id in lote)
+            totais['falhas'] += len(lote)
+    return confirmar, reentregar, totais
+
+def _tentar(funcao, entrada):
+    try:
+        return funcao(entrada), None
+    except Exception as e:
+        return None, e
+
+class RenovadorPrazo:
+    """
+    Renova o prazo de ack das mensagens de um pull enquanto elas são classificadas, para uma chamada
+    lenta ao modelo não estourar o prazo da assinatura e gerar entrega duplicada.
+    """
+
+    def __init__(self, subscriber, subscription_path: str, ack_ids: list):
+        self.subscriber = subscriber
+        self.subscription_path = subscription_path
+        self.ack_ids = ack_ids
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._renovar, name='renovador-ack', daemon=True)
+
+    def _renovar(self):
+        while not self._parar.wait(ACK_RENOVAR_S):
+            try:
+                self.subscriber.modify_ack_deadline(
+                    request={"subscription": self.subscription_path, "ack_ids": self.ack_ids, "ack_deadline_seconds": ACK_PRAZO_S}
+                )
+            except Exception as e:
+                logger.warning(f"FILA - Falha ao renovar o prazo de ack de {len(self.ack_ids)} mensagens: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+def consumir_fila(armazenamento: Armazenamento, subscriber=None, prazo: float = None, classificar=None) -> dict:
+    """
+    Puxa mensagens da assinatura do topico-wow até a fila esvaziar ou o prazo acabar.
+    Funciona com o emulador do Pub/Sub quando PUBSUB_EMULATOR_HOST está definido.
+    """
+    if subscriber is None:
+        from google.cloud import pubsub_v1
+        subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = subscriber.subscription_path(PROJECT_ID, PUBSUB_SUBSCRIPTION)
+    prazo = prazo or time.time() + TEMPO_MAXIMO_S
+    totais = {'classificadas': 0, 'descartadas': 0, 'shards': 0, 'falhas': 0, 'esgotadas': 0, 'pulls': 0}
+
+    while time.time() < prazo:
+        response = subscriber.pull(
+            request={"subscription": subscription_path, "max_messages": PULL_MAX_MENSAGENS},
+            timeout=30
+        )
+        totais['pulls'] += 1
+        if not response.received_messages:
+            break
+
+        ack_ids = [recebida.ack_id for recebida in response.received_messages]
+        with RenovadorPrazo(subscriber, subscription_path, ack_ids):
+            confirmar, reentregar, parciais = processar_mensagens(response.received_messages, armazenamento, classificar)
+        for chave, valor in parciais.items():
+            totais[chave] += valor
+
+        if confirmar:
+            subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": confirmar})
+        if reentregar:
+            # Prazo zero: a mensagem volta para a fila imediatamente
+            subscriber.modify_ack_deadline(
+                request={"subscription": subscription_path, "ack_ids": reentregar, "ack_deadline_seconds": 0}
+            )
+        logger.info(f"FILA - {totais['classificadas']} classificadas, {totais['falhas']} para reentrega")
+
+    totais.update(contador_respostas.como_dict())
+    totais.update(vertex_limiter.estado())
+    return totais
+
+
+# --- Junção dos shards ---
+
+def juntar_resultados(arquivo: str, armazenamento: Armazenamento) -> dict:
+    """
+    Monta `processados/processado_{arquivo}` a partir do CSV original e dos shards em `resultados/{arquivo}/`.
+    O id de cada linha segue a regra do orquestrador: "{arquivo}-{n}", com n contando só as linhas com mensagem.
+    Em caso de entrega duplicada vale o último resultado gravado.
+    """
+    resultados = {}
+    shards = armazenamento.listar(f"{PREFIXO_RESULTADOS}/{arquivo}/")
+    for nome in shards:
+        for linha in armazenamento.ler_texto(nome).splitlines():
+            if linha.strip():
+                registro = json.loads(linha)
+                resultados[registro['id']] = (registro.get('raciocinio', ''), registro.get('classificacao_final', 'Erro'))
+
+    destino = f"{PREFIXO_PROCESSADOS}/processado_{os.path.basename(arquivo)}"
+    totais = {'shards': len(shards), 'linhas': 0, 'com_resultado': 0, 'sem_resultado': 0, 'destino': destino}
+
+    with armazenamento.abrir_leitura(arquivo) as entrada:
+        csv_reader = csv.DictReader(io.TextIOWrapper(entrada, encoding='utf-8-sig', newline=''))
+        fieldnames = list(csv_reader.fieldnames or []) + ['raciocinio', 'classificacao_final']
+        saida = armazenamento.abrir_escrita_csv(destino)
+        csv_writer = csv.DictWriter(saida, fieldnames=fieldnames)
+        csv_writer.writeheader()
+
+        count = 0
+        for row in csv_reader:
+            totais['linhas'] += 1
+            if row.get('ordered_messages'):
+                resultado = resultados.get(f"{arquivo}-{count}")
+                count += 1
+                if resultado:
+                    row['raciocinio'], row['classificacao_final'] = resultado
+                    totais['com_resultado'] += 1
+                else:
+                    row['raciocinio'], row['classificacao_final'] = 'Sem resultado', 'Pendente'
+                    totais['sem_resultado'] += 1
+            else:
+                row['raciocinio'] = 'Sem mensagem para analisar'
+                row['classificacao_final'] = 'N/A'
+            csv_writer.writerow(row)
+        saida.close()
+
+    logger.info(f"JUNÇÃO - {destino}: {totais['com_resultado']} com resultado, {totais['sem_resultado']} pendentes")
+    return totais
+
+
+# --- Funções das Cloud Functions ---
+
+@functions_framework.http
+def classificar_fila(request):
+    """
+    Função HTTP (acionada pelo Cloud Scheduler) que consome o topico-wow em micro-lotes.
+    - POST '/' ou '/consumir': puxa e classifica mensagens até esvaziar a fila ou acabar o tempo.
+    - POST '/juntar' com {"arquivo": "..."}: monta o CSV processado a partir dos shards.
+    """
+    headers = {'Content-Type': 'application/json'}
+    try:
+        armazenamento = Armazenamento.padrao()
+        if 'juntar' in request.path:
+            request_json = request.get_json(silent=True) or {}
+            if 'arquivo' not in request_json:
+                return (json.dumps({'success': False, 'message': 'O campo "arquivo" é obrigatório.'}), 400, headers)
+            totais = juntar_resultados(request_json['arquivo'], armazenamento)
+        else:
+            totais = consumir_fila(armazenamento)
+        return (json.dumps({'success': True, **totais}), 200, headers)
+    except Exception as e:
+        logger.error(f"Erro no consumidor: {e}")
+        logger.error(traceback.format_exc())
+        return (json.dumps({'success': False, 'message': str(e)}), 500, headers)
+
+
+if __name__ == '__main__':
+    # Execução local, ex. com o emulador:
+    #   PUBSUB_EMULATOR_HOST=localhost:8085 RESULTADOS_DIR_LOCAL=/tmp/wow python main.py consumir
+    #   RESULTADOS_DIR_LOCAL=/tmp/wow python main.py juntar uploads/arquivo.csv
+    parser = argparse.ArgumentParser(description='Consumidor do topico-wow')
+    parser.add_argument('acao', choices=['consumir', 'juntar'])
+    parser.add_argument('arquivo', nargs='?')
+    args = parser.parse_args()
+
+    armazenamento = Armazenamento.padrao()
+    if args.acao == 'juntar':
+        print(json.dumps(juntar_resultados(args.arquivo, armazenamento), ensure_ascii=False))
+    else:
+        print(json.dumps(consumir_fila(armazenamento), ensure_ascii=False))
@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+RESPOSTA_ESQUEMA = os.environ.get('RESPOSTA_ESQUEMA', '1') == '1'                 # envia response_schema ao modelo
+RESPOSTA_MAX_REPEDIDOS = int(os.environ.get('RESPOSTA_MAX_REPEDIDOS', '1'))       # novas chamadas para uma resposta inválida
+
+# Rótulos aceitos (o enum do esquema) e a forma canônica de cada um
+ROTULOS_VALIDOS = ('Normal', 'Bom', 'WoW')
+_ROTULOS = {rotulo.lower(): rotulo for rotulo in ROTULOS_VALIDOS}
+
+# Nomes de campo que o modelo devolve fora do padrão (comparados sem acento/caixa)
+_CAMPOS = {
+    'raciocinio': 'raciocinio', 'justificativa': 'raciocinio', 'explicacao': 'raciocinio',
+    'classificacao_final': 'classificacao_final', 'classificacao': 'classificacao_final',
+    'categoria': 'classificacao_final', 'rotulo': 'classificacao_final'
+}
+
+ESQUEMA_RESPOSTA = {
+    'type': 'object',
+    'properties': {
+        'raciocinio': {'type': 'string'},
+        'classificacao_final': {'type': 'string', 'enum': list(ROTULOS_VALIDOS)}
+    },
+    'required': ['raciocinio', 'classificacao_final']
+}
+
+# Modo em lote: um array com um objeto por interação, identificado pelo id recebido
+ESQUEMA_LOTE = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {'id': {'type': 'string'}, **ESQUEMA_RESPOSTA['properties']},
+        'required': ['id', 'raciocinio', 'classificacao_final']
+    }
+}
+
+_CERCA = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.IGNORECASE)
+_VIRGULA_FINAL = re.compile(r',\s*([}\]])')
+_FECHAMENTOS = {'{': '}', '[': ']'}
+_ROTULO_NO_TEXTO = re.compile(r'classificacao[\s_]*final\W{0,5}(normal|bom|wow)\b')
+_PALAVRA_ROTULO = re.compile(r'\b(normal|bom|wow)\b')
+
+
+class RespostaInvalida(ValueError):
+    """A resposta do modelo não virou um resultado válido nem depois do reparo."""
+
+
+def config_geracao(esquema: dict = None) -> dict:
+    """generation_config das chamadas: JSON e, com RESPOSTA_ESQUEMA, o esquema com o enum dos rótulos."""
+    config = {'response_mime_type': 'application/json'}
+    if RESPOSTA_ESQUEMA:
+        config['response_schema'] = esquema or ESQUEMA_RESPOSTA
+    return config
+
+
+def _sem_acento(texto: str) -> str:
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def normalizar_classificacao(valor):
+    """'WOW', ' wow. ', 'WoW (excepcional)' -> 'WoW'; None se não der para decidir um único rótulo."""
+    chave = _sem_acento(str(valor or '')).strip(' .!"\'')
+    if chave in _ROTULOS:
+        return _ROTULOS[chave]
+    encontrados = set(_PALAVRA_ROTULO.findall(chave))
+    return _ROTULOS[encontrados.pop()] if len(encontrados) == 1 else None
+
+
+def normalizar_resultado(dados) -> dict:
+    """
+    {'raciocinio', 'classificacao_final'} canônico a partir do objeto devolvido pelo modelo:
+    campos sem diferença de caixa/acento ('Classificacao_final', 'Raciocínio') e rótulo do enum.
+    Levanta RespostaInvalida se não houver rótulo reconhecível.
+    """
+    if isinstance(dados, list) and len(dados) == 1:
+        dados = dados[0]
+    if not isinstance(dados, dict):
+        raise RespostaInvalida(f"Resposta não é um objeto JSON: {type(dados).__name__}")
+    campos = {}
+    for chave, valor in dados.items():
+        nome = _CAMPOS.get(re.sub(r'[\s\-]+', '_', _sem_acento(str(chave)).strip()))
+        if nome and nome not in campos:
+            campos[nome] = valor
+    rotulo = normalizar_classificacao(campos.get('classificacao_final'))
+    if rotulo is None:
+        raise RespostaInvalida(f"Classificação fora de {ROTULOS_VALIDOS}: {campos.get('classificacao_final')!r}")
+    return {'raciocinio': str(campos.get('raciocinio') or ''), 'classificacao_final': rotulo}
+
+
+def resultado_do_cache(valor):
+    """
+    Resultado lido do cache passado pelo mesmo parser das respostas: entradas gravadas antes do esquema
+    ('WOW', 'wow', 'Classificacao_final') saem canônicas; inválidas contam como ausentes (None).
+    """
+    if valor is None:
+        return None
+    try:
+        return normalizar_resultado(valor)
+    except RespostaInvalida:
+        return None
+
+
+def reparar_json(texto: str, abertura: str = '{'):
+    """
+    Tenta recuperar o JSON de uma resposta malformada: cercas ```json, texto em volta e vírgulas sobrando.
+    `abertura='['` procura um array (resposta em lote) em vez de um objeto.
+    """
+    texto = _CERCA.sub('', texto or '')
+    inicio, fim = texto.find(abertura), texto.rfind(_FECHAMENTOS[abertura])
+    if inicio >= 0 and fim > inicio:
+        trecho = _VIRGULA_FINAL.sub(r'\1', texto[inicio:fim + 1])
+        try:
+            return json.loads(trecho)
+        except ValueError:
+            pass
+    # Último recurso: o rótulo escrito no texto ("Classificação final: WoW")
+    encontrado = _ROTULO_NO_TEXTO.search(_sem_acento(texto))
+    if encontrado:
+        return {'raciocinio': '', 'classificacao_final': encontrado.group(1)}
+    raise RespostaInvalida(f"Resposta sem JSON reconhecível: {texto[:200]!r}")
+
+
+def interpretar_resposta(texto: str) -> tuple:
+    """(resultado canônico, reparado). Caminho rápido: json.loads direto; o reparo só roda se ele falhar."""
+    try:
+        dados = json.loads(texto)
+        reparado = False
+    except (TypeError, ValueError):
+        dados = reparar_json(texto)
+        reparado = True
+    try:
+        return normalizar_resultado(dados), reparado
+    except RespostaInvalida:
+        if reparado:
+            raise
+        # JSON válido, mas sem o rótulo nos campos esperados: o reparo pelo texto ainda pode achar
+        return normalizar_resultado(reparar_json(texto)), True
+
+
+class ContadorRespostas:
+    """Respostas válidas de primeira, reparadas, re-pedidas ao modelo e perdidas de uma execução."""
+
+    def __init__(self, ao_registrar=None):
+        self._lock = threading.Lock()
+        self.ao_registrar = ao_registrar  # ex.: contador de processo exportado em /metrics
+        self.contagens = {'valida': 0, 'reparada': 0, 'repedida': 0, 'invalida': 0}
+
+    def registrar(self, tipo: str):
+        with self._lock:
+            self.contagens[tipo] += 1
+        if self.ao_registrar:
+            self.ao_registrar(tipo)
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            c = dict(self.contagens)
+        respostas = c['valida'] + c['reparada'] + c['invalida']
+        return {
+            'responses_valid': c['valida'],
+            'responses_repaired': c['reparada'],
+            'responses_rerequested': c['repedida'],
+            'responses_invalid': c['invalida'],
+            'rerequest_rate': round(c['repedida'] / respostas, 4) if respostas else 0
+        }
+
+
+def obter_resultado(gerar, contador: ContadorRespostas = None, max_repedidos: int = None) -> dict:
+    """
+    Chama `gerar()` (texto da resposta do modelo) e devolve o resultado canônico.
+    Uma resposta inválida é reparada antes de qualquer nova chamada; só se o reparo falhar o modelo é
+    chamado de novo (até `max_repedidos` vezes). Levanta RespostaInvalida se nenhuma tentativa servir.
+    """
+    max_repedidos = RESPOSTA_MAX_REPEDIDOS if max_repedidos is None else max_repedidos
+    for tentativa in range(max_repedidos + 1):
+        texto = gerar()
+        try:
+            resultado, reparado = interpretar_resposta(texto)
+        except RespostaInvalida as e:
+            if tentativa < max_repedidos:
+                logger.warning(f"RESPOSTA - Inválida, pedindo de novo ({tentativa + 1}/{max_repedidos}): {e}")
+                if contador:
+                    contador.registrar('repedida')
+                continue
+            if contador:
+                contador.registrar('invalida')
+            raise
+        if contador:
+            contador.registrar('reparada' if reparado else 'valida')
+        return resultado
@@ -0,0 +1,89 @@
+import json
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import main
+from lote_classificacao import classificar_em_lote
+from resposta_modelo import ContadorRespostas
+
+
+def recebida(indice: int, arquivo: str = 'uploads/a.csv', entregas: int = 1):
+    """Mensagem do Pub/Sub no formato publicado pelo orquestrador."""
+    payload = {'id': f"{arquivo}-{indice}", 'arquivo': arquivo, 'ordered_messages': f"Cliente: mensagem {indice}"}
+    return SimpleNamespace(ack_id=f"ack-{indice}", delivery_attempt=entregas,
+                           message=SimpleNamespace(data=json.dumps(payload).encode('utf-8'), message_id=str(indice)))
+
+def classificar_com_erro_no_1(itens):
+    return {id_item: {'raciocinio': 'ok', 'classificacao_final': 'Erro' if id_item.endswith('-1') else 'Bom'}
+            for id_item, _ in itens}
+
+
+class ProcessarMensagensTest(unittest.TestCase):
+
+    def setUp(self):
+        self.armazenamento = main.Armazenamento(diretorio=tempfile.mkdtemp())
+
+    def test_falha_do_microlote_reentrega_sem_confirmar(self):
+        def classificar(itens):
+            raise RuntimeError('503 do modelo')
+
+        confirmar, reentregar, totais = main.processar_mensagens([recebida(i) for i in range(3)], self.armazenamento, classificar)
+
+        self.assertEqual(confirmar, [])
+        self.assertEqual(sorted(reentregar), ['ack-0', 'ack-1', 'ack-2'])
+        self.assertEqual(totais['falhas'], 3)
+        self.assertEqual(self.armazenamento.listar('resultados/uploads/a.csv/'), [])
+
+    def test_erro_do_modelo_reentrega_so_o_item(self):
+        confirmar, reentregar, totais = main.processar_mensagens([recebida(i) for i in range(3)], self.armazenamento, classificar_com_erro_no_1)
+
+        self.assertEqual(sorted(confirmar), ['ack-0', 'ack-2'])
+        self.assertEqual(reentregar, ['ack-1'])
+        self.assertEqual((totais['classificadas'], totais['falhas'], totais['shards']), (2, 1, 1))
+
+    def test_erro_apos_entregas_maximas_e_gravado_e_confirmado(self):
+        recebidas = [recebida(0), recebida(1, entregas=main.ENTREGAS_MAX)]
+
+        confirmar, reentregar, totais = main.processar_mensagens(recebidas, self.armazenamento, classificar_com_erro_no_1)
+
+        self.assertEqual(sorted(confirmar), ['ack-0', 'ack-1'])
+        self.assertEqual(reentregar, [])
+        self.assertEqual((totais['classificadas'], totais['esgotadas']), (1, 1))
+        shard, = self.armazenamento.listar('resultados/uploads/a.csv/')
+        linhas = [json.loads(linha) for linha in self.armazenamento.ler_texto(shard).splitlines()]
+        self.assertIn({'id': 'uploads/a.csv-1', 'raciocinio': 'ok', 'classificacao_final': 'Erro'}, linhas)
+
+
+class ClassificarEmLoteTest(unittest.TestCase):
+
+    def test_resposta_em_cerca_com_virgula_sobrando_e_reparada_sem_repedir(self):
+        chamadas = []
+        def gerar(conteudo):
+            chamadas.append(conteudo)
+            return '```json\n[{"id": "1", "raciocinio": "ok", "classificacao_final": "Bom"},\n {"id": "2", "raciocinio": "ok", "classificacao_final": "WoW"},]\n```'
+        contador = ContadorRespostas()
+
+        resultados = classificar_em_lote([('1', 'a'), ('2', 'b')], gerar, self.fail, contador)
+
+        self.assertEqual(len(chamadas), 1)
+        self.assertEqual({i: r['classificacao_final'] for i, r in resultados.items()}, {'1': 'Bom', '2': 'WoW'})
+        self.assertEqual(contador.contagens['repedida'], 0)
+
+    def test_divisao_e_reenvio_contam_como_repedida(self):
+        def gerar(conteudo):
+            if '"id": "3"' in conteudo:
+                return 'sem JSON nenhum'
+            return '[{"id": "1", "raciocinio": "ok", "classificacao_final": "Bom"}]'
+        contador = ContadorRespostas()
+
+        resultados = classificar_em_lote([('1', 'a'), ('2', 'b'), ('3', 'c')], gerar,
+                                         lambda texto: {'raciocinio': 'só', 'classificacao_final': 'Normal'}, contador)
+
+        self.assertEqual(set(resultados), {'1', '2', '3'})
+        # o lote [1, 2, 3] e a metade [2, 3] vêm sem JSON e são divididos
+        self.assertEqual(contador.contagens['repedida'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
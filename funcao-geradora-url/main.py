@@ -1,17 +1,174 @@
+import os
+import math
 import datetime
 import json
-from google.cloud import storage
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import functions_framework
+from clientes import GerenciadorClientes
+
+logger = logging.getLogger(__name__)
 
 # --- Variáveis de Configuração ---
 # O bucket para onde os arquivos serão enviados pelo frontend.
-BUCKET_NAME = "iteng-entrada-analise" 
+BUCKET_NAME = "iteng-entrada-analise"
+PARTE_MB = int(os.environ.get('PARTE_MB', '32'))                    # acima disso o arquivo é enviado em partes paralelas
+CHUNK_MB = int(os.environ.get('CHUNK_MB', '8'))                     # bloco de cada PUT da sessão resumível (múltiplo de 256KB)
+MAX_ARQUIVOS_LOTE = int(os.environ.get('MAX_ARQUIVOS_LOTE', '100'))
+ASSINATURA_PARALELISMO = int(os.environ.get('ASSINATURA_PARALELISMO', '8'))
+COMPOSE_MAX_FONTES = 32  # limite do compose do GCS: também é o máximo de partes por arquivo
+QUANTUM_RESUMIVEL = 256 * 1024  # blocos de uma sessão resumível (exceto o último) são múltiplos disso
+PREFIXO_UPLOADS = 'uploads/'     # sessões resumíveis e compose só gravam sob este prefixo
+
+# Cliente do Storage criado uma vez e reaproveitado entre requisições
+client_manager = GerenciadorClientes()
+
+# --- Credenciais de assinatura ---
+# Na Cloud Function não há chave privada: as URLs V4 são assinadas pelo IAM (signBlob) com o
+# e-mail da conta de serviço e um access token. As credenciais ficam no processo e só são
+# renovadas quando o token expira, em vez de uma busca a cada requisição.
+_credenciais = None
+_credenciais_lock = threading.Lock()
+
+
+def credenciais_assinatura() -> dict:
+    """Argumentos extras do generate_signed_url: vazio quando as credenciais têm chave própria e assinam localmente."""
+    global _credenciais
+    from google.auth.credentials import Signing
+    with _credenciais_lock:
+        if _credenciais is None:
+            import google.auth
+            _credenciais, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+        if isinstance(_credenciais, Signing):
+            return {}
+        if not _credenciais.valid:
+            from google.auth.transport.requests import Request
+            _credenciais.refresh(Request())
+        return {'service_account_email': _credenciais.service_account_email, 'access_token': _credenciais.token}
+
+
+def assinar(blob, method: str, content_type: str, expiracao_min: int = 15) -> str:
+    return blob.generate_signed_url(
+        version="v4",
+        expiration=datetime.timedelta(minutes=expiracao_min),
+        method=method,
+        content_type=content_type,
+        **credenciais_assinatura()
+    )
+
+
+def erro_nome_objeto(file_name, exigir_prefixo: bool = True):
+    """Mensagem de erro para um `fileName` inválido (None se válido): sem `/` inicial, sem segmentos `.`/`..`
+    ou vazios e, nos modos de lote e compose, dentro de `uploads/`."""
+    if not isinstance(file_name, str) or not file_name:
+        return '"fileName" é obrigatório.'
+    if file_name.startswith('/') or '\\' in file_name or any(ord(c) < 32 for c in file_name):
+        return f'"fileName" inválido: {file_name!r}'
+    if any(segmento in ('', '.', '..') for segmento in file_name.split('/')):
+        return f'"fileName" não pode ter segmentos vazios, "." ou "..": {file_name!r}'
+    if exigir_prefixo and not file_name.startswith(PREFIXO_UPLOADS):
+        return f'"fileName" deve estar em {PREFIXO_UPLOADS}: {file_name!r}'
+    return None
+
+
+def inteiro_positivo(valor):
+    """`valor` como int > 0, ou None se não for numérico (ex.: "abc", 1.5) ou não for positivo."""
+    if isinstance(valor, bool):
+        return None
+    try:
+        numero = int(str(valor).strip())
+    except (TypeError, ValueError):
+        return None
+    return numero if numero > 0 else None
+
+
+def erro_pedido(request_json: dict):
+    """Valida o pedido antes de tocar no Storage; devolve a mensagem do 400 ou None."""
+    if 'files' in request_json:
+        arquivos = request_json['files']
+        if not isinstance(arquivos, list) or not arquivos or len(arquivos) > MAX_ARQUIVOS_LOTE:
+            return f'"files" deve ser uma lista com 1 a {MAX_ARQUIVOS_LOTE} arquivos.'
+        for arquivo in arquivos:
+            if not isinstance(arquivo, dict) or inteiro_positivo(arquivo.get('size')) is None:
+                return 'Cada arquivo precisa de "fileName" e de um "size" inteiro positivo.'
+            erro = erro_nome_objeto(arquivo.get('fileName'))
+            if erro:
+                return erro
+        return None
+    if 'compose' in request_json:
+        pedido = request_json['compose']
+        quantidade = inteiro_positivo(pedido.get('parts')) if isinstance(pedido, dict) else None
+        if not quantidade or not 1 < quantidade <= COMPOSE_MAX_FONTES:
+            return f'"compose" precisa de "fileName" e de 2 a {COMPOSE_MAX_FONTES} "parts".'
+        return erro_nome_objeto(pedido.get('fileName'))
+    # Modo original: nomes fora de uploads/ continuam aceitos, mas sem "/" inicial nem ".."
+    return erro_nome_objeto(request_json['fileName'], exigir_prefixo=False)
+
+
+def planejar_partes(file_name: str, size: int) -> list:
+    """
+    Divide o arquivo em até COMPOSE_MAX_FONTES partes de ~PARTE_MB (alinhadas a 256KB).
+    Arquivos pequenos vão em uma única parte, direto para o objeto final.
+    """
+    tamanho_parte = PARTE_MB * 1024 * 1024
+    if size <= tamanho_parte:
+        return [{'index': 0, 'objectName': file_name, 'start': 0, 'end': size}]
+    if math.ceil(size / tamanho_parte) > COMPOSE_MAX_FONTES:
+        tamanho_parte = math.ceil(size / COMPOSE_MAX_FONTES / QUANTUM_RESUMIVEL) * QUANTUM_RESUMIVEL
+    return [
+        {'index': i, 'objectName': f"{file_name}.partes/{i:05d}", 'start': inicio, 'end': min(size, inicio + tamanho_parte)}
+        for i, inicio in enumerate(range(0, size, tamanho_parte))
+    ]
+
+
+def preparar_uploads(bucket, arquivos: list) -> list:
+    """Para cada arquivo, as partes com a URL assinada que abre a sessão resumível (POST com x-goog-resumable: start)."""
+    planos = []
+    for arquivo in arquivos:
+        content_type = arquivo.get('contentType') or 'application/octet-stream'
+        partes = planejar_partes(arquivo['fileName'], int(arquivo['size']))
+        planos.append({
+            'fileName': arquivo['fileName'],
+            'gcsPath': f"gs://{BUCKET_NAME}/{arquivo['fileName']}",
+            'contentType': content_type,
+            'size': int(arquivo['size']),
+            'chunkSize': CHUNK_MB * 1024 * 1024,
+            'compose': len(partes) > 1,
+            'parts': partes
+        })
+
+    # Assinar via IAM é uma chamada HTTP por URL: as partes de todos os arquivos são assinadas em paralelo
+    todas = [(parte, plano['contentType']) for plano in planos for parte in plano['parts']]
+    with ThreadPoolExecutor(max_workers=ASSINATURA_PARALELISMO) as executor:
+        urls = executor.map(lambda item: assinar(bucket.blob(item[0]['objectName']), 'RESUMABLE', item[1]), todas)
+        for (parte, _), url in zip(todas, urls):
+            parte['url'] = url
+    return planos
+
+
+def compor_partes(bucket, file_name: str, quantidade: int, content_type: str = None) -> str:
+    """Junta as partes enviadas em paralelo no objeto final (compose no servidor) e apaga as partes."""
+    partes = [bucket.blob(f"{file_name}.partes/{i:05d}") for i in range(quantidade)]
+    final = bucket.blob(file_name)
+    final.content_type = content_type or 'application/octet-stream'
+    final.compose(partes)
+    for parte in partes:
+        try:
+            parte.delete()
+        except Exception as e:
+            logger.warning(f"Falha ao apagar a parte {parte.name}: {e}")
+    return f"gs://{BUCKET_NAME}/{file_name}"
+
 
 @functions_framework.http
 def gerar_url_assinada(request):
     """
-    Função HTTP que gera uma URL assinada (signed URL) para permitir
-    o upload de um arquivo diretamente para o Cloud Storage.
+    Função HTTP que gera URLs assinadas para o upload direto ao Cloud Storage.
+    - `{"fileName": ...}`: uma URL de PUT único (modo original).
+    - `{"files": [{"fileName", "size", "contentType"}, ...]}`: sessões resumíveis para vários arquivos de uma vez;
+      arquivos grandes são divididos em partes enviadas em paralelo, em blocos de `chunkSize`.
+    - `{"compose": {"fileName", "parts", "contentType"}}`: junta as partes de um arquivo no objeto final.
     """
     # --- Tratamento de CORS (Cross-Origin Resource Sharing) ---
     # Essencial para permitir que o frontend (rodando em um navegador)
@@ -30,37 +187,46 @@ def gerar_url_assinada(request):
     # --- Lógica Principal ---
     if request.method == 'POST':
         request_json = request.get_json(silent=True)
-        if not request_json or 'fileName' not in request_json:
-            error_message = 'Requisição JSON inválida. O campo "fileName" é obrigatório.'
+        if not request_json or not ('fileName' in request_json or 'files' in request_json or 'compose' in request_json):
+            error_message = 'Requisição JSON inválida. Informe "fileName", "files" ou "compose".'
             return (error_message, 400, headers)
-        
-        file_name = request_json['fileName']
-        
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(file_name)
+
+        erro = erro_pedido(request_json)
+        if erro:
+            return (erro, 400, headers)
+
+        clients_before = client_manager.contagem()
 
         try:
-            # Gera a URL assinada que permite um upload (PUT) e expira em 15 minutos
-            signed_url = blob.generate_signed_url(
-                version="v4",
-                expiration=datetime.timedelta(minutes=15),
-                method="PUT",
-                content_type="text/csv"  # O tipo de conteúdo que o frontend deve enviar
-            )
-            
-            # Retorna a URL em um corpo JSON para o frontend
-            response_data = json.dumps({"url": signed_url})
+            bucket = client_manager.storage().bucket(BUCKET_NAME)
+
+            if 'files' in request_json:
+                arquivos = request_json['files']
+                response_data = {'uploads': preparar_uploads(bucket, arquivos)}
+
+            elif 'compose' in request_json:
+                pedido = request_json['compose']
+                quantidade = int(pedido['parts'])
+                response_data = {'gcsPath': compor_partes(bucket, pedido['fileName'], quantidade, pedido.get('contentType'))}
+
+            else:
+                # Gera a URL assinada que permite um upload (PUT) e expira em 15 minutos
+                blob = bucket.blob(request_json['fileName'])
+                response_data = {"url": assinar(blob, "PUT", "text/csv")}  # O tipo de conteúdo que o frontend deve enviar
+
+            # Retorna a resposta em um corpo JSON para o frontend
+            response_data['clients_built'] = client_manager.criados_desde(clients_before)
             headers['Content-Type'] = 'application/json'
-            return (response_data, 200, headers)
+            return (json.dumps(response_data), 200, headers)
 
         except Exception as e:
+            client_manager.reportar_falha('storage', e)
             error_message = f"Erro interno ao gerar URL assinada: {e}"
             headers['Content-Type'] = 'text/plain'
             return (error_message, 500, headers)
-            
+
     else:
         # Rejeita qualquer método que não seja POST ou OPTIONS
         error_message = 'Método não permitido. Use POST.'
         headers['Content-Type'] = 'text/plain'
-        return (error_message, 405, headers) 
\ No newline at end of file
+        return (error_message, 405, headers)
@@ -1,49 +1,155 @@
+import io
+import os
 import csv
 import json
+import time
+import threading
 from google.cloud import storage, pubsub_v1
+from google.cloud.pubsub_v1.types import BatchSettings, LimitExceededBehavior, PublishFlowControl
 
 PROJECT_ID = "iteng-itsystems"
 PUBSUB_TOPIC = "topico-wow"
 
+# Ajustes de lote e controle de fluxo do publisher
+PUBSUB_MAX_MENSAGENS = int(os.environ.get('PUBSUB_MAX_MENSAGENS', '500'))        # mensagens por lote
+PUBSUB_MAX_BYTES = int(os.environ.get('PUBSUB_MAX_BYTES', str(4 * 1024 * 1024)))  # bytes por lote
+PUBSUB_MAX_LATENCIA = float(os.environ.get('PUBSUB_MAX_LATENCIA', '0.05'))        # segundos até enviar um lote
+PUBSUB_FLUXO_MENSAGENS = int(os.environ.get('PUBSUB_FLUXO_MENSAGENS', '5000'))    # mensagens pendentes no máximo
+PUBSUB_FLUXO_BYTES = int(os.environ.get('PUBSUB_FLUXO_BYTES', str(64 * 1024 * 1024)))
+PUBSUB_TIMEOUT_FINAL = float(os.environ.get('PUBSUB_TIMEOUT_FINAL', '300'))        # espera final pelos futures
+
+# Objetos gerados pelo próprio pipeline no bucket não devem ser redistribuídos
+# (`uploads/` guarda as entradas do wow-parser, processadas por ele mesmo)
+PREFIXOS_IGNORADOS = ('resultados/', 'processados/', 'uploads/')
+
 storage_client = storage.Client()
-publisher = pubsub_v1.PublisherClient()
+publisher = pubsub_v1.PublisherClient(
+    batch_settings=BatchSettings(
+        max_messages=PUBSUB_MAX_MENSAGENS,
+        max_bytes=PUBSUB_MAX_BYTES,
+        max_latency=PUBSUB_MAX_LATENCIA,
+    ),
+    publisher_options=pubsub_v1.types.PublisherOptions(
+        # Quando o limite de pendências é atingido, o publish bloqueia em vez de estourar a memória
+        flow_control=PublishFlowControl(
+            message_limit=PUBSUB_FLUXO_MENSAGENS,
+            byte_limit=PUBSUB_FLUXO_BYTES,
+            limit_exceeded_behavior=LimitExceededBehavior.BLOCK,
+        )
+    ),
+)
 topic_path = publisher.topic_path(PROJECT_ID, PUBSUB_TOPIC)
 
+
+class ResultadoPublicacao:
+    """Acompanha os futures do publish: conta sucessos/falhas e permite esperar todos terminarem."""
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self.pendentes = 0
+        self.publicadas = 0
+        self.falhas = 0
+        self.ids_com_falha = []
+
+    def acompanhar(self, futuro, message_id: str):
+        with self._lock:
+            self.pendentes += 1
+        futuro.add_done_callback(lambda f: self._concluir(f, message_id))
+
+    def _concluir(self, futuro, message_id: str):
+        with self._lock:
+            self.pendentes -= 1
+            if futuro.exception() is None:
+                self.publicadas += 1
+            else:
+                self.falhas += 1
+                if len(self.ids_com_falha) < 100:
+                    self.ids_com_falha.append(message_id)
+                print(f"Falha ao publicar {message_id}: {futuro.exception()}")
+            self._lock.notify_all()
+
+    def aguardar(self, timeout: float = None) -> bool:
+        """Espera todos os futures terminarem; retorna False se o timeout acabar antes."""
+        limite = time.time() + timeout if timeout else None
+        with self._lock:
+            while self.pendentes > 0:
+                restante = limite - time.time() if limite else None
+                if restante is not None and restante <= 0:
+                    return False
+                self._lock.wait(restante)
+        return True
+
+
 def distribuir_analise(event, context):
     """
     Função gatilho do Cloud Storage que lê um arquivo CSV e publica
     cada linha em um tópico do Pub/Sub.
+    O blob é lido como stream por um parser CSV que respeita aspas (mensagens com quebra de linha
+    continuam inteiras), o publisher envia em lotes com controle de fluxo e todos os futures são
+    acompanhados até o fim, com contagem de publicadas/falhas.
     """
     bucket_name = event['bucket']
     file_name = event['name']
-    
+
+    if file_name.startswith(PREFIXOS_IGNORADOS) or not file_name.lower().endswith('.csv'):
+        print(f"Ignorando {file_name}: não é um CSV de entrada.")
+        return
+
     print(f"Processando arquivo: {file_name} do bucket: {bucket_name}.")
 
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(file_name)
-    
+
     try:
-        # Faz o download do arquivo como texto para processamento em memória
-        blob_stream = blob.download_as_text(encoding='utf-8').splitlines()
+        # Abre o blob como stream: o arquivo nunca fica inteiro em memória
+        blob_stream = blob.open('rb')
     except Exception as e:
-        print(f"Erro ao baixar ou decodificar o arquivo {file_name}: {e}")
+        print(f"Erro ao abrir o arquivo {file_name}: {e}")
         return
 
-    # Lê o arquivo CSV linha por linha
-    csv_reader = csv.DictReader(blob_stream)
-    
+    resultado = ResultadoPublicacao()
+    inicio = time.time()
     count = 0
-    for row in csv_reader:
-        # Garante que a coluna 'ordered_messages' existe e não está vazia
-        if 'ordered_messages' in row and row['ordered_messages']:
-            message_payload = {
-                "id": f"{file_name}-{count}",
-                "ordered_messages": row['ordered_messages']
-            }
-            
-            # Converte o payload para bytes e publica no Pub/Sub
-            message_bytes = json.dumps(message_payload).encode('utf-8')
-            publisher.publish(topic_path, data=message_bytes)
-            count += 1
-        
-    print(f"{count} mensagens publicadas para o arquivo {file_name}.")
\ No newline at end of file
+
+    with blob_stream:
+        # newline='' deixa o csv tratar quebras de linha dentro de campos entre aspas
+        texto = io.TextIOWrapper(blob_stream, encoding='utf-8-sig', newline='')
+        csv_reader = csv.DictReader(texto)
+
+        for row in csv_reader:
+            # Garante que a coluna 'ordered_messages' existe e não está vazia
+            if 'ordered_messages' in row and row['ordered_messages']:
+                message_id = f"{file_name}-{count}"
+                message_payload = {
+                    "id": message_id,
+                    "arquivo": file_name,
+                    "ordered_messages": row['ordered_messages']
+                }
+
+                # Converte o payload para bytes e publica no Pub/Sub (bloqueia se houver pendências demais)
+                message_bytes = json.dumps(message_payload).encode('utf-8')
+                futuro = publisher.publish(topic_path, data=message_bytes)
+                resultado.acompanhar(futuro, message_id)
+                count += 1
+
+    # Espera todos os lotes serem confirmados antes de a função terminar
+    concluiu = resultado.aguardar(timeout=PUBSUB_TIMEOUT_FINAL)
+    duracao = time.time() - inicio
+    taxa = resultado.publicadas / duracao if duracao > 0 else 0
+
+    resumo = {
+        'arquivo': file_name,
+        'enfileiradas': count,
+        'publicadas': resultado.publicadas,
+        'falhas': resultado.falhas,
+        'pendentes': resultado.pendentes,
+        'ids_com_falha': resultado.ids_com_falha,
+        'duracao_s': round(duracao, 1),
+        'mensagens_por_s': round(taxa, 1)
+    }
+    if not concluiu:
+        print(f"Tempo esgotado aguardando publicações pendentes: {resultado.pendentes}")
+    print(f"{resultado.publicadas} mensagens publicadas para o arquivo {file_name} "
+          f"({resultado.falhas} falhas, {taxa:.1f} msg/s).")
+    print(json.dumps(resumo))
+    return resumo
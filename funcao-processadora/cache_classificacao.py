@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'sqlite')  # sqlite | local | gcs | none
+CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH', '/tmp/wow_cache.sqlite3')
+CACHE_DIR = os.environ.get('CACHE_DIR', '/tmp/wow_cache')
+CACHE_BUCKET = os.environ.get('CACHE_BUCKET', '')
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'cache-classificacao')
+CACHE_MEMORIA_MB = float(os.environ.get('CACHE_MEMORIA_MB', '64'))
+
+
+def normalizar_texto(texto: str) -> str:
+    """Normaliza o texto da interação para que diferenças de espaços/caixa não gerem chaves novas."""
+    return re.sub(r'\s+', ' ', (texto or '').strip()).lower()
+
+
+def chave_cache(texto: str, prompt: str, modelo: str) -> str:
+    """Gera a chave de conteúdo: hash do texto normalizado + prompt + nome do modelo."""
+    h = hashlib.sha256()
+    for parte in (modelo, prompt, normalizar_texto(texto)):
+        dados = parte.encode('utf-8')
+        # Prefixo com o tamanho evita colisões entre concatenações diferentes
+        h.update(len(dados).to_bytes(8, 'big'))
+        h.update(dados)
+    return h.hexdigest()
+
+
+class ContadorCache:
+    """Contagem de hits/misses de uma execução (uma sessão de processamento)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits_memoria = 0
+        self.hits_persistente = 0
+        self.misses = 0
+
+    def registrar(self, origem: str):
+        with self._lock:
+            if origem == 'memoria':
+                self.hits_memoria += 1
+            elif origem == 'persistente':
+                self.hits_persistente += 1
+            else:
+                self.misses += 1
+
+    def como_dict(self) -> dict:
+        hits = self.hits_memoria + self.hits_persistente
+        total = hits + self.misses
+        return {
+            'cache_hits': hits,
+            'cache_hits_memoria': self.hits_memoria,
+            'cache_hits_persistente': self.hits_persistente,
+            'cache_misses': self.misses,
+            'cache_hit_rate': round(hits / total, 3) if total > 0 else 0
+        }
+
+
+# --- Camada em memória ---
+
+class CacheLRU:
+    """Cache LRU em memória com despejo por tamanho (bytes aproximados do JSON armazenado)."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._dados = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave: str):
+        with self._lock:
+            valor = self._dados.get(chave)
+            if valor is None:
+                return None
+            self._dados.move_to_end(chave)
+            return json.loads(valor)
+
+    def gravar(self, chave: str, resultado: dict):
+        valor = json.dumps(resultado, ensure_ascii=False)
+        tamanho = len(valor) + len(chave)
+        if tamanho > self.max_bytes:
+            return
+        with self._lock:
+            antigo = self._dados.pop(chave, None)
+            if antigo is not None:
+                self._bytes -= len(antigo) + len(chave)
+            self._dados[chave] = valor
+            self._bytes += tamanho
+            while self._bytes > self.max_bytes:
+                chave_antiga, valor_antigo = self._dados.popitem(last=False)
+                self._bytes -= len(valor_antigo) + len(chave_antiga)
+
+
+# --- Camadas persistentes ---
+
+class CacheSQLite:
+    """Camada persistente em um arquivo SQLite local."""
+
+    def __init__(self, caminho: str):
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS classificacoes (chave TEXT PRIMARY KEY, resultado TEXT NOT NULL)')
+            self._conn.commit()
+
+    def obter(self, chave: str):
+        with self._lock:
+            linha = self._conn.execute('SELECT resultado FROM classificacoes WHERE chave = ?', (chave,)).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def gravar(self, chave: str, resultado: dict):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO classificacoes (chave, resultado) VALUES (?, ?)',
+                (chave, json.dumps(resultado, ensure_ascii=False))
+            )
+            self._conn.commit()
+
+
+class CacheShards:
+    """
+    Camada persistente em shards de objetos: `{prefixo}/{chave[:2]}/{chave}.json`.
+    Funciona com um bucket do GCS (`bucket`) ou com um diretório local que faz o papel do bucket.
+    """
+
+    def __init__(self, prefixo: str, bucket=None, diretorio: str = None):
+        if bucket is None and diretorio is None:
+            raise ValueError("Informe um bucket do GCS ou um diretório local para o cache")
+        self.prefixo = prefixo.strip('/')
+        self.bucket = bucket
+        self.diretorio = diretorio
+
+    def _caminho(self, chave: str) -> str:
+        return f"{self.prefixo}/{chave[:2]}/{chave}.json"
+
+    def obter(self, chave: str):
+        caminho = self._caminho(chave)
+        if self.bucket is not None:
+            blob = self.bucket.blob(caminho)
+            try:
+                return json.loads(blob.download_as_bytes())
+            except Exception as e:
+                # NotFound é o caso comum (miss); outros erros também viram miss
+                if type(e).__name__ != 'NotFound':
+                    logger.warning(f"Erro ao ler cache {caminho}: {e}")
+                return None
+        arquivo = os.path.join(self.diretorio, caminho)
+        if not os.path.exists(arquivo):
+            return None
+        with open(arquivo, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def gravar(self, chave: str, resultado: dict):
+        caminho = self._caminho(chave)
+        dados = json.dumps(resultado, ensure_ascii=False)
+        if self.bucket is not None:
+            self.bucket.blob(caminho).upload_from_string(dados, content_type='application/json')
+            return
+        arquivo = os.path.join(self.diretorio, caminho)
+        os.makedirs(os.path.dirname(arquivo), exist_ok=True)
+        # Escrita atômica: outro worker nunca lê um arquivo pela metade
+        temporario = f"{arquivo}.{threading.get_ident()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            f.write(dados)
+        os.replace(temporario, arquivo)
+
+
+# --- Cache em duas camadas ---
+
+class CacheClassificacao:
+    """Cache de classificações em duas camadas: LRU em memória na frente de uma camada persistente."""
+
+    def __init__(self, memoria: CacheLRU, persistente=None):
+        self.memoria = memoria
+        self.persistente = persistente
+
+    def obter(self, chave: str, contador: ContadorCache = None):
+        resultado = self.memoria.obter(chave)
+        origem = 'memoria' if resultado is not None else None
+
+        if resultado is None and self.persistente is not None:
+            try:
+                resultado = self.persistente.obter(chave)
+            except Exception as e:
+                logger.warning(f"Falha na camada persistente do cache: {e}")
+                resultado = None
+            if resultado is not None:
+                origem = 'persistente'
+                self.memoria.gravar(chave, resultado)
+
+        if contador:
+            contador.registrar(origem or 'miss')
+        return resultado
+
+    def gravar(self, chave: str, resultado: dict):
+        # Nunca guardar erros: a próxima execução precisa tentar de novo
+        if not resultado or resultado.get('classificacao_final') in (None, 'Erro'):
+            return
+        self.memoria.gravar(chave, resultado)
+        if self.persistente is not None:
+            try:
+                self.persistente.gravar(chave, resultado)
+            except Exception as e:
+                logger.warning(f"Falha ao gravar na camada persistente do cache: {e}")
+
+
+def criar_cache(obter_bucket=None) -> CacheClassificacao:
+    """
+    Monta o cache a partir das variáveis de ambiente.
+    `obter_bucket(nome)` é usado apenas no backend 'gcs', para não acoplar este módulo ao cliente do Storage.
+    """
+    memoria = CacheLRU(int(CACHE_MEMORIA_MB * 1024 * 1024))
+    persistente = None
+    try:
+        if CACHE_BACKEND == 'sqlite':
+            persistente = CacheSQLite(CACHE_SQLITE_PATH)
+        elif CACHE_BACKEND == 'local':
+            persistente = CacheShards(CACHE_PREFIX, diretorio=CACHE_DIR)
+        elif CACHE_BACKEND == 'gcs' and CACHE_BUCKET and obter_bucket:
+            persistente = CacheShards(CACHE_PREFIX, bucket=obter_bucket(CACHE_BUCKET))
+    except Exception as e:
+        logger.error(f"Erro ao inicializar camada persistente do cache ({CACHE_BACKEND}): {e}")
+        persistente = None
+    logger.info(f"Cache de classificação: memória {CACHE_MEMORIA_MB}MB, persistente={type(persistente).__name__ if persistente else 'nenhum'}")
+    return CacheClassificacao(memoria, persistente)
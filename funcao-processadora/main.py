@@ -1,7 +1,5 @@
-import json
 import vertexai
-from vertexai.generative_models import GenerativeModel, Part
-from google.cloud import storage
+from vertexai.generative_models import Part
 import csv
 import io
 import uuid
@@ -9,16 +7,24 @@ from flask import request, jsonify
 from werkzeug.utils import secure_filename
 import logging
 import traceback
+from motor_classificacao import MotorClassificacao
+from cache_classificacao import ContadorCache, chave_cache, criar_cache
+from clientes import GerenciadorClientes
+from limitador import LimitadorVertex
+from resposta_modelo import ContadorRespostas, RespostaInvalida, config_geracao, obter_resultado, resultado_do_cache
 
 # Configurações
 PROJECT_ID = "iteng-itsystems"
 LOCATION = "us-central1"
 BUCKET_NAME = "iteng-entrada-analise"
+MODEL_NAME = "gemini-1.5-flash"
 
 # Inicialização
 vertexai.init(project=PROJECT_ID, location=LOCATION)
-storage_client = storage.Client()
+client_manager = GerenciadorClientes(PROJECT_ID, LOCATION)
+vertex_limiter = LimitadorVertex()
 logger = logging.getLogger(__name__)
+classification_cache = criar_cache(lambda nome: client_manager.storage().bucket(nome))
 
 # Prompt para análise
 PROMPT = """
@@ -34,19 +40,29 @@ Formato de saída JSON:
 {"raciocinio": "breve explicação", "classificacao_final": "Normal/Bom/WoW"}
 """
 
-def analisar_interacao(texto):
-    """Chama Gemini para análise."""
+def analisar_interacao(texto, contador_cache=None, contador_respostas=None):
+    """Chama Gemini para análise (com cache por conteúdo + prompt + modelo e resposta validada pelo esquema)."""
+    chave = chave_cache(texto, PROMPT, MODEL_NAME)
+    resultado = resultado_do_cache(classification_cache.obter(chave, contador_cache))
+    if resultado is not None:
+        return resultado
+    
     try:
-        model = GenerativeModel("gemini-1.5-flash", system_instruction=[PROMPT])
-        response = model.generate_content([Part.from_text(f"Interação: {texto}")])
+        model = client_manager.modelo(MODEL_NAME, PROMPT)
         
-        # Tentar extrair JSON da resposta
-        text = response.text.strip()
-        if text.startswith('```json'):
-            text = text.replace('```json', '').replace('```', '').strip()
+        def gerar():
+            return vertex_limiter.executar(lambda: model.generate_content(
+                [Part.from_text(f"Interação: {texto}")],
+                generation_config=config_geracao()
+            )).text
         
-        return json.loads(text)
+        # Resposta reparada antes de pedir de novo; só resultado válido vai para o cache
+        resultado = obter_resultado(gerar, contador_respostas)
+        classification_cache.gravar(chave, resultado)
+        return resultado
     except Exception as e:
+        if not isinstance(e, RespostaInvalida):
+            client_manager.reportar_falha('modelo', e)
         logger.error(f"Erro Gemini: {e}")
         return {"raciocinio": "Erro na análise", "classificacao_final": "Erro"}
 
@@ -62,6 +78,8 @@ def upload_service(request):
     if request.method == 'OPTIONS':
         return ('', 204, headers)
     
+    clients_before = client_manager.contagem()
+    
     if request.method == 'GET':
         # Retorna a página HTML
         return """
@@ -162,12 +180,19 @@ def upload_service(request):
         output_rows = []
         stats = {'total_rows': 0, 'normal_count': 0, 'bom_count': 0, 'wow_count': 0}
         
-        for row in reader:
-            stats['total_rows'] += 1
+        def classificar_linha(row):
             texto = row.get('ordered_messages', '').strip()
+            return analisar_interacao(texto, contador_cache, contador_respostas) if texto else None
+        
+        contador_cache = ContadorCache()
+        contador_respostas = ContadorRespostas()
+        
+        # Chamadas ao Gemini em paralelo, com as linhas devolvidas na ordem original
+        motor = MotorClassificacao()
+        for row, resultado in motor.mapear(classificar_linha, reader):
+            stats['total_rows'] += 1
             
-            if texto:
-                resultado = analisar_interacao(texto)
+            if resultado is not None:
                 row['raciocinio'] = resultado.get('raciocinio', 'Erro')
                 row['classificacao_final'] = resultado.get('classificacao_final', 'Erro')
                 
@@ -184,6 +209,10 @@ def upload_service(request):
             
             output_rows.append(row)
         
+        stats.update(contador_cache.como_dict())
+        stats.update(contador_respostas.como_dict())
+        stats.update(vertex_limiter.estado())
+        
         # Salva resultado
         output_csv = io.StringIO()
         writer = csv.DictWriter(output_csv, fieldnames=fieldnames)
@@ -194,7 +223,7 @@ def upload_service(request):
         session_id = str(uuid.uuid4())[:8]
         filename = f"processado_{session_id}_{secure_filename(file.filename)}"
         
-        bucket = storage_client.bucket(BUCKET_NAME)
+        bucket = client_manager.storage().bucket(BUCKET_NAME)
         blob = bucket.blob(f"processados/{filename}")
         blob.upload_from_string(output_csv.getvalue(), content_type='text/csv')
         blob.make_public()
@@ -204,6 +233,7 @@ def upload_service(request):
             'download_url': blob.public_url,
             'preview_data': output_rows,
             'statistics': stats,
+            'clients_built': client_manager.criados_desde(clients_before),
             'message': 'Processamento concluído!'
         }), 200, headers
         
@@ -0,0 +1,271 @@
+import io
+import os
+import csv
+import gzip
+import json
+import time
+import logging
+
+from streaming_csv import SAIDA_GZIP, abrir_parquet_saida_gcs
+from indice_resultados import INDICE_RESULTADOS, ConstrutorIndice, colunas_indexadas
+from estatisticas import AgregadorEstatisticas
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+CHECKPOINT_LINHAS = int(os.environ.get('CHECKPOINT_LINHAS', '500'))  # linhas por parte salva (0 desliga)
+PRAZO_FUNCAO_S = int(os.environ.get('PRAZO_FUNCAO_S', '540'))        # deve bater com o --timeout do deploy
+PRAZO_MARGEM_S = int(os.environ.get('PRAZO_MARGEM_S', '60'))         # folga para terminar chamadas e salvar
+
+# Limite de objetos por chamada de compose do GCS
+COMPOSE_MAX_FONTES = 32
+
+
+def calcular_prazo(inicio: float = None) -> float:
+    """Horário (epoch) a partir do qual o processamento não deve aceitar novas linhas."""
+    return (inicio or time.time()) + PRAZO_FUNCAO_S - PRAZO_MARGEM_S
+
+
+class CheckpointSessao:
+    """
+    Checkpoint de uma sessão de processamento em `processados/{session_id}/checkpoint/`.
+    - `cabecalho.csv`: linha de cabeçalho do CSV final.
+    - `parte-NNNNN.csv`: linhas processadas (sem cabeçalho), em ordem, cobrindo um intervalo contíguo da entrada.
+    - `parte-NNNNN.indice.json`: bytes e valores das colunas indexadas de cada linha da parte; no fim,
+      viram o índice de resultados sem reler o CSV.
+    - `manifesto.json`: colunas, origem, formato, nome final, estatísticas das linhas já salvas em partes
+      (gravadas junto com cada parte, para a retomada depois de uma queda) e a lista de partes com
+      intervalo e quantidade de erros.
+    O CSV final é montado com compose do GCS (cabeçalho + partes), sem baixar nada. Com saída gzip, cada
+    objeto (`.csv.gz`) é um membro gzip independente; a concatenação continua um gzip válido e o final
+    é gravado com `Content-Encoding: gzip`.
+    """
+
+    def __init__(self, bucket, session_id: str, linhas_por_parte: int = None, manifesto: dict = None,
+                 origem: str = None, processed_filename: str = None, formato: str = 'csv', parquet: bool = False):
+        self.bucket = bucket
+        self.session_id = session_id
+        self.prefixo = f"processados/{session_id}/checkpoint"
+        self.linhas_por_parte = linhas_por_parte or CHECKPOINT_LINHAS
+        self.manifesto = manifesto or {
+            'session_id': session_id,
+            'origem': origem,
+            'processed_filename': processed_filename,
+            'linhas_por_parte': self.linhas_por_parte,
+            'formato': formato,
+            'gzip': SAIDA_GZIP,
+            'parquet': parquet,
+            'partes': []
+        }
+        self.extensao = '.csv.gz' if self.manifesto.get('gzip') else '.csv'
+        # Estatísticas só das linhas gravadas em partes (as em voo ficam de fora até a parte ser salva)
+        self.estatisticas = AgregadorEstatisticas(self.manifesto.get('estatisticas'))
+        if self.fieldnames:
+            self.estatisticas.definir_dimensoes(self.fieldnames)
+        self._buffer = []
+        self._latencias = []
+        self._inicio_buffer = self.proxima_linha
+
+    # --- Manifesto ---
+
+    @classmethod
+    def carregar(cls, bucket, session_id: str):
+        """Carrega o checkpoint de uma sessão; retorna None se não existir."""
+        blob = bucket.blob(f"processados/{session_id}/checkpoint/manifesto.json")
+        try:
+            manifesto = json.loads(blob.download_as_bytes())
+        except Exception as e:
+            logger.warning(f"CHECKPOINT - Manifesto da sessão {session_id} não encontrado: {e}")
+            return None
+        return cls(bucket, session_id, manifesto.get('linhas_por_parte'), manifesto)
+
+    def _salvar_manifesto(self):
+        self.manifesto['atualizado_em'] = time.time()
+        self.manifesto['estatisticas'] = self.estatisticas.estado()
+        self.bucket.blob(f"{self.prefixo}/manifesto.json").upload_from_string(
+            json.dumps(self.manifesto, ensure_ascii=False), content_type='application/json'
+        )
+
+    def iniciar(self, fieldnames: list):
+        """Grava o cabeçalho e o manifesto inicial de uma sessão nova."""
+        self.manifesto['fieldnames'] = fieldnames
+        self.estatisticas.definir_dimensoes(fieldnames)
+        saida = io.StringIO()
+        csv.DictWriter(saida, fieldnames=fieldnames).writeheader()
+        self.manifesto['cabecalho_texto'] = len(saida.getvalue().encode('utf-8'))
+        self.manifesto['cabecalho_bytes'] = self._gravar(f"{self.prefixo}/cabecalho{self.extensao}", saida.getvalue())
+        self._salvar_manifesto()
+
+    @property
+    def fieldnames(self) -> list:
+        return self.manifesto.get('fieldnames', [])
+
+    @property
+    def proxima_linha(self) -> int:
+        """Índice (0-based) da primeira linha da entrada que ainda não está em nenhuma parte."""
+        partes = self.manifesto.get('partes', [])
+        return partes[-1]['fim'] if partes else 0
+
+    # --- Escrita das partes ---
+
+    def _gravar(self, nome: str, texto: str) -> int:
+        """Grava o objeto e devolve o tamanho armazenado (comprimido, com gzip)."""
+        dados = texto.encode('utf-8')
+        if self.manifesto.get('gzip'):
+            dados = gzip.compress(dados)
+            self.bucket.blob(nome).upload_from_string(dados, content_type='application/gzip')
+        else:
+            self.bucket.blob(nome).upload_from_string(dados, content_type='text/csv')
+        return len(dados)
+
+    def _serializar(self, rows: list) -> tuple:
+        """(texto CSV das linhas, bytes UTF-8 de cada linha)."""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.fieldnames, extrasaction='ignore')
+        linhas = []
+        for row in rows:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(row)
+            linhas.append(buffer.getvalue())
+        return ''.join(linhas), [len(linha.encode('utf-8')) for linha in linhas]
+
+    def _gravar_parte(self, nome: str, rows: list) -> dict:
+        """Grava uma parte e, com o índice ligado, o índice dela; devolve os campos da parte no manifesto."""
+        texto, tamanhos = self._serializar(rows)
+        campos = {'bytes': self._gravar(nome, texto)}
+        if INDICE_RESULTADOS:
+            campos['indice'] = nome[:-len(self.extensao)] + '.indice.json'
+            valores = {coluna: [row.get(coluna) for row in rows] for coluna in colunas_indexadas(self.fieldnames)}
+            self.bucket.blob(campos['indice']).upload_from_string(
+                json.dumps({'tamanhos': tamanhos, 'valores': valores}, ensure_ascii=False), content_type='application/json'
+            )
+        return campos
+
+    def adicionar(self, indice: int, row: dict, latencia: float = None):
+        """Acumula uma linha processada (na ordem da entrada) e salva a parte quando ela enche."""
+        if not self._buffer:
+            self._inicio_buffer = indice
+        self._buffer.append(row)
+        self._latencias.append(latencia)
+        if len(self._buffer) >= self.linhas_por_parte:
+            self.descarregar()
+
+    def descarregar(self):
+        """Salva no bucket as linhas acumuladas como uma nova parte e atualiza o manifesto."""
+        if not self._buffer:
+            return
+        numero = len(self.manifesto['partes'])
+        nome = f"{self.prefixo}/parte-{numero:05d}{self.extensao}"
+        campos = self._gravar_parte(nome, self._buffer)
+        for row, latencia in zip(self._buffer, self._latencias):
+            self.estatisticas.registrar(row, row.get('classificacao_final'), latencia)
+        self.manifesto['partes'].append({
+            'nome': nome,
+            'inicio': self._inicio_buffer,
+            'fim': self._inicio_buffer + len(self._buffer),
+            'erros': sum(1 for row in self._buffer if row.get('classificacao_final') == 'Erro'),
+            **campos
+        })
+        self._salvar_manifesto()
+        logger.info(f"CHECKPOINT - Parte {numero} salva: linhas {self._inicio_buffer} a {self._inicio_buffer + len(self._buffer) - 1}")
+        self._buffer = []
+        self._latencias = []
+
+    # --- Retomada ---
+
+    def partes_com_erro(self) -> list:
+        return [parte for parte in self.manifesto['partes'] if parte.get('erros')]
+
+    def ler_parte(self, parte: dict) -> list:
+        dados = self.bucket.blob(parte['nome']).download_as_bytes()
+        if dados[:2] == b'\x1f\x8b':
+            dados = gzip.decompress(dados)
+        return list(csv.DictReader(io.StringIO(dados.decode('utf-8')), fieldnames=self.fieldnames))
+
+    def reescrever_parte(self, parte: dict, rows: list):
+        """Substitui o conteúdo de uma parte (após refazer as linhas com erro, já trocadas em `estatisticas`)."""
+        parte.update(self._gravar_parte(parte['nome'], rows))
+        parte['erros'] = sum(1 for row in rows if row.get('classificacao_final') == 'Erro')
+        self._salvar_manifesto()
+
+    # --- Montagem do CSV final ---
+
+    def compor(self, destino: str) -> str:
+        """Monta o CSV final (cabeçalho + partes, em ordem) com compose do GCS, em rodadas de até 32 objetos."""
+        fontes = [self.bucket.blob(f"{self.prefixo}/cabecalho{self.extensao}")]
+        fontes += [self.bucket.blob(parte['nome']) for parte in self.manifesto['partes']]
+
+        rodada = 0
+        while len(fontes) > COMPOSE_MAX_FONTES:
+            intermediarios = []
+            for inicio in range(0, len(fontes), COMPOSE_MAX_FONTES):
+                grupo = fontes[inicio:inicio + COMPOSE_MAX_FONTES]
+                if len(grupo) == 1:
+                    intermediarios.append(grupo[0])
+                    continue
+                alvo = self.bucket.blob(f"{self.prefixo}/composto-{rodada}-{inicio // COMPOSE_MAX_FONTES:05d}{self.extensao}")
+                alvo.content_type = 'text/csv'
+                alvo.compose(grupo)
+                intermediarios.append(alvo)
+            fontes = intermediarios
+            rodada += 1
+
+        final = self.bucket.blob(destino)
+        final.content_type = 'text/csv'
+        if self.manifesto.get('gzip'):
+            final.content_encoding = 'gzip'
+        final.compose(fontes)
+        self.manifesto['concluido'] = True
+        self.manifesto['destino'] = destino
+        self._salvar_manifesto()
+        logger.info(f"CHECKPOINT - CSV final montado em {destino} a partir de {len(self.manifesto['partes'])} partes")
+        if INDICE_RESULTADOS:
+            try:
+                self.salvar_indice(destino)
+            except Exception as e:
+                logger.warning(f"INDICE - Falha ao montar o índice de resultados: {e}")
+        return destino
+
+    def limpar(self):
+        """Apaga partes, índices das partes e compostos intermediários depois que o CSV final (e o Parquet) existem.
+        Só o manifesto fica, marcado como `limpo`, para a sessão não ser retomada de novo."""
+        apagados = 0
+        for blob in self.bucket.list_blobs(prefix=f"{self.prefixo}/"):
+            if blob.name.endswith('/manifesto.json'):
+                continue
+            try:
+                blob.delete()
+                apagados += 1
+            except Exception as e:
+                logger.warning(f"CHECKPOINT - Falha ao apagar {blob.name}: {e}")
+        self.manifesto['limpo'] = True
+        self._salvar_manifesto()
+        logger.info(f"CHECKPOINT - {apagados} objetos intermediários apagados de {self.prefixo}/")
+
+    def salvar_indice(self, destino: str):
+        """Monta o índice de resultados do CSV final a partir dos índices das partes, sem reler o CSV."""
+        partes = self.manifesto['partes']
+        if 'cabecalho_bytes' not in self.manifesto or any('indice' not in parte for parte in partes):
+            logger.info("INDICE - Checkpoint sem índice em todas as partes: índice de resultados não gerado")
+            return None
+        indice = ConstrutorIndice(self.fieldnames, comprimido=bool(self.manifesto.get('gzip')))
+        indice.registrar_cabecalho(self.manifesto['cabecalho_texto'])
+        offset = self.manifesto['cabecalho_bytes']
+        for parte in partes:
+            # Cada parte é um bloco: com gzip, um membro que pode ser baixado por range e descomprimido sozinho
+            dados = json.loads(self.bucket.blob(parte['indice']).download_as_bytes())
+            indice.iniciar_bloco(offset)
+            for i, tamanho in enumerate(dados['tamanhos']):
+                indice.adicionar({coluna: valores[i] for coluna, valores in dados['valores'].items()}, tamanho)
+            offset += parte['bytes']
+        return indice.salvar(self.bucket, self.session_id, destino)
+
+    def exportar_parquet(self, destino: str) -> str:
+        """Gera o Parquet final lendo as partes em ordem, um row group por vez (memória limitada)."""
+        writer = abrir_parquet_saida_gcs(self.bucket, destino, self.fieldnames)
+        for parte in self.manifesto['partes']:
+            writer.writerows(self.ler_parte(parte))
+        writer.close()
+        logger.info(f"CHECKPOINT - Parquet montado em {destino} a partir de {len(self.manifesto['partes'])} partes")
+        return destino
@@ -0,0 +1,170 @@
+import os
+import re
+import logging
+import threading
+import unicodedata
+
+from lote_classificacao import estimar_tokens
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+COMPACTACAO = os.environ.get('COMPACTACAO', '1') == '1'
+COMPACTACAO_ORCAMENTO_TOKENS = int(os.environ.get('COMPACTACAO_ORCAMENTO_TOKENS', '2000'))
+COMPACTACAO_CABECA = float(os.environ.get('COMPACTACAO_CABECA', '0.4'))  # fração do orçamento para o início da conversa
+COMPACTACAO_LENTA_MAX_EM_VOO = int(os.environ.get('COMPACTACAO_LENTA_MAX_EM_VOO', '2'))
+
+# Marcadores de turno reconhecidos no texto de `ordered_messages`
+FALANTES = ('Cliente', 'Agente', 'Atendente', 'Sistema', 'Bot')
+_TURNO = re.compile(r'(?:^|(?<=\s))(' + '|'.join(FALANTES) + r')\s*:\s*')
+_FRASE = re.compile(r'(?<=[.!?])\s+')
+
+# Frases de roteiro sem informação para a classificação (comparadas sem acento/caixa/pontuação final).
+# Só frases inteiras saem: "Bom dia!" sai, "Bom dia quero cancelar minha conta." fica.
+BOILERPLATE = [
+    r'(ola|oi|bom dia|boa tarde|boa noite)',
+    r'(ola|oi|bom dia|boa tarde|boa noite),? (tudo bem|como vai)\??',
+    r'posso (te )?ajudar em (mais )?alguma (outra )?coisa\??',
+    r'(ha )?mais alguma coisa em que (eu )?possa (te )?ajudar\??',
+    r'obrigad[oa] por (entrar em contato|aguardar|sua paciencia)',
+    r'aguarde (so )?um (momento|instante),?( por favor)?',
+    r'(sua|esta) (ligacao|conversa|chamada) (pode ser|esta sendo|sera) gravada.*',
+    r'(o )?(seu )?(numero de )?protocolo( de atendimento)?( e)?:? ?[\w\-]+',
+    r'(mensagem|resposta) automatica.*',
+    r'(o|a) (cliente|agente|atendente) (entrou|saiu|foi transferid[oa]).*',
+    r'tenha um (otimo|bom|excelente) dia',
+]
+_BOILERPLATE = re.compile(r'^(?:' + '|'.join(BOILERPLATE) + r')[.!?]*$')
+
+
+def _chave_frase(frase: str) -> str:
+    sem_acento = unicodedata.normalize('NFKD', frase).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'\s+', ' ', sem_acento).strip().lower()
+
+
+def separar_turnos(texto: str) -> list:
+    """[(falante, fala)] a partir de 'Cliente: ... Agente: ...'; sem marcadores, um único turno sem falante."""
+    partes = _TURNO.split(texto)
+    turnos = []
+    if partes[0].strip():
+        turnos.append((None, partes[0].strip()))
+    for falante, fala in zip(partes[1::2], partes[2::2]):
+        turnos.append((falante, fala.strip()))
+    return turnos
+
+
+def juntar_turnos(turnos: list) -> str:
+    return ' '.join(f"{falante}: {fala}" if falante else fala for falante, fala in turnos)
+
+
+def limpar_turnos(turnos: list) -> list:
+    """
+    Remove frases de roteiro e repetições:
+    - frases inteiras que casam com BOILERPLATE (turnos que ficam vazios saem);
+    - falas de agente/sistema idênticas a uma anterior (textos de sistema repetidos);
+    - falas do cliente repetidas em sequência (a repetição espaçada pode indicar insistência e fica).
+    """
+    limpos = []
+    vistos = set()
+    for falante, fala in turnos:
+        frases = [frase for frase in _FRASE.split(fala) if frase and not _BOILERPLATE.match(_chave_frase(frase))]
+        if not frases:
+            continue
+        fala = ' '.join(frases)
+        chave = (falante, _chave_frase(fala))
+        if falante == 'Cliente':
+            if limpos and (limpos[-1][0], _chave_frase(limpos[-1][1])) == chave:
+                continue
+        elif chave in vistos:
+            continue
+        vistos.add(chave)
+        limpos.append((falante, fala))
+    return limpos
+
+
+def truncar_cabeca_cauda(turnos: list, orcamento: int, fracao_cabeca: float = None) -> tuple:
+    """
+    Mantém turnos inteiros do início e do fim dentro do `orcamento` de tokens, com um marcador no meio.
+    Retorna (turnos, omitidos). Um turno que sozinho não cabe é cortado no meio, preservando as pontas.
+    """
+    fracao_cabeca = COMPACTACAO_CABECA if fracao_cabeca is None else fracao_cabeca
+    custos = [estimar_tokens(f"{falante}: {fala}") for falante, fala in turnos]
+    orcamento_cabeca = int(orcamento * fracao_cabeca)
+
+    inicio, usado = 0, 0
+    while inicio < len(turnos) and usado + custos[inicio] <= orcamento_cabeca:
+        usado += custos[inicio]
+        inicio += 1
+    fim = len(turnos)
+    while fim > inicio and usado + custos[fim - 1] <= orcamento:
+        usado += custos[fim - 1]
+        fim -= 1
+
+    omitidos = fim - inicio
+    if omitidos == 0:
+        return turnos, 0
+    if inicio == 0 and fim == len(turnos):
+        # Nenhum turno inteiro coube: corta o maior trecho preservando começo e fim do texto
+        texto = juntar_turnos(turnos)
+        caracteres = max(0, (orcamento - 8) * 4)
+        cabeca = int(caracteres * fracao_cabeca)
+        return [(None, f"{texto[:cabeca]} [...] {texto[len(texto) - (caracteres - cabeca):]}")], omitidos
+    marcador = (None, f"[... {omitidos} turnos omitidos ...]")
+    return turnos[:inicio] + [marcador] + turnos[fim:], omitidos
+
+
+def compactar_conversa(texto: str, orcamento: int = None) -> dict:
+    """
+    Texto a enviar ao modelo para uma linha de `ordered_messages`.
+    Retorna {'texto', 'tokens_originais', 'tokens', 'acima_orcamento', 'truncada'}; `acima_orcamento`
+    indica que a conversa, mesmo limpa, passava do orçamento (essas linhas vão para a faixa lenta).
+    """
+    orcamento = orcamento or COMPACTACAO_ORCAMENTO_TOKENS
+    tokens_originais = estimar_tokens(texto)
+    if not COMPACTACAO or not texto:
+        return {'texto': texto, 'tokens_originais': tokens_originais, 'tokens': tokens_originais,
+                'acima_orcamento': False, 'truncada': False}
+
+    turnos = limpar_turnos(separar_turnos(texto))
+    compactado = juntar_turnos(turnos) if turnos else texto.strip()
+    acima_orcamento = estimar_tokens(compactado) > orcamento
+    truncada = False
+    if acima_orcamento and turnos:
+        turnos, omitidos = truncar_cabeca_cauda(turnos, orcamento)
+        compactado, truncada = juntar_turnos(turnos), omitidos > 0
+    tokens = estimar_tokens(compactado)
+    return {'texto': compactado, 'tokens_originais': tokens_originais, 'tokens': min(tokens, tokens_originais),
+            'acima_orcamento': acima_orcamento, 'truncada': truncada}
+
+
+class ContadorCompactacao:
+    """Tokens antes/depois da compactação e linhas truncadas ou na faixa lenta de uma execução."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.linhas = 0
+        self.tokens_originais = 0
+        self.tokens_enviados = 0
+        self.truncadas = 0
+        self.faixa_lenta = 0
+
+    def registrar(self, compactacao: dict):
+        with self._lock:
+            self.linhas += 1
+            self.tokens_originais += compactacao['tokens_originais']
+            self.tokens_enviados += compactacao['tokens']
+            self.truncadas += compactacao['truncada']
+            self.faixa_lenta += compactacao['acima_orcamento']
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            economizados = self.tokens_originais - self.tokens_enviados
+            return {
+                'compaction_enabled': COMPACTACAO,
+                'compaction_tokens_before': self.tokens_originais,
+                'compaction_tokens_after': self.tokens_enviados,
+                'compaction_tokens_saved': economizados,
+                'compaction_saved_pct': round(100 * economizados / self.tokens_originais, 1) if self.tokens_originais else 0,
+                'compaction_truncated_rows': self.truncadas,
+                'slow_lane_rows': self.faixa_lenta
+            }
@@ -0,0 +1,124 @@
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+ESCALONADOR_MAX_EM_VOO = int(os.environ.get('ESCALONADOR_MAX_EM_VOO', os.environ.get('VERTEX_MAX_CONCORRENCIA', '16')))
+ESCALONADOR_PEQUENO_KB = int(os.environ.get('ESCALONADOR_PEQUENO_KB', '512'))  # arquivos até esse tamanho vão para a faixa prioritária
+ESCALONADOR_JANELA_S = 30.0  # janela usada para calcular a fatia de vazão de cada sessão
+
+# Faixas de atendimento: a prioritária (arquivos pequenos, interativos) sempre passa na frente
+FAIXA_PRIORITARIA = 0
+FAIXA_NORMAL = 1
+
+
+class SessaoEscalonada:
+    """Estado de uma sessão no escalonador: peso, faixa, etiqueta virtual e contadores de espera."""
+
+    def __init__(self, session_id: str, peso: float, prioritaria: bool):
+        self.session_id = session_id
+        self.peso = max(0.01, peso)
+        self.faixa = FAIXA_PRIORITARIA if prioritaria else FAIXA_NORMAL
+        self.ultima_etiqueta = 0.0
+        self.em_voo = 0
+        self.atendidas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+
+class EscalonadorJusto:
+    """
+    Escalonador central das chamadas de classificação de todas as sessões da instância.
+    - Enfileiramento justo ponderado (start-time fair queueing): cada pedido recebe a etiqueta
+      max(tempo virtual, última etiqueta da sessão) + custo/peso e é atendido pela menor etiqueta,
+      então uma sessão com muitas linhas não passa na frente das outras só por ter mais threads.
+    - Faixa prioritária: sessões de arquivos pequenos são atendidas antes das demais.
+    - Limite global de pedidos em voo, somando todas as sessões.
+    """
+
+    def __init__(self, max_em_voo: int = None):
+        self.max_em_voo = max_em_voo or ESCALONADOR_MAX_EM_VOO
+        self._cond = threading.Condition()
+        self._fila = []
+        self._sequencia = itertools.count()
+        self._tempo_virtual = 0.0
+        self._em_voo = 0
+        self._sessoes = {}
+        self._atendidos = deque()  # (instante, session_id, custo) dentro da janela
+
+    # --- Sessões ---
+
+    def registrar(self, session_id: str, peso: float = 1.0, total_bytes: int = None) -> SessaoEscalonada:
+        prioritaria = total_bytes is not None and total_bytes <= ESCALONADOR_PEQUENO_KB * 1024
+        sessao = SessaoEscalonada(session_id, peso, prioritaria)
+        with self._cond:
+            # Sessão nova começa no tempo virtual atual: não herda crédito nem dívida
+            sessao.ultima_etiqueta = self._tempo_virtual
+            self._sessoes[session_id] = sessao
+        logger.info(f"ESCALONADOR - Sessão {session_id} registrada (peso {peso}, {'prioritária' if prioritaria else 'normal'})")
+        return sessao
+
+    def encerrar(self, sessao: SessaoEscalonada):
+        with self._cond:
+            if self._sessoes.get(sessao.session_id) is sessao:
+                del self._sessoes[sessao.session_id]
+
+    # --- Execução ---
+
+    def executar(self, sessao: SessaoEscalonada, funcao, custo: float = 1.0):
+        """Espera a vez da sessão, executa `funcao()` e libera a vaga."""
+        chegada = time.time()
+        with self._cond:
+            etiqueta = max(self._tempo_virtual, sessao.ultima_etiqueta)
+            sessao.ultima_etiqueta = etiqueta + custo / sessao.peso
+            pedido = (sessao.faixa, etiqueta, next(self._sequencia))
+            heapq.heappush(self._fila, pedido)
+            while self._em_voo >= self.max_em_voo or self._fila[0] is not pedido:
+                self._cond.wait()
+            heapq.heappop(self._fila)
+            self._tempo_virtual = max(self._tempo_virtual, etiqueta)
+            self._em_voo += 1
+            sessao.em_voo += 1
+            espera = time.time() - chegada
+            sessao.espera_total += espera
+            sessao.espera_max = max(sessao.espera_max, espera)
+            # O próximo da fila pode ter vaga também
+            self._cond.notify_all()
+        try:
+            return funcao()
+        finally:
+            agora = time.time()
+            with self._cond:
+                self._em_voo -= 1
+                sessao.em_voo -= 1
+                sessao.atendidas += 1
+                self._atendidos.append((agora, sessao.session_id, custo))
+                while self._atendidos and self._atendidos[0][0] < agora - ESCALONADOR_JANELA_S:
+                    self._atendidos.popleft()
+                self._cond.notify_all()
+
+    # --- Métricas ---
+
+    def estado(self, sessao: SessaoEscalonada) -> dict:
+        """Métricas da sessão para o payload de progresso."""
+        with self._cond:
+            limite = time.time() - ESCALONADOR_JANELA_S
+            total = sum(custo for instante, _, custo in self._atendidos if instante >= limite)
+            da_sessao = sum(custo for instante, sid, custo in self._atendidos
+                            if instante >= limite and sid == sessao.session_id)
+            return {
+                'sched_priority_lane': sessao.faixa == FAIXA_PRIORITARIA,
+                'sched_weight': sessao.peso,
+                'sched_wait_avg_s': round(sessao.espera_total / sessao.atendidas, 3) if sessao.atendidas else 0,
+                'sched_wait_max_s': round(sessao.espera_max, 3),
+                'sched_throughput_share': round(da_sessao / total, 3) if total else 0,
+                'sched_active_sessions': len(self._sessoes),
+                'sched_in_flight': self._em_voo,
+                'sched_in_flight_cap': self.max_em_voo
+            }
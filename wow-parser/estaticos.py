@@ -0,0 +1,89 @@
+import os
+import gzip
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+ESTATICOS_MAX_AGE_S = int(os.environ.get('ESTATICOS_MAX_AGE_S', '300'))  # depois disso o navegador revalida com If-None-Match
+ESTATICOS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
+
+# Codificações na ordem de preferência do servidor (brotli só se o pacote opcional estiver instalado)
+CODIFICACOES = ('br', 'gzip')
+
+
+def _comprimir_brotli(dados: bytes):
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(dados, quality=11)
+
+
+def aceita_codificacoes(accept_encoding: str) -> set:
+    """Codificações do header Accept-Encoding com q > 0."""
+    aceitas = set()
+    for item in (accept_encoding or '').split(','):
+        nome, _, parametros = item.strip().partition(';')
+        parametros = parametros.replace(' ', '')
+        try:
+            peso = float(parametros[2:]) if parametros.startswith('q=') else 1.0
+        except ValueError:
+            peso = 1.0
+        if nome and peso > 0:
+            aceitas.add(nome.lower())
+    return aceitas
+
+
+class ArquivoEstatico:
+    """Conteúdo de um arquivo estático lido uma vez, com as versões comprimidas e o ETag do conteúdo."""
+
+    def __init__(self, caminho: str, content_type: str, variaveis: dict = None):
+        with open(caminho, 'rb') as arquivo:
+            self.dados = arquivo.read()
+        # `{{NOME}}` no arquivo vira o valor, antes do ETag e da compressão (valores fixos por instância)
+        for nome, valor in (variaveis or {}).items():
+            self.dados = self.dados.replace(('{{' + nome + '}}').encode(), str(valor).encode())
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha256(self.dados).hexdigest()[:32] + '"'
+        self.variantes = {'gzip': gzip.compress(self.dados, compresslevel=9, mtime=0)}
+        brotli = _comprimir_brotli(self.dados)
+        if brotli is not None:
+            self.variantes['br'] = brotli
+        logger.info(f"ESTATICOS - {os.path.basename(caminho)}: {len(self.dados)} bytes, "
+                    + ', '.join(f"{nome} {len(dados)}" for nome, dados in self.variantes.items()))
+
+    def responder(self, if_none_match: str = None, accept_encoding: str = None) -> tuple:
+        """(corpo, status, headers) da resposta: 304 se o ETag bate, senão a melhor variante aceita pelo cliente."""
+        headers = {
+            'Content-Type': self.content_type,
+            'ETag': self.etag,
+            'Cache-Control': f'public, max-age={ESTATICOS_MAX_AGE_S}',
+            'Vary': 'Accept-Encoding'
+        }
+        if if_none_match and (if_none_match.strip() == '*' or self.etag in [e.strip().removeprefix('W/') for e in if_none_match.split(',')]):
+            return b'', 304, headers
+        aceitas = aceita_codificacoes(accept_encoding)
+        for codificacao in CODIFICACOES:
+            if codificacao in aceitas and codificacao in self.variantes:
+                headers['Content-Encoding'] = codificacao
+                return self.variantes[codificacao], 200, headers
+        return self.dados, 200, headers
+
+
+_arquivos = {}
+_arquivos_lock = threading.Lock()
+
+
+def arquivo_estatico(nome: str, content_type: str = 'text/html; charset=utf-8', variaveis: dict = None) -> ArquivoEstatico:
+    """Arquivo de `templates/` carregado e comprimido no primeiro pedido; os seguintes saem da memória.
+    `variaveis` só é aplicado na primeira carga."""
+    arquivo = _arquivos.get(nome)
+    if arquivo is None:
+        with _arquivos_lock:
+            arquivo = _arquivos.get(nome)
+            if arquivo is None:
+                arquivo = _arquivos[nome] = ArquivoEstatico(os.path.join(ESTATICOS_DIR, nome), content_type, variaveis)
+    return arquivo
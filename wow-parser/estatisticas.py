@@ -0,0 +1,116 @@
+import os
+import threading
+
+# Variáveis de Configuração
+# Colunas usadas nos recortes (separadas por vírgula); vazio = todas as colunas extras da entrada
+ESTATISTICAS_DIMENSOES = [c.strip() for c in os.environ.get('ESTATISTICAS_DIMENSOES', '').split(',') if c.strip()]
+ESTATISTICAS_MAX_VALORES = int(os.environ.get('ESTATISTICAS_MAX_VALORES', '50'))  # acima disso a coluna sai dos recortes
+
+# Colunas que nunca viram recorte: o texto analisado e as colunas geradas
+COLUNAS_IGNORADAS = {'ordered_messages', 'raciocinio', 'classificacao_final'}
+
+# Rótulos canônicos (a comparação ignora maiúsculas/minúsculas e espaços)
+ROTULOS = {'normal': 'Normal', 'bom': 'Bom', 'wow': 'WoW', 'erro': 'Erro', 'n/a': 'N/A'}
+
+
+def normalizar_rotulo(valor) -> str:
+    """'WOW', ' wow ', 'WoW' -> 'WoW'; valores fora da lista viram 'Outro'."""
+    return ROTULOS.get(str(valor or '').strip().lower(), 'Outro')
+
+
+class AgregadorEstatisticas:
+    """
+    Estatísticas do arquivo inteiro, atualizadas linha a linha conforme as classificações terminam
+    (sem reler a saída): contagem por rótulo, recortes por coluna extra (ex.: `canal`) e latência
+    por classe. O estado é um dict serializável, salvo no manifesto do checkpoint para a retomada.
+    """
+
+    def __init__(self, estado: dict = None):
+        estado = estado or {}
+        self._lock = threading.Lock()
+        self.rotulos = dict(estado.get('rotulos', {}))
+        self.recortes = {coluna: {valor: dict(contagens) for valor, contagens in valores.items()}
+                         for coluna, valores in estado.get('recortes', {}).items()}
+        self.descartadas = set(estado.get('descartadas', []))
+        self.latencias = {rotulo: dict(valores) for rotulo, valores in estado.get('latencias', {}).items()}
+        self.dimensoes = estado.get('dimensoes')
+
+    def definir_dimensoes(self, fieldnames: list):
+        """Escolhe as colunas dos recortes a partir do cabeçalho (uma vez por sessão)."""
+        if self.dimensoes is None:
+            candidatas = ESTATISTICAS_DIMENSOES or [
+                c for c in fieldnames
+                if c not in COLUNAS_IGNORADAS and c.lower() != 'id' and not c.lower().endswith('_id')
+            ]
+            self.dimensoes = [c for c in candidatas if c in fieldnames]
+
+    def _contar(self, row: dict, rotulo: str, delta: int):
+        self.rotulos[rotulo] = self.rotulos.get(rotulo, 0) + delta
+        for coluna in self.dimensoes or []:
+            if coluna in self.descartadas:
+                continue
+            valores = self.recortes.setdefault(coluna, {})
+            valor = str(row.get(coluna) or '').strip() or '(vazio)'
+            if valor not in valores and len(valores) >= ESTATISTICAS_MAX_VALORES:
+                # Coluna com valores demais (ex.: ids) não serve como recorte
+                self.descartadas.add(coluna)
+                del self.recortes[coluna]
+                continue
+            contagens = valores.setdefault(valor, {})
+            contagens[rotulo] = contagens.get(rotulo, 0) + delta
+
+    def registrar(self, row: dict, classificacao, latencia: float = None):
+        """Conta uma linha concluída (`classificacao` None = linha sem mensagem)."""
+        rotulo = 'N/A' if classificacao is None else normalizar_rotulo(classificacao)
+        with self._lock:
+            self._contar(row, rotulo, 1)
+            if latencia is not None:
+                valores = self.latencias.setdefault(rotulo, {'n': 0, 'soma': 0.0, 'max': 0.0})
+                valores['n'] += 1
+                valores['soma'] += latencia
+                valores['max'] = max(valores['max'], latencia)
+
+    def substituir(self, row: dict, anterior, classificacao, latencia: float = None):
+        """Troca o rótulo de uma linha já contada (ex.: 'Erro' refeito na retomada)."""
+        with self._lock:
+            self._contar(row, normalizar_rotulo(anterior), -1)
+        self.registrar(row, classificacao, latencia)
+
+    def analisadas(self) -> int:
+        """Linhas já enviadas ao modelo (tudo menos 'N/A')."""
+        with self._lock:
+            return sum(n for rotulo, n in self.rotulos.items() if rotulo != 'N/A')
+
+    def estado(self) -> dict:
+        """Estado bruto, para salvar e recarregar."""
+        with self._lock:
+            return {
+                'rotulos': dict(self.rotulos),
+                'recortes': {coluna: {valor: dict(c) for valor, c in valores.items()} for coluna, valores in self.recortes.items()},
+                'descartadas': sorted(self.descartadas),
+                'latencias': {rotulo: dict(valores) for rotulo, valores in self.latencias.items()},
+                'dimensoes': self.dimensoes
+            }
+
+    def como_dict(self) -> dict:
+        """Estatísticas para o payload de progresso e o `stats` final."""
+        with self._lock:
+            return {
+                'normal_count': self.rotulos.get('Normal', 0),
+                'bom_count': self.rotulos.get('Bom', 0),
+                'wow_count': self.rotulos.get('WoW', 0),
+                'error_count': self.rotulos.get('Erro', 0),
+                'na_count': self.rotulos.get('N/A', 0),
+                'other_count': self.rotulos.get('Outro', 0),
+                'classified_rows': sum(self.rotulos.values()),
+                'breakdowns': {coluna: {valor: {r: n for r, n in c.items() if n} for valor, c in valores.items()}
+                               for coluna, valores in self.recortes.items()},
+                'latency_by_class': {
+                    rotulo: {
+                        'count': valores['n'],
+                        'avg_s': round(valores['soma'] / valores['n'], 3) if valores['n'] else 0,
+                        'max_s': round(valores['max'], 3)
+                    }
+                    for rotulo, valores in self.latencias.items()
+                }
+            }
@@ -0,0 +1,290 @@
+import os
+import json
+import math
+import time
+import logging
+import threading
+
+from lote_classificacao import estimar_tokens
+from streaming_csv import abrir_entrada
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+ETA_HISTORICO = os.environ.get('ETA_HISTORICO', 'gcs')                       # gcs | local | none
+ETA_HISTORICO_PATH = os.environ.get('ETA_HISTORICO_PATH', '/tmp/wow_eta.json')
+ETA_HISTORICO_BLOB = os.environ.get('ETA_HISTORICO_BLOB', 'telemetria/eta.json')
+PRE_SCAN_MAX_MB = float(os.environ.get('PRE_SCAN_MAX_MB', '16'))                  # bytes lidos pelo pré-scan (0 = arquivo inteiro)
+PRE_SCAN_AMOSTRA_LINHAS = int(os.environ.get('PRE_SCAN_AMOSTRA_LINHAS', '20000'))  # Parquet: linhas lidas (o total vem dos metadados)
+
+# Sem histórico: ~1s por chamada + custo por token, 80% da concorrência aproveitada
+LATENCIA_BASE_PADRAO = 1.0
+LATENCIA_POR_TOKEN_PADRAO = 0.0005
+EFICIENCIA_PADRAO = 0.8
+DECAIMENTO = 0.998         # peso das chamadas antigas na regressão (por chamada observada)
+Z_90 = 1.645               # intervalo de confiança de 90%
+ERROS_GUARDADOS = 30       # execuções usadas para calibrar o erro das previsões
+
+
+def pre_escanear(stream, coluna: str = 'ordered_messages', formato: str = 'csv', total_bytes: int = None) -> dict:
+    """
+    Passada barata pela entrada (sem chamar o modelo): linhas, linhas com texto e tokens estimados.
+    `stream` binário e posicionável; a posição original é restaurada no fim.
+    Roda no caminho da requisição, então o custo é limitado: CSV/JSONL leem até PRE_SCAN_MAX_MB
+    (bytes como armazenados, comprimidos se gzip) e extrapolam pela fração de `total_bytes`; o Parquet
+    pega o total de linhas dos metadados e lê só PRE_SCAN_AMOSTRA_LINHAS para os tokens.
+    Com amostra, o resultado traz `sampled_rows` e `rows_estimated` (linhas extrapoladas, não exatas).
+    """
+    posicao = stream.tell()
+    linhas = com_texto = caracteres = tokens = 0
+    limite_bytes = int(PRE_SCAN_MAX_MB * 1024 * 1024) if total_bytes else 0
+    fator = None
+    try:
+        # O leitor envolve o stream sem fechá-lo (o contador de bytes não repassa o close)
+        leitor, contador = abrir_entrada(stream, formato)
+        total_linhas = getattr(leitor, 'total_linhas', None)
+        for row in leitor:
+            linhas += 1
+            mensagem = row.get(coluna) or ''
+            if mensagem:
+                com_texto += 1
+                caracteres += len(mensagem)
+                tokens += estimar_tokens(mensagem)
+            if total_linhas is not None:
+                if linhas >= PRE_SCAN_AMOSTRA_LINHAS and linhas < total_linhas:
+                    fator = total_linhas / linhas
+                    break
+            elif limite_bytes and contador is not None and linhas % 1000 == 0 and contador.bytes_lidos >= limite_bytes:
+                if contador.bytes_lidos < total_bytes:
+                    fator = total_bytes / contador.bytes_lidos
+                break
+    finally:
+        stream.seek(posicao)
+    if fator is None:
+        return {'rows': linhas, 'rows_with_text': com_texto, 'chars': caracteres, 'tokens': tokens}
+    logger.info(f"ETA - Pré-scan por amostra: {linhas} linhas lidas, extrapoladas ×{fator:.1f}")
+    return {
+        'rows': total_linhas if total_linhas is not None else round(linhas * fator),
+        'rows_with_text': round(com_texto * fator),
+        'chars': round(caracteres * fator),
+        'tokens': round(tokens * fator),
+        'sampled_rows': linhas,
+        'rows_estimated': total_linhas is None
+    }
+
+
+class HistoricoETA:
+    """
+    Modelo persistido entre execuções:
+    - latência por chamada = base + custo_por_token × tokens (mínimos quadrados com decaimento);
+    - eficiência = chamadas em voo de fato / concorrência configurada (média móvel);
+    - erros relativos das previsões iniciais anteriores, usados para corrigir o viés e dar o intervalo.
+    """
+
+    def __init__(self, dados: dict = None):
+        dados = dados or {}
+        self.somas = dados.get('somas', {'n': 0.0, 'x': 0.0, 'y': 0.0, 'xx': 0.0, 'xy': 0.0, 'yy': 0.0})
+        self.eficiencia = dados.get('eficiencia', EFICIENCIA_PADRAO)
+        self.erros_log = dados.get('erros_log', [])
+        self.execucoes = dados.get('execucoes', 0)
+        self._lock = threading.Lock()
+
+    def observar_chamada(self, tokens: int, latencia: float):
+        with self._lock:
+            for chave in self.somas:
+                self.somas[chave] *= DECAIMENTO
+            self.somas['n'] += 1
+            self.somas['x'] += tokens
+            self.somas['y'] += latencia
+            self.somas['xx'] += tokens * tokens
+            self.somas['xy'] += tokens * latencia
+            self.somas['yy'] += latencia * latencia
+
+    def coeficientes(self) -> tuple:
+        """(base, custo_por_token, desvio dos resíduos)."""
+        with self._lock:
+            s = dict(self.somas)
+        if s['n'] < 5:
+            return LATENCIA_BASE_PADRAO, LATENCIA_POR_TOKEN_PADRAO, LATENCIA_BASE_PADRAO * 0.5
+        media_x, media_y = s['x'] / s['n'], s['y'] / s['n']
+        variancia_x = s['xx'] / s['n'] - media_x ** 2
+        if variancia_x <= 1e-9:
+            custo = 0.0
+        else:
+            custo = max(0.0, (s['xy'] / s['n'] - media_x * media_y) / variancia_x)
+        base = max(0.01, media_y - custo * media_x)
+        variancia_y = max(0.0, s['yy'] / s['n'] - media_y ** 2)
+        return base, custo, math.sqrt(variancia_y)
+
+    def registrar_execucao(self, previsto: float, real: float, eficiencia: float = None):
+        with self._lock:
+            if previsto > 0 and real > 0:
+                self.erros_log = (self.erros_log + [math.log(real / previsto)])[-ERROS_GUARDADOS:]
+            if eficiencia:
+                self.eficiencia = 0.7 * self.eficiencia + 0.3 * min(1.0, max(0.05, eficiencia))
+            self.execucoes += 1
+
+    def calibracao(self) -> tuple:
+        """(fator de viés, desvio do log do erro) das previsões anteriores."""
+        with self._lock:
+            erros = list(self.erros_log)
+        if len(erros) < 3:
+            return 1.0, 0.5
+        media = sum(erros) / len(erros)
+        desvio = math.sqrt(sum((e - media) ** 2 for e in erros) / (len(erros) - 1))
+        return math.exp(media), max(0.1, desvio)
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            return {'somas': dict(self.somas), 'eficiencia': self.eficiencia,
+                    'erros_log': list(self.erros_log), 'execucoes': self.execucoes,
+                    'atualizado_em': time.time()}
+
+
+# --- Persistência do histórico ---
+
+_historico = None
+_historico_lock = threading.Lock()
+
+
+def carregar_historico(obter_bucket=None) -> HistoricoETA:
+    """Histórico do processo (carregado uma vez do backend configurado)."""
+    global _historico
+    if _historico is None:
+        with _historico_lock:
+            if _historico is None:
+                dados = None
+                try:
+                    if ETA_HISTORICO == 'gcs' and obter_bucket:
+                        dados = json.loads(obter_bucket().blob(ETA_HISTORICO_BLOB).download_as_bytes())
+                    elif ETA_HISTORICO == 'local' and os.path.exists(ETA_HISTORICO_PATH):
+                        with open(ETA_HISTORICO_PATH, encoding='utf-8') as arquivo:
+                            dados = json.load(arquivo)
+                except Exception as e:
+                    logger.info(f"ETA - Sem histórico salvo ({e}), usando valores padrão")
+                _historico = HistoricoETA(dados)
+    return _historico
+
+
+def salvar_historico(historico: HistoricoETA, obter_bucket=None):
+    try:
+        dados = json.dumps(historico.como_dict())
+        if ETA_HISTORICO == 'gcs' and obter_bucket:
+            obter_bucket().blob(ETA_HISTORICO_BLOB).upload_from_string(dados, content_type='application/json')
+        elif ETA_HISTORICO == 'local':
+            with open(ETA_HISTORICO_PATH, 'w', encoding='utf-8') as arquivo:
+                arquivo.write(dados)
+    except Exception as e:
+        logger.warning(f"ETA - Falha ao salvar histórico: {e}")
+
+
+# --- Estimador de uma execução ---
+
+def _formatar(segundos: float) -> str:
+    segundos = int(max(0, segundos))
+    return f"{segundos // 60}min {segundos % 60}s" if segundos >= 60 else f"{segundos}s"
+
+
+class EstimadorETA:
+    """
+    ETA de uma execução com intervalo de confiança de 90%.
+    - Antes de começar: trabalho previsto (latência modelada de cada chamada, a partir do pré-scan)
+      dividido pelo paralelismo histórico, corrigido pelo viés das previsões anteriores.
+    - Durante: mede a vazão real em "segundos de trabalho previsto por segundo" e projeta o que falta;
+      o peso da medição ao vivo cresce com as chamadas concluídas e o intervalo vai estreitando.
+    """
+
+    def __init__(self, historico: HistoricoETA, linhas: int = None, linhas_com_texto: int = None, tokens: int = None,
+                 concorrencia: int = 8, tamanho_lote: int = 1):
+        self.historico = historico
+        self.linhas = linhas
+        self.linhas_com_texto = linhas_com_texto if linhas_com_texto is not None else linhas
+        self.tokens = tokens
+        self.concorrencia = max(1, concorrencia)
+        self.tamanho_lote = max(1, tamanho_lote)
+        self.base, self.custo_token, self.desvio_latencia = historico.coeficientes()
+        self._lock = threading.Lock()
+        self.chamadas = 0
+        self.latencia_total = 0.0
+        self.trabalho_feito = 0.0
+        self.previsao_inicial = None
+        self.fonte_inicial = None
+
+    def _trabalho(self, chamadas: float, tokens: float) -> float:
+        return chamadas * self.base + tokens * self.custo_token
+
+    def _resultado(self, segundos: float, fator_min: float, fator_max: float, fonte: str) -> dict:
+        return {
+            'eta_s': round(segundos, 1),
+            'eta_min_s': round(segundos * fator_min, 1),
+            'eta_max_s': round(segundos * fator_max, 1),
+            'eta_confidence': 0.9,
+            'eta_source': fonte,
+            'formatted': _formatar(segundos)
+        }
+
+    def inicial(self) -> dict:
+        """ETA antes do processamento (precisa do pré-scan)."""
+        if self.linhas_com_texto is None or self.tokens is None:
+            return None
+        chamadas = math.ceil(self.linhas_com_texto / self.tamanho_lote)
+        paralelismo = max(1.0, self.historico.eficiencia * self.concorrencia)
+        vies, desvio_log = self.historico.calibracao()
+        segundos = self._trabalho(chamadas, self.tokens) / paralelismo * vies
+        self.previsao_inicial = segundos
+        fonte = self.fonte_inicial = 'historico' if self.historico.execucoes else 'padrao'
+        return self._resultado(segundos, math.exp(-Z_90 * desvio_log), math.exp(Z_90 * desvio_log), fonte)
+
+    def observar(self, linhas: int, tokens: int, latencia: float):
+        """Registra uma chamada concluída (`linhas` com texto enviadas, `tokens` estimados, latência em s)."""
+        if latencia is None or linhas <= 0:
+            return
+        self.historico.observar_chamada(tokens, latencia)
+        with self._lock:
+            self.chamadas += 1
+            self.latencia_total += latencia
+            self.trabalho_feito += self._trabalho(1, tokens)
+
+    def atualizar(self, linhas_concluidas: int, tokens_concluidos: int, decorrido: float, total_linhas: int = None) -> dict:
+        """ETA refinado durante a execução."""
+        total_linhas = self.linhas or total_linhas
+        with self._lock:
+            chamadas, trabalho_feito = self.chamadas, self.trabalho_feito
+        if not total_linhas or decorrido <= 0 or chamadas == 0:
+            return self.inicial()
+
+        # Trabalho restante: pelos tokens do pré-scan, ou pela média por linha observada até agora
+        linhas_restantes = max(0, total_linhas - linhas_concluidas)
+        if self.tokens is not None:
+            tokens_restantes = max(0, self.tokens - tokens_concluidos)
+        else:
+            tokens_restantes = tokens_concluidos / max(1, linhas_concluidas) * linhas_restantes
+        fracao_texto = (self.linhas_com_texto / self.linhas) if self.linhas and self.linhas_com_texto is not None else 1.0
+        chamadas_restantes = math.ceil(linhas_restantes * fracao_texto / self.tamanho_lote)
+        trabalho_restante = self._trabalho(chamadas_restantes, tokens_restantes)
+
+        vazao = trabalho_feito / decorrido
+        ao_vivo = trabalho_restante / vazao if vazao > 0 else 0
+        espalhamento_vivo = Z_90 * 0.5 / math.sqrt(chamadas)
+
+        peso = chamadas / (chamadas + 20)
+        if self.previsao_inicial is not None:
+            restante_inicial = max(0.0, self.previsao_inicial - decorrido)
+            segundos = peso * ao_vivo + (1 - peso) * restante_inicial
+            _, desvio_log = self.historico.calibracao()
+            espalhamento = peso * espalhamento_vivo + (1 - peso) * Z_90 * desvio_log
+        else:
+            segundos, espalhamento = ao_vivo, espalhamento_vivo
+        return self._resultado(segundos, math.exp(-espalhamento), math.exp(espalhamento), 'ao_vivo')
+
+    def finalizar(self, decorrido: float, completa: bool = True):
+        """
+        Alimenta o histórico com a eficiência observada (Little: chamadas em voo = Σlatência / tempo) e,
+        em execuções completas previstas pelo histórico, com o erro da previsão inicial
+        (previsões feitas com os valores padrão não dizem nada sobre a calibração do modelo).
+        """
+        with self._lock:
+            latencia_total = self.latencia_total
+        eficiencia = (latencia_total / decorrido) / self.concorrencia if decorrido > 0 and latencia_total else None
+        previsto = self.previsao_inicial if completa and self.fonte_inicial == 'historico' else 0
+        self.historico.registrar_execucao(previsto, decorrido, eficiencia)
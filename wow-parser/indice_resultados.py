@@ -0,0 +1,286 @@
+import io
+import os
+import csv
+import gzip
+import json
+import base64
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from collections import OrderedDict
+
+from estatisticas import ESTATISTICAS_DIMENSOES, ESTATISTICAS_MAX_VALORES, COLUNAS_IGNORADAS, normalizar_rotulo
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+INDICE_RESULTADOS = os.environ.get('INDICE_RESULTADOS', '1') == '1'
+INDICE_LINHAS_BLOCO = int(os.environ.get('INDICE_LINHAS_BLOCO', '2000'))      # linhas por membro gzip na saída em stream
+RESULTADOS_POR_PAGINA = int(os.environ.get('RESULTADOS_POR_PAGINA', '50'))
+RESULTADOS_MAX_POR_PAGINA = int(os.environ.get('RESULTADOS_MAX_POR_PAGINA', '500'))
+RESULTADOS_FOLGA_LEITURA = 64 * 1024  # linhas separadas por menos que isso são lidas num único range
+INDICE_CACHE_SESSOES = 20
+
+COLUNA_ROTULO = 'classificacao_final'
+
+
+def caminho_indice(session_id: str) -> str:
+    return f"processados/{session_id}/indice.json.gz"
+
+
+def colunas_indexadas(fieldnames: list) -> list:
+    """`classificacao_final` e as mesmas colunas usadas nos recortes das estatísticas."""
+    candidatas = ESTATISTICAS_DIMENSOES or [
+        c for c in fieldnames
+        if c not in COLUNAS_IGNORADAS and c.lower() != 'id' and not c.lower().endswith('_id')
+    ]
+    return [COLUNA_ROTULO] + [c for c in candidatas if c in fieldnames and c != COLUNA_ROTULO]
+
+
+def valor_indexado(coluna: str, valor) -> str:
+    if coluna == COLUNA_ROTULO:
+        return normalizar_rotulo(valor)
+    return str(valor or '').strip() or '(vazio)'
+
+
+def _b64(dados: bytes) -> str:
+    return base64.b64encode(dados).decode('ascii')
+
+
+class ConstrutorIndice:
+    """
+    Índice da saída montado enquanto as linhas são gravadas, sem reler o CSV:
+    - bytes de cada linha no CSV descomprimido (os offsets saem da soma acumulada);
+    - blocos: (primeira linha, offset no objeto armazenado, offset no texto). Com gzip, cada bloco é um
+      membro gzip independente, que pode ser baixado com range e descomprimido sozinho;
+    - um bitmap por valor de `classificacao_final` e das colunas de recorte (bit i = linha i).
+    Colunas com valores distintos demais (acima de ESTATISTICAS_MAX_VALORES) saem do índice.
+    """
+
+    def __init__(self, fieldnames: list = None, comprimido: bool = False):
+        self.comprimido = comprimido
+        self.fieldnames = None
+        self.colunas = {}
+        self.tamanhos = array('I')
+        self.blocos = []
+        self.cabecalho = 0
+        self.bytes_texto = 0
+        if fieldnames:
+            self.definir_colunas(fieldnames)
+
+    def definir_colunas(self, fieldnames: list):
+        self.fieldnames = list(fieldnames)
+        self.colunas = {coluna: {} for coluna in colunas_indexadas(self.fieldnames)}
+
+    def registrar_cabecalho(self, tamanho: int):
+        self.cabecalho = self.bytes_texto = tamanho
+
+    def iniciar_bloco(self, offset_armazenado: int):
+        self.blocos.append([len(self.tamanhos), offset_armazenado, self.bytes_texto])
+
+    def adicionar(self, row: dict, tamanho: int):
+        linha = len(self.tamanhos)
+        if not self.blocos:
+            self.iniciar_bloco(0)
+        self.tamanhos.append(tamanho)
+        self.bytes_texto += tamanho
+        byte, bit = linha >> 3, 1 << (linha & 7)
+        for coluna in list(self.colunas):
+            bitmaps = self.colunas[coluna]
+            valor = valor_indexado(coluna, row.get(coluna))
+            bitmap = bitmaps.get(valor)
+            if bitmap is None:
+                if len(bitmaps) >= ESTATISTICAS_MAX_VALORES and coluna != COLUNA_ROTULO:
+                    del self.colunas[coluna]
+                    continue
+                bitmap = bitmaps[valor] = bytearray()
+            if len(bitmap) <= byte:
+                bitmap.extend(bytes(byte + 1 - len(bitmap)))
+            bitmap[byte] |= bit
+
+    def como_dict(self, objeto: str) -> dict:
+        return {
+            'versao': 1,
+            'objeto': objeto,
+            'gzip': self.comprimido,
+            'fieldnames': self.fieldnames,
+            'linhas': len(self.tamanhos),
+            'cabecalho': self.cabecalho,
+            'tamanhos': _b64(self.tamanhos.tobytes()),
+            'blocos': self.blocos,
+            'colunas': {coluna: {valor: _b64(bytes(bitmap)) for valor, bitmap in bitmaps.items()}
+                        for coluna, bitmaps in self.colunas.items()}
+        }
+
+    def salvar(self, bucket, session_id: str, objeto: str) -> str:
+        caminho = caminho_indice(session_id)
+        dados = gzip.compress(json.dumps(self.como_dict(objeto)).encode('utf-8'))
+        bucket.blob(caminho).upload_from_string(dados, content_type='application/gzip')
+        logger.info(f"INDICE - {len(self.tamanhos)} linhas, {len(self.blocos)} blocos, "
+                    f"colunas {list(self.colunas)} ({len(dados)} bytes) em {caminho}")
+        return caminho
+
+
+class EscritorIndexado:
+    """
+    Mesma interface do csv.DictWriter, alimentando o índice com os bytes de cada linha.
+    Se a saída aceitar `novo_membro()` (gzip), um membro novo começa a cada INDICE_LINHAS_BLOCO linhas.
+    """
+
+    def __init__(self, saida, fieldnames: list, indice: ConstrutorIndice, linhas_por_bloco: int = None):
+        self.saida = saida
+        self.indice = indice
+        self.linhas_por_bloco = linhas_por_bloco or INDICE_LINHAS_BLOCO
+        if indice.fieldnames is None:
+            indice.definir_colunas(fieldnames)
+        self._buffer = io.StringIO()
+        self._writer = csv.DictWriter(self._buffer, fieldnames=fieldnames)
+
+    def _serializar(self, escrever) -> str:
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        escrever()
+        return self._buffer.getvalue()
+
+    def writeheader(self):
+        texto = self._serializar(self._writer.writeheader)
+        self.saida.write(texto)
+        self.indice.iniciar_bloco(0)  # o primeiro bloco começa no cabeçalho
+        self.indice.registrar_cabecalho(len(texto.encode('utf-8')))
+
+    def writerow(self, row: dict):
+        linhas = len(self.indice.tamanhos)
+        if linhas and linhas % self.linhas_por_bloco == 0 and hasattr(self.saida, 'novo_membro'):
+            self.indice.iniciar_bloco(self.saida.novo_membro())
+        texto = self._serializar(lambda: self._writer.writerow(row))
+        self.saida.write(texto)
+        self.indice.adicionar(row, len(texto.encode('utf-8')))
+
+
+# --- Leitura paginada pelo índice ---
+
+class IndiceResultados:
+    """Índice carregado de uma sessão: filtra pelos bitmaps e lê do objeto só os ranges das linhas da página."""
+
+    def __init__(self, dados: dict):
+        self.objeto = dados['objeto']
+        self.comprimido = dados['gzip']
+        self.fieldnames = dados['fieldnames']
+        self.linhas = dados['linhas']
+        tamanhos = array('I')
+        tamanhos.frombytes(base64.b64decode(dados['tamanhos']))
+        self.tamanhos = tamanhos
+        self.offsets = array('Q', accumulate(tamanhos, initial=dados['cabecalho']))
+        self.blocos = dados['blocos']
+        self._primeiras = [bloco[0] for bloco in self.blocos]
+        self.colunas = {
+            coluna: {valor: int.from_bytes(base64.b64decode(bitmap), 'little') for valor, bitmap in bitmaps.items()}
+            for coluna, bitmaps in dados['colunas'].items()
+        }
+
+    def valores(self) -> dict:
+        """Contagem por valor de cada coluna indexada."""
+        return {coluna: {valor: mascara.bit_count() for valor, mascara in bitmaps.items()}
+                for coluna, bitmaps in self.colunas.items()}
+
+    def mascara(self, filtros: dict):
+        """AND entre colunas, OR entre os valores de uma coluna; None quando não há filtro."""
+        resultado = None
+        for coluna, valores in filtros.items():
+            if coluna not in self.colunas:
+                raise ValueError(f"Coluna '{coluna}' não indexada. Colunas disponíveis: {list(self.colunas)}")
+            mascara_coluna = 0
+            for valor in valores:
+                mascara_coluna |= self.colunas[coluna].get(valor_indexado(coluna, valor), 0)
+            resultado = mascara_coluna if resultado is None else resultado & mascara_coluna
+        return resultado
+
+    @staticmethod
+    def _selecionar(mascara: int, inicio: int, quantidade: int) -> list:
+        """Linhas (bits ligados) de número `inicio` até `inicio + quantidade`, pulando bytes zerados."""
+        linhas = []
+        vistos = 0
+        for posicao, byte in enumerate(mascara.to_bytes((mascara.bit_length() + 7) // 8, 'little')):
+            if not byte:
+                continue
+            ligados = byte.bit_count()
+            if vistos + ligados <= inicio:
+                vistos += ligados
+                continue
+            for bit in range(8):
+                if byte >> bit & 1:
+                    if vistos >= inicio:
+                        linhas.append(posicao * 8 + bit)
+                        if len(linhas) == quantidade:
+                            return linhas
+                    vistos += 1
+        return linhas
+
+    def pagina(self, filtros: dict, pagina: int, por_pagina: int) -> tuple:
+        """(números das linhas da página, total de linhas que passam no filtro)."""
+        inicio = (pagina - 1) * por_pagina
+        mascara = self.mascara(filtros)
+        if mascara is None:
+            return list(range(inicio, min(self.linhas, inicio + por_pagina))), self.linhas
+        return self._selecionar(mascara, inicio, por_pagina), mascara.bit_count()
+
+    def _ranges(self, linhas: list) -> list:
+        """[(início, fim exclusivo, deslocamento do texto no início)] a baixar do objeto armazenado."""
+        if self.comprimido:
+            # Cada bloco é um membro gzip: baixa os blocos inteiros que contêm as linhas
+            ranges = []
+            for indice in sorted({bisect_right(self._primeiras, linha) - 1 for linha in linhas}):
+                fim = self.blocos[indice + 1][1] if indice + 1 < len(self.blocos) else None
+                ranges.append((self.blocos[indice][1], fim, self.blocos[indice][2]))
+            return ranges
+        ranges = []
+        for linha in sorted(linhas):
+            inicio, fim = self.offsets[linha], self.offsets[linha + 1]
+            if ranges and inicio - ranges[-1][1] <= RESULTADOS_FOLGA_LEITURA:
+                ranges[-1] = (ranges[-1][0], fim, ranges[-1][2])
+            else:
+                ranges.append((inicio, fim, inicio))
+        return ranges
+
+    def ler_linhas(self, blob, linhas: list) -> tuple:
+        """(rows na ordem pedida, bytes baixados), com downloads por range sem transcodificação do GCS."""
+        trechos = []
+        baixados = 0
+        for inicio, fim, offset_texto in self._ranges(linhas):
+            dados = blob.download_as_bytes(start=inicio, end=fim - 1 if fim is not None else None, raw_download=True)
+            baixados += len(dados)
+            if self.comprimido:
+                dados = gzip.decompress(dados)
+            trechos.append((offset_texto, dados))
+
+        rows = []
+        for linha in linhas:
+            inicio, fim = self.offsets[linha], self.offsets[linha + 1]
+            offset_texto, dados = next((o, d) for o, d in reversed(trechos) if o <= inicio)
+            texto = dados[inicio - offset_texto:fim - offset_texto].decode('utf-8')
+            valores = next(csv.reader(io.StringIO(texto)), [])
+            rows.append(dict(zip(self.fieldnames, valores)))
+        return rows, baixados
+
+
+_indices = OrderedDict()
+_indices_lock = threading.Lock()
+
+
+def carregar_indice(bucket, session_id: str):
+    """Índice da sessão (em cache no processo); None se a sessão não tiver índice."""
+    with _indices_lock:
+        if session_id in _indices:
+            _indices.move_to_end(session_id)
+            return _indices[session_id]
+    blob = bucket.blob(caminho_indice(session_id))
+    if not blob.exists():
+        return None
+    indice = IndiceResultados(json.loads(gzip.decompress(blob.download_as_bytes())))
+    with _indices_lock:
+        _indices[session_id] = indice
+        while len(_indices) > INDICE_CACHE_SESSOES:
+            _indices.popitem(last=False)
+    return indice
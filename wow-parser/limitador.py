@@ -0,0 +1,197 @@
+import os
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+VERTEX_MAX_RPS = float(os.environ.get('VERTEX_MAX_RPS', '10'))          # teto da taxa de chamadas
+VERTEX_MIN_RPS = float(os.environ.get('VERTEX_MIN_RPS', '0.5'))
+VERTEX_MAX_CONCORRENCIA = int(os.environ.get('VERTEX_MAX_CONCORRENCIA', '16'))
+VERTEX_MAX_TENTATIVAS = int(os.environ.get('VERTEX_MAX_TENTATIVAS', '6'))
+BACKOFF_BASE = float(os.environ.get('VERTEX_BACKOFF_BASE', '1.0'))
+BACKOFF_MAX = float(os.environ.get('VERTEX_BACKOFF_MAX', '60'))
+
+# Erros de cota (o serviço pediu para desacelerar)
+ERROS_THROTTLE = {'ResourceExhausted', 'TooManyRequests'}
+# Erros transitórios do serviço ou da rede: vale tentar de novo
+ERROS_TRANSITORIOS = {
+    'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout', 'BadGateway',
+    'Aborted', 'Unknown', 'RetryError', 'TransportError', 'ConnectionError', 'ConnectionResetError',
+    'RemoteDisconnected', 'ProtocolError', 'Timeout', 'TimeoutError', 'ReadTimeout'
+}
+
+
+def classificar_erro(erro: Exception) -> str:
+    """Classifica o erro como 'throttle', 'transitorio' (ambos repetíveis) ou 'terminal'."""
+    atual = erro
+    while atual is not None:
+        nome = type(atual).__name__
+        codigo = getattr(atual, 'code', None)
+        codigo = codigo if isinstance(codigo, int) else None
+        if nome in ERROS_THROTTLE or codigo == 429:
+            return 'throttle'
+        if nome in ERROS_TRANSITORIOS or (codigo is not None and 500 <= codigo < 600):
+            return 'transitorio'
+        atual = atual.__cause__ or atual.__context__
+    return 'terminal'
+
+
+class TokenBucket:
+    """Token bucket compartilhado: limita a taxa média de chamadas, com rajadas até `capacidade`."""
+
+    def __init__(self, taxa: float, capacidade: float = None):
+        self.taxa = taxa
+        self.capacidade = capacidade or max(1.0, taxa)
+        self._tokens = self.capacidade
+        self._atualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._atualizado) * self.taxa)
+        self._atualizado = agora
+
+    def ajustar_taxa(self, taxa: float):
+        with self._lock:
+            self._repor()
+            self.taxa = taxa
+            self.capacidade = max(1.0, taxa)
+            self._tokens = min(self._tokens, self.capacidade)
+
+    def adquirir(self):
+        """Bloqueia até haver um token disponível."""
+        while True:
+            with self._lock:
+                self._repor()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+
+class ControleAIMD:
+    """
+    Controle AIMD (aumento aditivo, redução multiplicativa) da concorrência e da taxa permitidas.
+    - Cada sucesso aumenta o limite em ~1 por "janela" cheia de chamadas.
+    - Cada throttle corta o limite pela metade (no máximo uma vez por `resfriamento` segundos,
+      para que uma rajada de 429 simultâneos não derrube tudo para o mínimo).
+    """
+
+    def __init__(self, inicial: float, minimo: float, maximo: float, resfriamento: float = 2.0):
+        self.valor = inicial
+        self.minimo = minimo
+        self.maximo = maximo
+        self.resfriamento = resfriamento
+        self._ultima_reducao = 0.0
+
+    def sucesso(self):
+        self.valor = min(self.maximo, self.valor + 1.0 / max(1.0, self.valor))
+
+    def throttle(self) -> bool:
+        agora = time.monotonic()
+        if agora - self._ultima_reducao < self.resfriamento:
+            return False
+        self._ultima_reducao = agora
+        self.valor = max(self.minimo, self.valor / 2)
+        return True
+
+
+class LimitadorVertex:
+    """
+    Porta de entrada única para as chamadas ao Vertex AI do processo.
+    Combina token bucket (taxa), limite adaptativo de chamadas simultâneas (AIMD)
+    e novas tentativas com backoff exponencial e jitter para erros repetíveis.
+    """
+
+    def __init__(self, max_rps: float = None, max_concorrencia: int = None, max_tentativas: int = None):
+        max_rps = max_rps or VERTEX_MAX_RPS
+        max_concorrencia = max_concorrencia or VERTEX_MAX_CONCORRENCIA
+        self.max_tentativas = max_tentativas or VERTEX_MAX_TENTATIVAS
+
+        self._lock = threading.Condition()
+        self._taxa = ControleAIMD(max_rps, min(VERTEX_MIN_RPS, max_rps), max_rps)
+        self._concorrencia = ControleAIMD(max_concorrencia, 1, max_concorrencia)
+        self._bucket = TokenBucket(max_rps)
+        self._em_voo = 0
+
+        self.chamadas = 0
+        self.throttles = 0
+        self.tentativas_extras = 0
+        self.erros_terminais = 0
+
+    # --- Limite de chamadas simultâneas ---
+
+    def _entrar(self):
+        with self._lock:
+            while self._em_voo >= int(self._concorrencia.valor):
+                self._lock.wait()
+            self._em_voo += 1
+
+    def _sair(self):
+        with self._lock:
+            self._em_voo -= 1
+            self._lock.notify_all()
+
+    def _registrar_sucesso(self):
+        with self._lock:
+            self.chamadas += 1
+            self._concorrencia.sucesso()
+            self._taxa.sucesso()
+            self._lock.notify_all()
+        self._bucket.ajustar_taxa(self._taxa.valor)
+
+    def _registrar_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            reduziu = self._concorrencia.throttle()
+            self._taxa.throttle()
+        if reduziu:
+            self._bucket.ajustar_taxa(self._taxa.valor)
+            logger.warning(f"LIMITADOR - Throttle do Vertex AI: taxa {self._taxa.valor:.2f} req/s, concorrência {int(self._concorrencia.valor)}")
+
+    # --- Execução ---
+
+    def executar(self, funcao):
+        """Executa `funcao()` respeitando taxa/concorrência e repetindo em erros repetíveis."""
+        tentativa = 0
+        while True:
+            self._bucket.adquirir()
+            self._entrar()
+            try:
+                resultado = funcao()
+            except Exception as e:
+                tipo = classificar_erro(e)
+                if tipo == 'throttle':
+                    self._registrar_throttle()
+                if tipo == 'terminal' or tentativa + 1 >= self.max_tentativas:
+                    with self._lock:
+                        self.erros_terminais += 1
+                    raise
+                # Backoff exponencial com "full jitter"
+                espera = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** tentativa)))
+                tentativa += 1
+                with self._lock:
+                    self.tentativas_extras += 1
+                logger.debug(f"LIMITADOR - Erro {tipo} ({type(e).__name__}), nova tentativa {tentativa} em {espera:.1f}s")
+            else:
+                self._registrar_sucesso()
+                return resultado
+            finally:
+                self._sair()
+            time.sleep(espera)
+
+    def estado(self) -> dict:
+        """Estado atual do limitador para o payload de progresso."""
+        with self._lock:
+            return {
+                'rate_limit_rps': round(self._taxa.valor, 2),
+                'concurrency_limit': int(self._concorrencia.valor),
+                'in_flight': self._em_voo,
+                'throttle_count': self.throttles,
+                'retry_count': self.tentativas_extras,
+                'terminal_errors': self.erros_terminais
+            }
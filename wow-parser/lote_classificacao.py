@@ -0,0 +1,121 @@
+import os
+import json
+import logging
+
+from resposta_modelo import reparar_json
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração do modo em lote
+LOTE_MAX_ITENS = int(os.environ.get('LOTE_MAX_ITENS', '1'))  # 1 = modo em lote desligado
+LOTE_ORCAMENTO_TOKENS = int(os.environ.get('LOTE_ORCAMENTO_TOKENS', '6000'))
+
+INSTRUCAO_LOTE = """Classifique CADA interação da lista abaixo de forma independente, seguindo exatamente os mesmos critérios.
+Responda SOMENTE com um array JSON contendo um objeto por interação, no formato:
+[{"id": "<id da interação>", "raciocinio": "breve explicação", "classificacao_final": "Normal, Bom ou WoW"}]
+Use o mesmo "id" recebido e não omita nenhuma interação.
+
+Interações para Análise:
+"""
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa local e barata de tokens (~4 caracteres por token em português)."""
+    return len(texto or '') // 4 + 1
+
+
+def agrupar_em_lotes(itens, custo, orcamento_tokens: int = None, max_itens: int = None):
+    """
+    Agrupa itens consecutivos em lotes (gerador), sem passar de `max_itens` nem de `orcamento_tokens`.
+    O tamanho do lote se adapta ao comprimento das conversas: muitas curtas ou poucas longas.
+    Um item que sozinho estoura o orçamento vira um lote de um item.
+    """
+    orcamento_tokens = orcamento_tokens or LOTE_ORCAMENTO_TOKENS
+    max_itens = max(1, max_itens or LOTE_MAX_ITENS)
+
+    lote, tokens_lote = [], 0
+    for item in itens:
+        tokens = custo(item)
+        if lote and (len(lote) >= max_itens or tokens_lote + tokens > orcamento_tokens):
+            yield lote
+            lote, tokens_lote = [], 0
+        lote.append(item)
+        tokens_lote += tokens
+    if lote:
+        yield lote
+
+
+def montar_conteudo_lote(itens: list) -> str:
+    """Monta o conteúdo da chamada com as interações identificadas por id."""
+    interacoes = [{'id': id_item, 'interacao': texto} for id_item, texto in itens]
+    return INSTRUCAO_LOTE + json.dumps(interacoes, ensure_ascii=False, indent=1)
+
+
+def interpretar_resposta_lote(texto_resposta: str, ids_esperados) -> dict:
+    """
+    Lê o array JSON devolvido pelo modelo e retorna {id: resultado} apenas para ids esperados
+    com classificação preenchida. Ids faltando ou inválidos ficam de fora (serão reenviados).
+    Um array malformado passa pelo mesmo reparo da resposta individual antes de o lote ser descartado.
+    """
+    try:
+        dados = json.loads(texto_resposta)
+    except (TypeError, ValueError):
+        dados = reparar_json(texto_resposta, abertura='[')
+    if isinstance(dados, dict):
+        # Alguns modelos embrulham o array em um objeto: {"resultados": [...]}
+        listas = [v for v in dados.values() if isinstance(v, list)]
+        dados = listas[0] if listas else [dados]
+    if not isinstance(dados, list):
+        raise ValueError(f"Resposta em lote não é um array JSON: {type(dados).__name__}")
+
+    ids_esperados = set(ids_esperados)
+    resultados = {}
+    for elemento in dados:
+        if not isinstance(elemento, dict):
+            continue
+        campos = {str(k).lower(): v for k, v in elemento.items()}
+        id_item = str(campos.get('id', ''))
+        classificacao = campos.get('classificacao_final')
+        if id_item in ids_esperados and classificacao:
+            resultados[id_item] = {
+                'raciocinio': campos.get('raciocinio', ''),
+                'classificacao_final': classificacao
+            }
+    return resultados
+
+
+def classificar_em_lote(itens: list, gerar, classificar_um, contador=None) -> dict:
+    """
+    Classifica `itens` [(id, texto)] com uma chamada ao modelo por lote e devolve {id: resultado}.
+    - `gerar(conteudo)` faz a chamada ao modelo e retorna o texto da resposta.
+    - `classificar_um(texto)` classifica uma interação isolada (caminho normal, sem lote).
+    Se a resposta vier malformada mesmo depois do reparo, o lote é dividido ao meio e cada metade é
+    tentada de novo; se vier incompleta só os ids faltantes são reenviados. Assim uma linha ruim não
+    derruba as outras. Cada divisão ou reenvio conta como 'repedida' no `contador` (ContadorRespostas).
+    """
+    if not itens:
+        return {}
+    if len(itens) == 1:
+        id_item, texto = itens[0]
+        return {id_item: classificar_um(texto)}
+
+    try:
+        resultados = interpretar_resposta_lote(gerar(montar_conteudo_lote(itens)), [i for i, _ in itens])
+        if not resultados:
+            raise ValueError("nenhuma interação do lote foi reconhecida na resposta")
+    except Exception as e:
+        logger.warning(f"LOTE - Falha no lote de {len(itens)} interações, dividindo ao meio: {e}")
+        if contador:
+            contador.registrar('repedida')
+        meio = len(itens) // 2
+        resultados = classificar_em_lote(itens[:meio], gerar, classificar_um, contador)
+        resultados.update(classificar_em_lote(itens[meio:], gerar, classificar_um, contador))
+        return resultados
+
+    faltando = [item for item in itens if item[0] not in resultados]
+    if faltando:
+        logger.warning(f"LOTE - Resposta incompleta: {len(faltando)} de {len(itens)} interações serão reenviadas")
+        if contador:
+            contador.registrar('repedida')
+        resultados.update(classificar_em_lote(faltando, gerar, classificar_um, contador))
+    return resultados
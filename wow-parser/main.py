@@ -9,26 +9,81 @@ import traceback
 import logging
 import time
 import threading
-from google.cloud import storage
 import functions_framework
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part
 from werkzeug.utils import secure_filename
+from motor_classificacao import MAX_CONCORRENCIA, MotorClassificacao
+from cache_classificacao import ContadorCache, chave_cache, criar_cache
+from clientes import GerenciadorClientes
+from limitador import LimitadorVertex
+from streaming_csv import SAIDA_PARQUET, abrir_csv_saida_gcs, abrir_entrada, abrir_parquet_saida_gcs, detectar_formato, nome_base, parquet_disponivel
+from checkpoint import CHECKPOINT_LINHAS, CheckpointSessao, calcular_prazo
+from indice_resultados import INDICE_RESULTADOS, RESULTADOS_MAX_POR_PAGINA, RESULTADOS_POR_PAGINA, ConstrutorIndice, EscritorIndexado, carregar_indice
+from lote_classificacao import LOTE_MAX_ITENS, agrupar_em_lotes, classificar_em_lote
+from progresso import PROGRESSO_TTL_S, criar_armazenamento_progresso
+from tarefas import FilaCheia, PoolTarefas
+from escalonador import EscalonadorJusto
+from estatisticas import AgregadorEstatisticas
+from estimativa import EstimadorETA, carregar_historico, pre_escanear, salvar_historico
+from compactacao import COMPACTACAO_LENTA_MAX_EM_VOO, ContadorCompactacao, compactar_conversa
+from metricas import MetricasSessao, amostrar, metricas, metricas_sessao, obter_metricas_sessao
+from estaticos import arquivo_estatico
+from resposta_modelo import ESQUEMA_LOTE, ContadorRespostas, RespostaInvalida, config_geracao, normalizar_resultado, obter_resultado, resultado_do_cache
+from pre_classificador import COLUNA_NIVEL, NIVEL_LLM, ContadorCascata, carregar_pre_classificador
+from predicao_massa import PREDICAO_MASSA_MAX_JOBS, PredicaoMassa, criar_backend, id_requisicao, usar_predicao_massa
 
 # Configuração de logging
-logging.basicConfig(level=logging.INFO)
+# (LOG_LEVEL=DEBUG liga o log amostrado por linha; ver METRICAS_AMOSTRA_LOG)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
 
 # Variáveis de Configuração
 BUCKET_NAME = os.environ.get('BUCKET_NAME', 'iteng-entrada-analise')
 PROJECT_ID = "iteng-itsystems"
 LOCATION = "us-central1"
+MODEL_NAME = "gemini-2.5-flash-lite"
 
-# Cache global para progresso das sessões
-progress_cache = {}
+MAX_UPLOAD_MB = float(os.environ.get('MAX_UPLOAD_MB', '100'))  # limite do arquivo enviado (bytes comprimidos, se gzip/Parquet)
+MAX_GCS_MB = float(os.environ.get('MAX_GCS_MB', '5120'))       # limite da entrada lida de um gs:// (upload direto ao Storage)
+PROGRESS_INTERVAL = 1.0  # segundos entre atualizações de progresso durante o processamento
+SSE_DURACAO_MAX_S = int(os.environ.get('SSE_DURACAO_MAX_S', '300'))  # o navegador reconecta sozinho depois disso
+SSE_HEARTBEAT_S = 15  # comentário periódico para proxies não fecharem a conexão ociosa
 
-# Inicialização do Vertex AI
-vertexai.init(project=PROJECT_ID, location=LOCATION)
+# Cache de classificações (inicializado sob demanda)
+classification_cache = None
+classification_cache_lock = threading.Lock()
+
+# Clientes do Storage e do Gemini compartilhados por todas as requisições e threads.
+# Nada do SDK é importado ou inicializado aqui: o vertexai.init e o google.cloud.storage só rodam
+# na primeira rota que precisa deles, e o cold start (inclusive o GET / da página) não paga por isso.
+client_manager = GerenciadorClientes(PROJECT_ID, LOCATION)
+
+# Limitador de taxa/concorrência compartilhado por todas as chamadas ao Vertex AI do processo
+vertex_limiter = LimitadorVertex()
+
+# Escalonador justo: reparte as chamadas de classificação entre as sessões ativas da instância
+scheduler = EscalonadorJusto()
+
+# Faixa lenta: conversas acima do orçamento de tokens vão sozinhas e com poucas em voo por vez,
+# para não segurarem as chamadas curtas
+faixa_lenta = threading.BoundedSemaphore(max(1, COMPACTACAO_LENTA_MAX_EM_VOO))
+
+# Progresso das sessões: cópia local com TTL/limite de memória e, opcionalmente, backend compartilhado entre instâncias
+progress_store = criar_armazenamento_progresso(lambda: client_manager.storage().bucket(BUCKET_NAME))
+
+# Jobs de processamento em segundo plano (modo assíncrono do /process): poucos por vez, o resto em fila
+job_pool = PoolTarefas(ao_mudar_posicao=lambda job_id, posicao, na_fila: update_progress(
+    job_id, 0, 0, "queued", {'queue_position': posicao, 'jobs_queued': na_fila}
+))
+
+# Jobs do modo em massa: passam a maior parte do tempo esperando o batch prediction, por isso têm
+# um pool próprio e não ocupam as vagas dos jobs de processamento online
+bulk_pool = PoolTarefas(max_simultaneos=PREDICAO_MASSA_MAX_JOBS, ao_mudar_posicao=lambda job_id, posicao, na_fila: update_progress(
+    job_id, 0, 0, "queued", {'queue_position': posicao, 'jobs_queued': na_fila}
+))
+
+# Medidores exportados em /metrics junto com os contadores e histogramas do processo
+metricas.registrar_medidor(vertex_limiter.estado)
+metricas.registrar_medidor(job_pool.estado)
 
 # --- Prompt para Análise ---
 PROMPT = """
@@ -73,38 +128,150 @@ Tarefa Principal
             2 - Classificacao_final: A palavra final: Normal, Bom ou WoW.
 """
 
-def analisar_interacao(texto_interacao: str) -> dict:
-    """Chama o modelo Gemini para analisar o texto e retorna um dicionário."""
+def parte_texto(texto: str):
+    """Part do conteúdo enviado ao modelo (o SDK do Vertex AI só é importado na primeira classificação)."""
+    from vertexai.generative_models import Part
+    return Part.from_text(texto)
+
+def novo_contador_respostas() -> ContadorRespostas:
+    """Contador de respostas de uma execução; cada registro também soma no `respostas_modelo_total` do /metrics."""
+    return ContadorRespostas(lambda tipo: metricas.incrementar('respostas_modelo_total', tipo=tipo))
+
+def novo_contador_cascata(pre_classificador) -> ContadorCascata:
+    """Contador de níveis da cascata de uma execução; cada linha também soma no `linhas_nivel_total` do /metrics."""
+    return ContadorCascata(pre_classificador, lambda nivel: metricas.incrementar('linhas_nivel_total', nivel=nivel))
+
+def get_classification_cache():
+    """Retorna o cache de classificações do processo, criando-o na primeira chamada."""
+    global classification_cache
+    if classification_cache is None:
+        with classification_cache_lock:
+            if classification_cache is None:
+                classification_cache = criar_cache(lambda nome: get_storage_client().bucket(nome))
+    return classification_cache
+
+def analisar_interacao(texto_interacao: str, contador_cache: ContadorCache = None, medidor: MetricasSessao = None, contador_respostas: ContadorRespostas = None) -> dict:
+    """Chama o modelo Gemini para analisar o texto e retorna um dicionário.
+    Interações já classificadas com o mesmo prompt e modelo são servidas pelo cache (passando pelo parser, para
+    rótulos gravados antes do esquema saírem canônicos).
+    A chamada usa `response_schema` (enum dos rótulos) e a resposta passa pelo parser de `resposta_modelo`:
+    campos e rótulo canônicos, reparo de JSON malformado e, só se o reparo falhar, um novo pedido ao modelo
+    (contados em `contador_respostas`).
+    Os tempos da chamada e do parse e os tokens do `usage_metadata` vão para `medidor` (métricas da sessão).
+    """
+    cache = get_classification_cache()
+    chave = chave_cache(texto_interacao, PROMPT, MODEL_NAME)
+    resultado = resultado_do_cache(cache.obter(chave, contador_cache))
+    if resultado is not None:
+        return resultado
+    
+    medidor = medidor or MetricasSessao()
+    contador_respostas = contador_respostas or novo_contador_respostas()
+    tempo_modelo = [0.0]
     try:
-        logger.info(f"TESTE GEMINI - Iniciando análise para: {texto_interacao[:100]}...")
-        
-        # Testar inicialização do modelo
-        logger.info(f"TESTE GEMINI - Inicializando modelo gemini-2.5-flash-lite...")
-        model = GenerativeModel("gemini-2.5-flash-lite", system_instruction=[PROMPT])
-        logger.info(f"TESTE GEMINI - Modelo inicializado com sucesso")
-        
-        # Testar chamada da API
-        logger.info(f"TESTE GEMINI - Enviando requisição para Vertex AI...")
-        response = model.generate_content(
-            [Part.from_text(f"Interação para Análise: {texto_interacao}")],
-            generation_config={"response_mime_type": "application/json"}
-        )
-        logger.info(f"TESTE GEMINI - Resposta recebida: {response.text[:200]}...")
+        # Modelo reaproveitado do gerenciador de clientes
+        model = client_manager.modelo(MODEL_NAME, PROMPT)
+        
+        def gerar():
+            # Throttling (429) e erros transitórios são repetidos com backoff pelo limitador
+            inicio = time.perf_counter()
+            try:
+                with medidor.medir('modelo'):
+                    response = vertex_limiter.executar(lambda: model.generate_content(
+                        [parte_texto(f"Interação para Análise: {texto_interacao}")],
+                        generation_config=config_geracao()
+                    ))
+            except Exception:
+                medidor.registrar_chamada(ok=False)
+                raise
+            finally:
+                tempo_modelo[0] += time.perf_counter() - inicio
+            medidor.registrar_chamada(uso=getattr(response, 'usage_metadata', None))
+            if amostrar(logger):
+                logger.debug(f"GEMINI - Amostra: {texto_interacao[:100]}... -> {response.text[:200]}")
+            return response.text
         
-        # Testar parsing JSON
-        logger.info(f"TESTE GEMINI - Fazendo parse do JSON...")
-        resultado = json.loads(response.text)
-        logger.info(f"TESTE GEMINI - JSON parseado com sucesso: {resultado}")
+        inicio = time.perf_counter()
+        resultado = obter_resultado(gerar, contador_respostas)
+        medidor.observar('json_parse', time.perf_counter() - inicio - tempo_modelo[0])
         
+        cache.gravar(chave, resultado)
         return resultado
         
     except Exception as e:
-        logger.error(f"TESTE GEMINI - ERRO DETALHADO: {e}")
-        logger.error(f"TESTE GEMINI - TRACEBACK: {traceback.format_exc()}")
+        if not isinstance(e, RespostaInvalida):
+            client_manager.reportar_falha('modelo', e)
+        logger.error(f"GEMINI - ERRO DETALHADO: {e}")
+        logger.error(f"GEMINI - TRACEBACK: {traceback.format_exc()}")
         return {"raciocinio": "Erro no processamento da IA", "classificacao_final": "Erro"}
 
+def analisar_lote(textos: list, contador_cache: ContadorCache = None, medidor: MetricasSessao = None, contador_respostas: ContadorRespostas = None) -> list:
+    """Classifica várias interações com uma única chamada ao Gemini e retorna os resultados na mesma ordem.
+    Textos vazios retornam None; textos já em cache não são enviados ao modelo.
+    A chamada usa o esquema de array do lote; cada item volta canônico, e itens com rótulo inválido
+    são refeitos sozinhos por `analisar_interacao`.
+    """
+    medidor = medidor or MetricasSessao()
+    contador_respostas = contador_respostas or novo_contador_respostas()
+    cache = get_classification_cache()
+    resultados = [None] * len(textos)
+    pendentes = []
+    chaves = {}
+    
+    for indice, texto in enumerate(textos):
+        if not texto:
+            continue
+        chave = chave_cache(texto, PROMPT, MODEL_NAME)
+        resultado = resultado_do_cache(cache.obter(chave, contador_cache))
+        if resultado is not None:
+            resultados[indice] = resultado
+        else:
+            pendentes.append((str(indice), texto))
+            chaves[str(indice)] = chave
+    
+    if pendentes:
+        model = client_manager.modelo(MODEL_NAME, PROMPT)
+        individuais = set()  # resultados que já vieram de analisar_interacao (canônicos e contados)
+        
+        def analisar_um(texto):
+            resultado = analisar_interacao(texto, medidor=medidor, contador_respostas=contador_respostas)
+            individuais.add(id(resultado))
+            return resultado
+        
+        def gerar(conteudo):
+            try:
+                with medidor.medir('modelo'):
+                    response = vertex_limiter.executar(lambda: model.generate_content(
+                        [parte_texto(conteudo)],
+                        generation_config=config_geracao(ESQUEMA_LOTE)
+                    ))
+            except Exception as e:
+                medidor.registrar_chamada(ok=False)
+                client_manager.reportar_falha('modelo', e)
+                raise
+            # Cada interação do lote aparece uma vez como chave "interacao" no JSON enviado
+            medidor.registrar_chamada(uso=getattr(response, 'usage_metadata', None), linhas=conteudo.count('"interacao": '))
+            return response.text
+        
+        respostas = classificar_em_lote(pendentes, gerar, analisar_um, contador_respostas)
+        textos_pendentes = dict(pendentes)
+        for id_item, resultado in respostas.items():
+            if id(resultado) not in individuais:
+                try:
+                    resultado = normalizar_resultado(resultado)
+                    contador_respostas.registrar('valida')
+                except RespostaInvalida as e:
+                    logger.warning(f"LOTE - Item {id_item} com resposta inválida, refazendo sozinho: {e}")
+                    contador_respostas.registrar('repedida')
+                    resultado = analisar_um(textos_pendentes[id_item])
+            resultados[int(id_item)] = resultado
+            if resultado.get('classificacao_final') != 'Erro':
+                cache.gravar(chaves[id_item], resultado)
+    
+    return resultados
+
 def update_progress(session_id: str, current: int, total: int, status: str = "processing", extra_data: dict = None):
-    """Atualiza o progresso de uma sessão no cache."""
+    """Atualiza o progresso de uma sessão no armazenamento de progresso."""
     progress_data = {
         'current': current,
         'total': total,
@@ -116,26 +283,109 @@ def update_progress(session_id: str, current: int, total: int, status: str = "pr
     if extra_data:
         progress_data.update(extra_data)
     
-    progress_cache[session_id] = progress_data
+    progress_store.gravar(session_id, progress_data)
     logger.info(f"Progresso atualizado - Sessão: {session_id}, {current}/{total} ({progress_data['percentage']}%)")
 
-def estimate_processing_time(file_size_mb: float) -> dict:
-    """Estima o tempo de processamento baseado no tamanho do arquivo."""
-    # Estimativas baseadas em benchmarks reais
-    base_time_per_mb = 2.5  # segundos por MB para processamento de texto + IA
-    overhead = 10  # segundos de overhead para setup
+def progresso_final(progress_data: dict) -> bool:
+    """Indica se o progresso chegou ao fim (um 'completed' só é final quando já tem o link de download)."""
+    status = progress_data.get('status')
+    return status in ('error', 'interrupted', 'failed') or (status == 'completed' and 'download_url' in progress_data)
+
+def evento_sse(evento: str, dados: dict, event_id=None) -> str:
+    """Formata um evento Server-Sent Events."""
+    linhas = [f"id: {event_id}"] if event_id is not None else []
+    linhas.append(f"event: {evento}")
+    linhas.append(f"data: {json.dumps(dados, ensure_ascii=False)}")
+    return '\n'.join(linhas) + '\n\n'
+
+def stream_progresso(session_id: str, ultimo_id: str = None):
+    """
+    Gera os eventos SSE do progresso de uma sessão.
+    - `snapshot`: estado completo (sem o preview) na conexão ou reconexão com `Last-Event-ID` desatualizado.
+    - `delta`: só os campos que mudaram desde o último evento; nada é enviado se só o timestamp mudou.
+    - `final`: estado final completo, com `preview_data`; encerra o stream.
+    O `id` de cada evento é o `seq` do progresso: reconectando com o mesmo id, nada é reenviado.
+    """
+    yield "retry: 3000\n\n"
+    seq = int(ultimo_id) if ultimo_id and ultimo_id.isdigit() else None
+    enviado = None
+    fim = time.time() + SSE_DURACAO_MAX_S
     
-    estimated_seconds = (file_size_mb * base_time_per_mb) + overhead
+    while True:
+        restante = fim - time.time()
+        if restante <= 0:
+            return
+        progress_data = progress_store.aguardar(session_id, seq, min(SSE_HEARTBEAT_S, restante))
+        if progress_data is None or progress_data.get('seq') == seq:
+            yield ": keep-alive\n\n"
+            continue
+        
+        seq = progress_data.get('seq')
+        if progresso_final(progress_data):
+            yield evento_sse('final', progress_data, seq)
+            return
+        
+        atual = {chave: valor for chave, valor in progress_data.items() if chave != 'preview_data'}
+        if enviado is None:
+            yield evento_sse('snapshot', atual, seq)
+        else:
+            delta = {chave: valor for chave, valor in atual.items()
+                     if chave not in ('timestamp', 'seq') and enviado.get(chave) != valor}
+            if delta:
+                yield evento_sse('delta', delta, seq)
+        enviado = atual
+
+def bucket_principal():
+    return client_manager.storage().bucket(BUCKET_NAME)
+
+def criar_estimador(pre_scan: dict = None, max_concorrencia: int = None, tamanho_lote: int = None) -> EstimadorETA:
+    """Estimador de ETA da sessão, com o histórico de latências das execuções anteriores."""
+    pre_scan = pre_scan or {}
+    return EstimadorETA(
+        carregar_historico(bucket_principal),
+        linhas=pre_scan.get('rows'),
+        linhas_com_texto=pre_scan.get('rows_with_text'),
+        tokens=pre_scan.get('tokens'),
+        concorrencia=max_concorrencia or MAX_CONCORRENCIA,
+        tamanho_lote=max(1, tamanho_lote or LOTE_MAX_ITENS)
+    )
+
+def estimate_processing_time(file_size_mb: float, pre_scan: dict = None) -> dict:
+    """Estima o tempo de processamento com intervalo de confiança de 90%.
+    Com `pre_scan` (linhas e tokens do arquivo), usa o modelo calibrado pelas execuções anteriores;
+    sem ele, cai na regra fixa por MB com um intervalo largo.
+    """
+    estimativa = criar_estimador(pre_scan).inicial() if pre_scan else None
+    if estimativa is None:
+        # Estimativas baseadas em benchmarks reais
+        base_time_per_mb = 2.5  # segundos por MB para processamento de texto + IA
+        overhead = 10  # segundos de overhead para setup
+        segundos = (file_size_mb * base_time_per_mb) + overhead
+        estimativa = {'eta_s': round(segundos, 1), 'eta_min_s': round(segundos * 0.5, 1), 'eta_max_s': round(segundos * 2, 1),
+                      'eta_confidence': 0.9, 'eta_source': 'tamanho'}
+    
+    estimated_seconds = estimativa['eta_s']
     estimated_minutes = estimated_seconds / 60
     
     return {
         "seconds": int(estimated_seconds),
         "minutes": round(estimated_minutes, 1),
-        "formatted": f"{int(estimated_minutes)}min {int(estimated_seconds % 60)}s" if estimated_minutes >= 1 else f"{int(estimated_seconds)}s"
+        "formatted": f"{int(estimated_minutes)}min {int(estimated_seconds % 60)}s" if estimated_minutes >= 1 else f"{int(estimated_seconds)}s",
+        "min_seconds": int(estimativa['eta_min_s']),
+        "max_seconds": int(estimativa['eta_max_s']),
+        "confidence": estimativa['eta_confidence'],
+        "source": estimativa['eta_source'],
+        "rows": (pre_scan or {}).get('rows'),
+        "tokens": (pre_scan or {}).get('tokens')
     }
 
-def make_blob_public(bucket_name: str, blob_path: str) -> str:
+def make_blob_public(bucket_name: str, blob_path: str, session_id: str = None) -> str:
     """Torna o blob público e retorna a URL pública."""
+    medidor = metricas_sessao(session_id) if session_id else MetricasSessao()
+    with medidor.medir('blob_publico'):
+        return _tornar_publico(bucket_name, blob_path)
+
+def _tornar_publico(bucket_name: str, blob_path: str) -> str:
     try:
         storage_client = get_storage_client()
         if not storage_client:
@@ -154,157 +404,646 @@ def make_blob_public(bucket_name: str, blob_path: str) -> str:
         
         return public_url
     except Exception as e:
+        client_manager.reportar_falha('storage', e)
         logger.error(f"Erro ao tornar blob público: {e}")
         logger.error(traceback.format_exc())
         # Fallback: retornar URL direta mesmo sem permissão pública
         return f"https://storage.googleapis.com/{bucket_name}/{blob_path}"
 
-def processar_csv_streaming(csv_content: str, session_id: str, max_preview_rows: int = 50) -> tuple:
-    """Processa um CSV aplicando o prompt com updates de progresso em tempo real."""
+def processar_csv_streaming(csv_source, session_id: str, max_preview_rows: int = 50, max_concorrencia: int = None, tamanho_lote: int = None, output_stream=None, total_bytes: int = None, checkpoint=None, pular_linhas: int = 0, prazo: float = None, agregador: AgregadorEstatisticas = None, pre_scan: dict = None, formato: str = 'csv', abrir_saida_parquet=None, indice: ConstrutorIndice = None, classificador=None) -> tuple:
+    """Processa um CSV aplicando o prompt com updates de progresso em tempo real.
+    As chamadas ao modelo rodam em paralelo (até `max_concorrencia` em voo) e a saída mantém a ordem de entrada.
+    Com `tamanho_lote` > 1 várias interações são enviadas em cada chamada (modo em lote).
+    
+    `csv_source` pode ser um stream binário (lido de forma incremental) ou um `str`.
+    Se `output_stream` for informado, as linhas são escritas nele à medida que ficam prontas e o
+    primeiro item do retorno é None; caso contrário o CSV completo é devolvido como `str`.
+    Com stream de entrada e `total_bytes`, o progresso é estimado pelos bytes já consumidos.
+    `formato` ('csv', 'jsonl' ou 'parquet') escolhe o leitor; CSV e JSONL podem vir comprimidos com gzip.
+    `abrir_saida_parquet(fieldnames)`, se informado, abre um writer Parquet que recebe as mesmas linhas.
+    Com `indice`, a saída é gravada por um EscritorIndexado, que monta o índice de resultados linha a linha.
+    `classificador(textos)`, se informado, substitui as chamadas ao modelo: recebe os textos compactados de
+    um lote e devolve os resultados na mesma ordem (None para texto vazio). É o join do modo em massa.
+    
+    Com `checkpoint`, as linhas prontas são salvas em partes no Storage; `pular_linhas` ignora as
+    linhas já salvas (retomada) e `prazo` (epoch) faz o processamento parar de aceitar linhas novas
+    antes do timeout da função. Nesse caso `stats['interrupted']` fica True.
+    
+    As estatísticas cobrem o arquivo inteiro: um `AgregadorEstatisticas` é atualizado a cada linha
+    concluída e publicado em cada atualização de progresso (na retomada, `agregador` já vem com as
+    linhas anteriores).
+    
+    Antes da classificação cada conversa é compactada (roteiros e repetições saem, e o que passa do
+    orçamento de tokens é truncado preservando início e fim); o original continua na saída. As linhas
+    acima do orçamento vão pela faixa lenta e os tokens economizados saem no progresso e nas estatísticas.
+    
+    Com um pré-classificador treinado, a cascata decide localmente as conversas de rotina com confiança acima
+    do limiar (só elas deixam de ir ao modelo); a coluna `nivel_classificacao` diz qual nível decidiu a linha.
+    
+    Os tempos por etapa (csv_parse, fila, modelo, json_parse) e os tokens ficam nas métricas da sessão
+    e saem em `timings` no progresso e nas estatísticas finais.
+    
+    O ETA publicado no progresso vem de um `EstimadorETA`: com `pre_scan` (linhas e tokens do arquivo)
+    o total de linhas é exato e a previsão inicial é refinada pela vazão medida durante a execução.
+    """
+    sessao_escalonada = None
     try:
         logger.info(f"PROCESSAMENTO - Iniciando para sessão: {session_id}")
-        logger.info(f"PROCESSAMENTO - Tamanho do CSV: {len(csv_content)} chars")
+        if isinstance(csv_source, str):
+            total_bytes = total_bytes or len(csv_source.encode('utf-8'))
+        logger.info(f"PROCESSAMENTO - Tamanho do CSV: {total_bytes or 'desconhecido'} bytes")
         
-        # Ler o CSV
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
-        fieldnames = list(csv_reader.fieldnames)
+        # Ler o CSV de forma incremental
+        csv_reader, contador_bytes = abrir_entrada(csv_source, formato)
+        fieldnames = list(csv_reader.fieldnames or [])
         logger.info(f"PROCESSAMENTO - Colunas encontradas: {fieldnames}")
         
         # Verificar se tem a coluna obrigatória
         if 'ordered_messages' not in fieldnames:
             raise Exception(f"Coluna 'ordered_messages' não encontrada. Colunas disponíveis: {fieldnames}")
         
-        fieldnames = fieldnames + ['raciocinio', 'classificacao_final']
-        
-        # Primeiro, contar total de linhas para progresso
-        csv_reader_count = csv.DictReader(io.StringIO(csv_content))
-        total_rows = sum(1 for row in csv_reader_count)
-        logger.info(f"PROCESSAMENTO - Total de linhas para processar: {total_rows}")
+        fieldnames = fieldnames + ['raciocinio', 'classificacao_final', COLUNA_NIVEL]
+        if checkpoint is not None and not checkpoint.fieldnames:
+            checkpoint.iniciar(fieldnames)
         
-        # Inicializar progresso
-        update_progress(session_id, 0, total_rows, "starting")
+        # Inicializar progresso (o total de linhas é estimado durante a leitura, sem passada extra)
+        update_progress(session_id, 0, 0, "starting")
         
         # Criar CSV de saída
-        output = io.StringIO()
-        csv_writer = csv.DictWriter(output, fieldnames=fieldnames)
-        csv_writer.writeheader()
+        # (com checkpoint e sem stream de saída, as partes salvas são a saída)
+        output = output_stream
+        if output is None and checkpoint is None:
+            output = io.StringIO()
+        if output is None:
+            csv_writer = None
+        elif indice is not None:
+            csv_writer = EscritorIndexado(output, fieldnames, indice)
+        else:
+            csv_writer = csv.DictWriter(output, fieldnames=fieldnames)
+        if csv_writer:
+            csv_writer.writeheader()
+        saida_parquet = abrir_saida_parquet(fieldnames) if abrir_saida_parquet else None
         
-        processed_count = 0
+        # Na retomada, a contagem de analisadas continua das linhas já salvas no checkpoint
+        processed_count = checkpoint.estatisticas.analisadas() if checkpoint is not None and pular_linhas else 0
         preview_data = []
         
-        # Determinar tamanho do chunk baseado no número total de linhas
-        if total_rows <= 100:
-            chunk_size = 5
-        elif total_rows <= 500:
-            chunk_size = 10
-        elif total_rows <= 1000:
-            chunk_size = 20
-        else:
-            chunk_size = 50
+        start_time = time.time()
+        motor = MotorClassificacao(max_concorrencia)
+        tamanho_lote = max(1, tamanho_lote or LOTE_MAX_ITENS)
+        logger.info(f"PROCESSAMENTO - Concorrência máxima: {motor.max_concorrencia} chamadas em voo, até {tamanho_lote} interações por chamada")
         
-        # Resetar o reader
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
+        # Contadores atualizados pelas threads do motor, na ordem em que as chamadas terminam
+        progresso_lock = threading.Lock()
+        contadores = {'lidas': 0, 'concluidas': pular_linhas, 'analisadas': processed_count, 'tokens': 0, 'ultimo_reporte': 0.0, 'interrompido': False}
+        contador_cache = ContadorCache()
+        contador_respostas = novo_contador_respostas()
+        contador_compactacao = ContadorCompactacao()
+        compactadas = {}  # id(row) -> compactação, até a linha ser escrita
+        pre_classificador = carregar_pre_classificador(bucket_principal)
+        contador_cascata = novo_contador_cascata(pre_classificador)
+        decididas_local = {}  # id(row) -> resultado do pré-classificador, até a linha ser escrita
+        latencias = {}  # id(row) -> latência da chamada, até a linha entrar no checkpoint
+        sessao_escalonada = scheduler.registrar(session_id, total_bytes=total_bytes)
+        agregador = agregador or AgregadorEstatisticas()
+        agregador.definir_dimensoes(fieldnames)
+        medidor = metricas_sessao(session_id)
+        estimador = criar_estimador(pre_scan if not pular_linhas else None, motor.max_concorrencia, tamanho_lote)
+        estimador.inicial()
         
-        start_time = time.time()
+        def estimar_total_linhas():
+            # Com pré-scan completo o total é conhecido; senão, linhas lidas / fração de bytes consumidos
+            # (sem stream binário, usa as linhas lidas até agora)
+            if pre_scan and not pular_linhas and not pre_scan.get('rows_estimated'):
+                return pre_scan['rows']
+            if getattr(csv_reader, 'total_linhas', None) is not None:
+                return csv_reader.total_linhas
+            lidas = contadores['lidas']
+            if contador_bytes and total_bytes and contador_bytes.bytes_lidos > 0:
+                fracao = min(1.0, contador_bytes.bytes_lidos / total_bytes)
+                return max(lidas, round(lidas / fracao))
+            return lidas
         
-        for row_index, row in enumerate(csv_reader, 1):
-            # Verificar se existe a coluna 'ordered_messages'
-            if 'ordered_messages' in row and row['ordered_messages']:
-                resultado = analisar_interacao(row['ordered_messages'])
-                row['raciocinio'] = resultado.get('raciocinio', 'Erro no processamento')
-                row['classificacao_final'] = resultado.get('classificacao_final', 'Erro')
-                processed_count += 1
-            else:
-                row['raciocinio'] = 'Sem mensagem para analisar'
-                row['classificacao_final'] = 'N/A'
+        def linhas_lidas():
+            leitor = iter(csv_reader)
+            while True:
+                inicio = time.perf_counter()
+                row = next(leitor, None)
+                if row is None:
+                    return
+                medidor.observar('csv_parse', time.perf_counter() - inicio)
+                contadores['lidas'] += 1
+                if contadores['lidas'] <= pular_linhas:
+                    continue
+                # Perto do timeout: parar de aceitar linhas; as que estão em voo terminam normalmente
+                if prazo and time.time() >= prazo:
+                    contadores['lidas'] -= 1
+                    contadores['interrompido'] = True
+                    logger.warning(f"PROCESSAMENTO - Prazo da função próximo, parando na linha {contadores['lidas']}")
+                    return
+                compactacao = compactadas[id(row)] = compactar_conversa(row.get('ordered_messages') or '')
+                if row.get('ordered_messages'):
+                    contador_compactacao.registrar(compactacao)
+                # Primeiro nível da cascata: rotina com confiança alta não vai ao modelo
+                decisao = pre_classificador.decidir(compactacao['texto']) if pre_classificador else None
+                if decisao is not None:
+                    decididas_local[id(row)] = decisao
+                yield row
+        
+        def classificar_linhas(lote):
+            # Texto compactado (o modelo não vê roteiros, repetições nem o miolo de conversas enormes)
+            textos = [compactadas[id(row)]['texto'] for row in lote]
+            if len(lote) == 1 and not textos[0]:
+                return [None], None
+            # Só as linhas que o pré-classificador não decidiu vão ao modelo
+            locais = [decididas_local.get(id(row)) for row in lote]
+            pendentes = [indice for indice, local in enumerate(locais) if local is None]
+            if not pendentes:
+                return locais, None
+            textos = [textos[indice] for indice in pendentes]
+            
+            enfileirado = time.perf_counter()
             
-            csv_writer.writerow(row)
+            def chamar():
+                # Latência medida só na chamada, sem a espera no escalonador
+                medidor.observar('fila', time.perf_counter() - enfileirado)
+                inicio = time.time()
+                if classificador is not None:
+                    respostas = classificador(textos)
+                elif len(textos) == 1:
+                    respostas = [analisar_interacao(textos[0], contador_cache, medidor, contador_respostas)]
+                else:
+                    respostas = analisar_lote(textos, contador_cache, medidor, contador_respostas)
+                resultados = list(locais)
+                for indice, resultado in zip(pendentes, respostas):
+                    resultados[indice] = resultado
+                return resultados, time.time() - inicio
             
-            # Guardar dados para preview (apenas primeiras linhas)
-            if len(preview_data) < max_preview_rows:
-                preview_data.append(dict(row))
+            if len(lote) == 1 and compactadas[id(lote[0])]['acima_orcamento']:
+                with faixa_lenta:
+                    return scheduler.executar(sessao_escalonada, chamar, custo=len(lote))
+            return scheduler.executar(sessao_escalonada, chamar, custo=len(lote))
+        
+        def ao_concluir(lote, concluido):
+            resultados, latencia = concluido
+            for row, resultado in zip(lote, resultados):
+                # Nível antes do agregador: a coluna também entra nos recortes das estatísticas
+                if resultado is not None:
+                    row[COLUNA_NIVEL] = resultado.get(COLUNA_NIVEL, NIVEL_LLM)
+                    contador_cascata.registrar(row[COLUNA_NIVEL])
+                else:
+                    row[COLUNA_NIVEL] = 'N/A'
+                agregador.registrar(row, resultado.get('classificacao_final', 'Erro') if resultado is not None else None, latencia)
+                latencias[id(row)] = latencia
+            # Tokens do texto original, na mesma medida do pré-scan do ETA
+            com_texto = [compactadas[id(row)] for row in lote if row.get('ordered_messages')]
+            tokens = sum(compactacao['tokens_originais'] for compactacao in com_texto)
+            # A latência da chamada é só das linhas que foram ao modelo
+            no_modelo = [compactadas[id(row)] for row in lote if row.get('ordered_messages') and id(row) not in decididas_local]
+            estimador.observar(len(no_modelo), sum(compactacao['tokens_originais'] for compactacao in no_modelo), latencia)
             
-            # Atualizar progresso em chunks ou ao finalizar
-            if row_index % chunk_size == 0 or row_index == total_rows:
-                elapsed_time = time.time() - start_time
-                avg_time_per_row = elapsed_time / row_index if row_index > 0 else 0
-                remaining_rows = total_rows - row_index
-                estimated_remaining_time = remaining_rows * avg_time_per_row
+            with progresso_lock:
+                contadores['concluidas'] += len(lote)
+                contadores['analisadas'] += sum(1 for resultado in resultados if resultado is not None)
+                contadores['tokens'] += tokens
+                concluidas = contadores['concluidas']
                 
-                update_progress(
-                    session_id, 
-                    row_index, 
-                    total_rows, 
-                    "processing",
-                    {
-                        'processed_count': processed_count,
-                        'elapsed_time': round(elapsed_time, 1),
-                        'estimated_remaining': round(estimated_remaining_time, 1),
-                        'avg_time_per_row': round(avg_time_per_row, 2)
-                    }
-                )
+                # Atualizar progresso no máximo uma vez por intervalo
+                agora = time.time()
+                if agora - contadores['ultimo_reporte'] >= PROGRESS_INTERVAL:
+                    contadores['ultimo_reporte'] = agora
+                    total_estimado = max(concluidas, estimar_total_linhas())
+                    elapsed_time = agora - start_time
+                    avg_time_per_row = elapsed_time / (concluidas - pular_linhas) if concluidas > pular_linhas else 0
+                    eta = estimador.atualizar(
+                        concluidas - pular_linhas, contadores['tokens'], elapsed_time, total_estimado - pular_linhas
+                    ) or {'eta_s': round((total_estimado - concluidas) * avg_time_per_row, 1)}
+                    
+                    update_progress(
+                        session_id, 
+                        concluidas, 
+                        total_estimado, 
+                        "processing",
+                        {
+                            'total_is_estimate': not (pre_scan and not pular_linhas and not pre_scan.get('rows_estimated')) and getattr(csv_reader, 'total_linhas', None) is None,
+                            'bytes_read': contador_bytes.bytes_lidos if contador_bytes else None,
+                            'total_bytes': total_bytes,
+                            'processed_count': contadores['analisadas'],
+                            'elapsed_time': round(elapsed_time, 1),
+                            'estimated_remaining': eta['eta_s'],
+                            'eta_min_s': eta.get('eta_min_s'),
+                            'eta_max_s': eta.get('eta_max_s'),
+                            'eta_source': eta.get('eta_source'),
+                            'avg_time_per_row': round(avg_time_per_row, 2),
+                            'concurrency': motor.max_concorrencia,
+                            'batch_size': tamanho_lote,
+                            'live_stats': agregador.como_dict(),
+                            'timings': medidor.como_dict(),
+                            **contador_cache.como_dict(),
+                            **contador_respostas.como_dict(),
+                            **contador_cascata.como_dict(),
+                            **contador_compactacao.como_dict(),
+                            **vertex_limiter.estado(),
+                            **scheduler.estado(sessao_escalonada)
+                        }
+                    )
+        
+        # Lotes adaptativos: mais interações curtas ou menos longas por chamada, dentro do orçamento de tokens
+        # (linhas da faixa lenta vão sozinhas: custo acima de qualquer orçamento de lote)
+        lotes = agrupar_em_lotes(
+            linhas_lidas(),
+            lambda row: 0 if id(row) in decididas_local
+            else float('inf') if compactadas[id(row)]['acima_orcamento'] else compactadas[id(row)]['tokens'],
+            max_itens=tamanho_lote
+        )
+        
+        indice_saida = pular_linhas
+        for lote, (resultados, _) in motor.mapear(classificar_linhas, lotes, ao_concluir):
+            for row, resultado in zip(lote, resultados):
+                if resultado is not None:
+                    row['raciocinio'] = resultado.get('raciocinio', 'Erro no processamento')
+                    row['classificacao_final'] = resultado.get('classificacao_final', 'Erro')
+                    processed_count += 1
+                else:
+                    row['raciocinio'] = 'Sem mensagem para analisar'
+                    row['classificacao_final'] = 'N/A'
+                
+                if csv_writer:
+                    csv_writer.writerow(row)
+                if saida_parquet:
+                    saida_parquet.writerow(row)
+                if checkpoint is not None:
+                    checkpoint.adicionar(indice_saida, row, latencias.get(id(row)))
+                indice_saida += 1
+                compactadas.pop(id(row), None)
+                decididas_local.pop(id(row), None)
+                latencias.pop(id(row), None)
+                
+                # Guardar dados para preview (apenas primeiras linhas)
+                if len(preview_data) < max_preview_rows:
+                    preview_data.append(dict(row))
+        
+        if checkpoint is not None:
+            checkpoint.descarregar()
+        if saida_parquet:
+            saida_parquet.close()
+        scheduler.encerrar(sessao_escalonada)
+        
+        interrompido = contadores['interrompido']
+        # Calibrar o modelo de ETA com esta execução (o erro da previsão só conta em execuções completas)
+        estimador.finalizar(time.time() - start_time, completa=not interrompido)
+        salvar_historico(estimador.historico, bucket_principal)
+        total_rows = estimar_total_linhas() if interrompido else contadores['lidas']
         
         # Calcular estatísticas finais
         stats = {
             'total_rows': total_rows,
+            'interrupted': interrompido,
+            'next_row': indice_saida,
             'processed_rows': processed_count,
-            'normal_count': sum(1 for row in preview_data if row.get('classificacao_final') == 'Normal'),
-            'bom_count': sum(1 for row in preview_data if row.get('classificacao_final') == 'Bom'),
-            'wow_count': sum(1 for row in preview_data if row.get('classificacao_final') == 'WoW')
+            **agregador.como_dict(),
+            **contador_cache.como_dict(),
+            **contador_respostas.como_dict(),
+            **contador_cascata.como_dict(),
+            **contador_compactacao.como_dict(),
+            'timings': medidor.como_dict()
         }
         
-        # Marcar como concluído
-        update_progress(session_id, total_rows, total_rows, "completed", {
+        # Marcar como concluído (ou interrompido pelo prazo, aguardando retomada)
+        update_progress(session_id, indice_saida, total_rows, "interrupted" if interrompido else "completed", {
             'processed_count': processed_count,
             'total_time': round(time.time() - start_time, 1),
-            'stats': stats
+            'stats': stats,
+            **vertex_limiter.estado(),
+            **scheduler.estado(sessao_escalonada)
         })
         
         logger.info(f"Processamento concluído: {processed_count}/{total_rows} linhas analisadas")
-        return output.getvalue(), preview_data, fieldnames, stats
+        compactacao = contador_compactacao.como_dict()
+        logger.info(f"COMPACTACAO - {compactacao['compaction_tokens_saved']} tokens economizados ({compactacao['compaction_saved_pct']}%), "
+                    f"{compactacao['compaction_truncated_rows']} linhas truncadas, {compactacao['slow_lane_rows']} na faixa lenta")
+        return (output.getvalue() if output is not None and output_stream is None else None), preview_data, fieldnames, stats
         
     except Exception as e:
         logger.error(f"Erro ao processar CSV: {e}")
+        if sessao_escalonada is not None:
+            scheduler.encerrar(sessao_escalonada)
+        if checkpoint is not None:
+            # Salvar o que já ficou pronto para que a retomada não refaça essas linhas
+            try:
+                checkpoint.descarregar()
+            except Exception as erro_checkpoint:
+                logger.error(f"Erro ao salvar checkpoint: {erro_checkpoint}")
         update_progress(session_id, 0, 0, "error", {'error_message': str(e)})
         raise
 
-def processar_csv_async(csv_content: str, session_id: str, filename: str):
-    """Processa CSV de forma assíncrona em thread separada."""
+def caminho_parquet(blob_path: str) -> str:
+    return os.path.splitext(blob_path)[0] + '.parquet'
+
+def caminho_entrada_gcs(uri: str) -> str:
+    """Objeto de `gs://bucket/objeto` para o modo gs:// do /process; só o bucket da função é aceito."""
+    if not uri.startswith('gs://'):
+        raise ValueError("gcs_path deve ter o formato gs://bucket/objeto")
+    bucket, _, caminho = uri[len('gs://'):].partition('/')
+    if bucket != BUCKET_NAME:
+        raise ValueError(f"Apenas objetos do bucket {BUCKET_NAME} podem ser processados")
+    if not caminho or caminho.endswith('/') or caminho.startswith('processados/'):
+        raise ValueError(f"Caminho inválido para processamento: {uri}")
+    return caminho
+
+def processar_csv_para_storage(csv_source, session_id: str, blob_path: str, total_bytes: int = None, origem: str = None, prazo: float = None, pre_scan: dict = None, formato: str = 'csv', parquet: bool = False, classificador=None) -> tuple:
+    """Processa o arquivo escrevendo a saída direto no Storage (CSV, com gzip se SAIDA_GZIP).
+    - Com checkpoint ligado e a entrada já salva no Storage (`origem`), as linhas prontas vão para
+      partes em `processados/{session_id}/checkpoint/` e o CSV final é montado com compose no fim.
+      Se o `prazo` chegar antes, retorna com `stats['interrupted']` e a sessão pode ser retomada.
+    - Sem checkpoint, a saída vai por upload resumível em partes e o objeto só é finalizado sem erro.
+    Com `parquet`, também grava `<nome>.parquet` ao lado do CSV e informa o caminho em `stats['parquet_path']`.
+    `classificador` é repassado ao processar_csv_streaming (join do modo em massa).
+    """
+    storage_client = get_storage_client()
+    if not storage_client:
+        raise Exception("Falha ao obter cliente do Storage")
+    bucket = storage_client.bucket(BUCKET_NAME)
+    
+    if CHECKPOINT_LINHAS > 0 and origem:
+        checkpoint = CheckpointSessao(bucket, session_id, origem=origem, processed_filename=os.path.basename(blob_path),
+                                      formato=formato, parquet=parquet)
+        _, preview_data, column_names, stats = processar_csv_streaming(
+            csv_source, session_id, total_bytes=total_bytes, checkpoint=checkpoint, prazo=prazo, pre_scan=pre_scan,
+            formato=formato, classificador=classificador
+        )
+        if not stats['interrupted']:
+            with metricas_sessao(session_id).medir('upload_gcs'):
+                checkpoint.compor(blob_path)
+                if parquet:
+                    stats['parquet_path'] = checkpoint.exportar_parquet(caminho_parquet(blob_path))
+                checkpoint.limpar()
+        return preview_data, column_names, stats
+    
+    writer = abrir_csv_saida_gcs(bucket, blob_path)
+    abrir_saida_parquet = (lambda fieldnames: abrir_parquet_saida_gcs(bucket, caminho_parquet(blob_path), fieldnames)) if parquet else None
+    indice = ConstrutorIndice(comprimido=hasattr(writer, 'novo_membro')) if INDICE_RESULTADOS else None
+    _, preview_data, column_names, stats = processar_csv_streaming(
+        csv_source, session_id, output_stream=writer, total_bytes=total_bytes, pre_scan=pre_scan,
+        formato=formato, abrir_saida_parquet=abrir_saida_parquet, indice=indice, classificador=classificador
+    )
+    # Fechar o writer envia a última parte e conclui o upload resumível
+    with metricas_sessao(session_id).medir('upload_gcs'):
+        writer.close()
+        if indice is not None:
+            try:
+                indice.salvar(bucket, session_id, blob_path)
+            except Exception as e:
+                logger.warning(f"INDICE - Falha ao salvar o índice de resultados: {e}")
+    if parquet:
+        stats['parquet_path'] = caminho_parquet(blob_path)
+    logger.info(f"CSV processado salvo em: {blob_path}")
+    return preview_data, column_names, stats
+
+def refazer_erros_checkpoint(checkpoint: CheckpointSessao, prazo: float = None, agregador: AgregadorEstatisticas = None) -> tuple:
+    """Reclassifica as linhas marcadas como 'Erro' nas partes já salvas de um checkpoint.
+    Retorna (linhas refeitas, interrompido pelo prazo). Com `agregador`, os rótulos refeitos substituem os 'Erro' contados.
+    """
+    refeitas = 0
+    motor = MotorClassificacao()
+    sessao_escalonada = scheduler.registrar(checkpoint.session_id)
+    medidor = metricas_sessao(checkpoint.session_id)
+    
+    def reclassificar(row):
+        def chamar():
+            inicio = time.time()
+            texto = compactar_conversa(row.get('ordered_messages') or '')['texto']
+            return analisar_interacao(texto, medidor=medidor), time.time() - inicio
+        return scheduler.executar(sessao_escalonada, chamar)
+    
+    try:
+        for parte in checkpoint.partes_com_erro():
+            if prazo and time.time() >= prazo:
+                return refeitas, True
+            rows = checkpoint.ler_parte(parte)
+            com_erro = [row for row in rows if row.get('classificacao_final') == 'Erro']
+            for row, (resultado, latencia) in motor.mapear(reclassificar, com_erro):
+                row['raciocinio'] = resultado.get('raciocinio', 'Erro no processamento')
+                row['classificacao_final'] = resultado.get('classificacao_final', 'Erro')
+                if agregador is not None:
+                    agregador.substituir(row, 'Erro', row['classificacao_final'], latencia)
+                checkpoint.estatisticas.substituir(row, 'Erro', row['classificacao_final'], latencia)
+                refeitas += 1
+            checkpoint.reescrever_parte(parte, rows)
+            logger.info(f"RETOMADA - {len(com_erro)} linhas com erro refeitas em {parte['nome']}")
+    finally:
+        scheduler.encerrar(sessao_escalonada)
+    return refeitas, False
+
+def retomar_processamento(session_id: str, prazo: float = None) -> dict:
+    """Continua uma sessão a partir do último checkpoint.
+    Refaz as linhas com 'Erro' já salvas, processa só as linhas que faltam e monta o CSV final.
+    """
+    storage_client = get_storage_client()
+    if not storage_client:
+        raise Exception("Falha ao obter cliente do Storage")
+    bucket = storage_client.bucket(BUCKET_NAME)
+    
+    checkpoint = CheckpointSessao.carregar(bucket, session_id)
+    if checkpoint is None:
+        raise Exception(f"Nenhum checkpoint encontrado para a sessão {session_id}")
+    if checkpoint.manifesto.get('limpo'):
+        raise Exception(f"Sessão {session_id} já concluída em {checkpoint.manifesto.get('destino')}: partes do checkpoint já apagadas")
+    
+    processed_filename = checkpoint.manifesto['processed_filename']
+    blob_path = f"processados/{session_id}/{processed_filename}"
+    resultado = {
+        'blob_path': blob_path,
+        'processed_filename': processed_filename,
+        'column_names': checkpoint.fieldnames,
+        'preview_data': [],
+        'stats': {}
+    }
+    
+    # Estatísticas das linhas já salvas: a retomada continua a contagem em vez de reler as partes
+    agregador = AgregadorEstatisticas(checkpoint.manifesto.get('estatisticas'))
+    refeitas, interrompido = refazer_erros_checkpoint(checkpoint, prazo, agregador)
+    if interrompido:
+        resultado['stats'] = {'interrupted': True, 'next_row': checkpoint.proxima_linha, 'retried_error_rows': refeitas}
+        return resultado
+    
+    logger.info(f"RETOMADA - Sessão {session_id} continuando da linha {checkpoint.proxima_linha}")
+    origem = bucket.blob(checkpoint.manifesto['origem'])
+    origem.reload()
+    with origem.open('rb') as stream:
+        _, preview_data, column_names, stats = processar_csv_streaming(
+            stream, session_id, total_bytes=origem.size, checkpoint=checkpoint,
+            pular_linhas=checkpoint.proxima_linha, prazo=prazo, agregador=agregador,
+            formato=checkpoint.manifesto.get('formato', 'csv')
+        )
+    stats['retried_error_rows'] = refeitas
+    resultado.update({'preview_data': preview_data, 'column_names': column_names, 'stats': stats})
+    
+    if not stats['interrupted']:
+        with metricas_sessao(session_id).medir('upload_gcs'):
+            checkpoint.compor(blob_path)
+            if checkpoint.manifesto.get('parquet'):
+                stats['parquet_path'] = checkpoint.exportar_parquet(caminho_parquet(blob_path))
+        if not preview_data and checkpoint.manifesto['partes']:
+            resultado['preview_data'] = checkpoint.ler_parte(checkpoint.manifesto['partes'][0])[:50]
+        checkpoint.limpar()
+    return resultado
+
+def gerar_online(conteudo: str, prompt: str):
+    """Uma chamada online ao modelo (usada pelo backend local do modo em massa)."""
+    model = client_manager.modelo(MODEL_NAME, prompt)
+    return vertex_limiter.executar(lambda: model.generate_content(
+        [parte_texto(conteudo)],
+        generation_config=config_geracao()
+    ))
+
+def preparar_predicao_massa(source_path: str, session_id: str, formato: str = 'csv', pre_scan: dict = None, contexto: dict = None) -> tuple:
+    """Modo em massa: classifica o arquivo inteiro com um job de batch prediction antes de montar a saída.
+    1. Lê a entrada e grava no JSONL de requisições uma linha por conversa distinta (compactada) fora do cache
+       e não decidida pelo pré-classificador local;
+    2. submete o job ao backend (PREDICAO_MASSA_BACKEND) e consulta até terminar, publicando o estado no progresso;
+    3. devolve (classificador, resumo, massa): o classificador faz o join pelo id da conversa na segunda leitura
+       (no processar_csv_streaming), e o que ficou sem resultado válido vai ao modelo online.
+    `contexto` (parâmetros do processar_csv_async) vai para o manifesto, para a sessão poder ser retomada.
+    """
+    bucket = bucket_principal()
+    backend = criar_backend(bucket, MODEL_NAME, PROJECT_ID, LOCATION, gerar=gerar_online)
+    massa = PredicaoMassa(bucket, session_id, backend, PROMPT, contexto)
+    massa.iniciar()
+    cache = get_classification_cache()
+    pre_classificador = carregar_pre_classificador(bucket_principal)
+    total = (pre_scan or {}).get('rows', 0)
+    
+    update_progress(session_id, 0, total, "bulk_preparing")
+    linhas = em_cache = locais = 0
+    with bucket.blob(source_path).open('rb') as source_stream:
+        leitor, _ = abrir_entrada(source_stream, formato)
+        for row in leitor:
+            linhas += 1
+            texto = compactar_conversa(row.get('ordered_messages') or '')['texto']
+            if not texto:
+                continue
+            # Decididas localmente de novo no join (mesmo texto, mesma decisão): ficam fora do job
+            if pre_classificador and pre_classificador.decidir(texto) is not None:
+                locais += 1
+                continue
+            chave = chave_cache(texto, PROMPT, MODEL_NAME)
+            if resultado_do_cache(cache.obter(chave)) is not None:
+                em_cache += 1
+                continue
+            massa.adicionar(chave, f"Interação para Análise: {texto}")
+    massa.manifesto.update({'linhas': linhas, 'em_cache': em_cache, 'locais': locais})
+    return classificar_com_massa(massa, session_id)
+
+def carregar_predicao_massa(session_id: str):
+    """Execução do modo em massa salva para a sessão (None se a sessão não usou o modo em massa)."""
+    bucket = bucket_principal()
+    backend = criar_backend(bucket, MODEL_NAME, PROJECT_ID, LOCATION, gerar=gerar_online)
+    return PredicaoMassa.carregar(bucket, session_id, backend, PROMPT)
+
+def classificar_com_massa(massa: PredicaoMassa, session_id: str) -> tuple:
+    """Espera o job (submetendo se preciso) e monta o classificador do join; serve à execução nova e à retomada."""
+    cache = get_classification_cache()
+    medidor = metricas_sessao(session_id)
+    linhas, em_cache, locais = (massa.manifesto.get(chave, 0) for chave in ('linhas', 'em_cache', 'locais'))
+    
+    def ao_consultar(estado, decorrido):
+        update_progress(session_id, 0, linhas, "bulk_running", {
+            'bulk_job': massa.manifesto['job'],
+            'bulk_backend': massa.backend.nome,
+            'bulk_requests': massa.manifesto['requisicoes'],
+            'bulk_state': estado.get('detalhe'),
+            'elapsed_time': round(decorrido, 1)
+        })
+    
+    massa.executar(ao_consultar)
+    resultados = massa.resultados(medidor)
+    
+    resumo = {'bulk_backend': massa.backend.nome, 'bulk_job': massa.manifesto['job'], 'bulk_requests': massa.manifesto['requisicoes'],
+              'bulk_results': len(resultados), 'bulk_cached_rows': em_cache, 'bulk_local_rows': locais,
+              'bulk_job_seconds': massa.manifesto.get('duracao_s', 0),
+              'bulk_online_fallback': 0}
+    resumo_lock = threading.Lock()
+    gravadas = set()
+    
+    def classificar(textos):
+        saida = []
+        for texto in textos:
+            if not texto:
+                saida.append(None)
+                continue
+            chave = chave_cache(texto, PROMPT, MODEL_NAME)
+            id_item = id_requisicao(chave)
+            resultado = resultados.get(id_item)
+            if resultado is not None:
+                if id_item not in gravadas:
+                    gravadas.add(id_item)
+                    cache.gravar(chave, resultado)
+            else:
+                # Estava no cache na primeira leitura ou o job não trouxe resultado válido: analisar_interacao resolve os dois
+                resultado = resultado_do_cache(cache.obter(chave))
+                if resultado is None:
+                    with resumo_lock:
+                        resumo['bulk_online_fallback'] += 1
+                    resultado = analisar_interacao(texto, medidor=medidor)
+            saida.append(resultado)
+        return saida
+    
+    logger.info(f"MASSA - Sessão {session_id}: {linhas} linhas, {massa.manifesto['requisicoes']} requisições, "
+                f"{em_cache} do cache, {locais} decididas localmente, {len(resultados)} resultados do job")
+    return classificar, resumo, massa
+
+def processar_csv_async(source_path: str, session_id: str, filename: str, total_bytes: int = None, pre_scan: dict = None, formato: str = 'csv', parquet: bool = False, massa: bool = False, retomada: PredicaoMassa = None):
+    """Job em segundo plano: processa um arquivo já salvo no Storage em `source_path`.
+    Estados no progresso: queued (definido pelo pool) -> starting/processing -> completed ou failed.
+    Com `massa`, a classificação vem de um job de batch prediction (bulk_preparing -> bulk_running antes do processing).
+    `retomada` é a execução em massa recarregada do manifesto por /resume: continua a espera do job já submetido
+    (ou só faz o join, se ele já terminou) em vez de gravar e submeter as requisições de novo.
+    """
     try:
         logger.info(f"Iniciando processamento assíncrono para sessão {session_id}")
-        processed_csv, preview_data, column_names, stats = processar_csv_streaming(csv_content, session_id)
-        
-        logger.info(f"Processamento concluído, salvando no storage...")
+        inicio = time.time()
+        if retomada is not None and retomada.manifesto['estado'] in ('executando', 'concluido'):
+            classificador, resumo_massa, execucao_massa = classificar_com_massa(retomada, session_id)
+        elif massa or retomada is not None:
+            contexto = {'source_path': source_path, 'filename': filename, 'total_bytes': total_bytes, 'pre_scan': pre_scan,
+                        'formato': formato, 'parquet': parquet}
+            classificador, resumo_massa, execucao_massa = preparar_predicao_massa(source_path, session_id, formato, pre_scan, contexto)
+        else:
+            classificador, resumo_massa, execucao_massa = None, None, None
         
-        # Salvar o CSV processado no Storage
-        processed_filename = f"processado_{filename}"
+        # Salvar o CSV processado no Storage à medida que as linhas ficam prontas
+        processed_filename = f"processado_{nome_base(filename)}.csv"
         blob_path = f"processados/{session_id}/{processed_filename}"
-        
-        storage_client = get_storage_client()
-        if not storage_client:
-            raise Exception("Falha ao obter cliente do Storage")
-            
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(blob_path)
-        blob.upload_from_string(processed_csv, content_type='text/csv')
-        logger.info(f"CSV processado salvo em: {blob_path}")
+        source_blob = get_storage_client().bucket(BUCKET_NAME).blob(source_path)
+        with source_blob.open('rb') as source_stream:
+            preview_data, column_names, stats = processar_csv_para_storage(
+                source_stream, session_id, blob_path, total_bytes, origem=source_path, pre_scan=pre_scan,
+                formato=formato, parquet=parquet, classificador=classificador
+            )
+        if resumo_massa:
+            stats.update(resumo_massa)
+            execucao_massa.marcar_juntado()
         
         # Tornar o arquivo público para download
-        download_url = make_blob_public(BUCKET_NAME, blob_path)
+        download_url = make_blob_public(BUCKET_NAME, blob_path, session_id)
         if not download_url:
             raise Exception("Falha ao tornar blob público")
+        parquet_url = make_blob_public(BUCKET_NAME, stats['parquet_path'], session_id) if stats.get('parquet_path') else None
             
         logger.info(f"Download URL criada: {download_url}")
         
-        # Atualizar cache com dados finais
-        logger.info(f"Atualizando cache final com resultados...")
+        # Atualizar progresso com dados finais
+        logger.info(f"Atualizando progresso final com resultados...")
         update_progress(session_id, stats['total_rows'], stats['total_rows'], "completed", {
             'download_url': download_url,
+            'parquet_url': parquet_url,
             'processed_filename': processed_filename,
             'preview_data': preview_data,
             'column_names': column_names,
             'statistics': stats,
-            'total_time': 0  # Adicionar tempo total
+            'processed_count': stats['processed_rows'],
+            'total_time': round(time.time() - inicio, 1)
         })
         
         logger.info(f"Processamento assíncrono concluído com sucesso para sessão {session_id}")
@@ -312,14 +1051,14 @@ def processar_csv_async(csv_content: str, session_id: str, filename: str):
     except Exception as e:
         logger.error(f"Erro no processamento assíncrono: {e}")
         logger.error(traceback.format_exc())
-        update_progress(session_id, 0, 0, "error", {'error_message': str(e), 'traceback': traceback.format_exc()})
+        update_progress(session_id, 0, 0, "failed", {'error_message': str(e), 'traceback': traceback.format_exc()})
 
 # --- Funções Auxiliares (baseadas no código fornecido) ---
 
 def get_storage_client():
-    """Inicializa e retorna o cliente do Google Cloud Storage."""
+    """Retorna o cliente do Google Cloud Storage compartilhado pelo processo."""
     try:
-        return storage.Client()
+        return client_manager.storage()
     except Exception as e:
         logger.error(f"Erro ao inicializar cliente do Storage: {e}")
         return None
@@ -336,6 +1075,7 @@ def upload_to_storage(bucket_name, source_file_path, destination_blob_name):
         logger.info(f"Arquivo {source_file_path} enviado para {destination_blob_name}")
         return True
     except Exception as e:
+        client_manager.reportar_falha('storage', e)
         logger.error(f"Erro ao enviar {source_file_path}: {e}")
         return False
 
@@ -347,13 +1087,22 @@ def upload_service(request):
     Função HTTP unificada que atua como um serviço de backend e frontend.
     - Se a requisição for GET para a raiz ('/'), serve a página de upload.
     - Se a requisição for POST para '/upload', recebe arquivos e os salva no Storage.
-    - Se a requisição for POST para '/process', processa um CSV com o prompt.
+    - Se a requisição for POST para '/process', processa um CSV com o prompt
+      (com `async=1` ou `Prefer: respond-async`, enfileira um job e responde 202 na hora;
+      com `bulk=1` ou acima de PREDICAO_MASSA_LIMIAR_LINHAS linhas, o job usa batch prediction).
+    - Se a requisição for POST para '/resume/<session_id>', retoma uma sessão a partir do checkpoint.
+    - Se a requisição for GET para '/metrics', exporta as métricas do processo no formato do Prometheus
+      (com `?session_id=`, os tempos por etapa e tokens da sessão em JSON).
     """
     
-    # Debug - imprimir informações da requisição
-    print(f"Method: {request.method}")
-    print(f"Path: {request.path}")
-    print(f"URL: {request.url}")
+    # Debug - uma linha por requisição, só com o nível DEBUG ligado (/progress e /metrics são chamados o tempo todo)
+    logger.debug(f"{request.method} {request.path}")
+    
+    # Fotografia dos clientes já construídos, para contar quantos esta requisição criou
+    clients_before = client_manager.contagem()
+    
+    # Início da requisição: base para o prazo de processamento (timeout da função)
+    request_start = time.time()
     
     # --- Tratamento de CORS (Cross-Origin Resource Sharing) ---
     headers = {
@@ -368,15 +1117,17 @@ def upload_service(request):
 
     # --- Roteamento da Requisição ---
 
-    # Rota 1: Servir a página HTML do frontend
+    # Rota 1: Servir a página HTML do frontend (da memória, já comprimida, com ETag para revalidação)
     if request.method == 'GET' and request.path == '/':
         try:
-            dir_path = os.path.dirname(os.path.realpath(__file__))
-            file_path = os.path.join(dir_path, 'templates', 'upload.html')
-            with open(file_path, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-            headers['Content-Type'] = 'text/html'
-            return (html_content, 200, headers)
+            # Sem pyarrow, a opção de saída Parquet não aparece na página
+            corpo, status, headers_arquivo = arquivo_estatico('upload.html', variaveis={
+                'OPCAO_PARQUET': 'flex' if parquet_disponivel() else 'none'
+            }).responder(
+                request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding')
+            )
+            headers.update(headers_arquivo)
+            return (corpo, status, headers)
         except FileNotFoundError:
             return ('Arquivo HTML não encontrado.', 404, headers)
         except Exception as e:
@@ -385,21 +1136,30 @@ def upload_service(request):
     # Rota 2: Consultar progresso de uma sessão
     elif request.method == 'GET' and 'progress' in request.path:
         try:
-            # Extrair session_id da URL (ex: /progress/session_id)
-            path_parts = request.path.split('/')
+            # Extrair session_id da URL (ex: /progress/session_id ou /progress/session_id/stream)
+            path_parts = request.path.rstrip('/').split('/')
+            
+            if path_parts[-1] == 'stream' and len(path_parts) > 2:
+                # Streaming (SSE): eventos só quando o progresso muda, com retomada via Last-Event-ID
+                ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+                headers['Content-Type'] = 'text/event-stream'
+                headers['Cache-Control'] = 'no-cache'
+                headers['X-Accel-Buffering'] = 'no'
+                return (stream_progresso(path_parts[-2], ultimo_id), 200, headers)
+            
             session_id = path_parts[-1] if len(path_parts) > 1 else None
             
             if not session_id:
                 return (json.dumps({'success': False, 'message': 'Session ID não fornecido'}), 400, headers)
             
-            progress_data = progress_cache.get(session_id)
+            progress_data = progress_store.obter(session_id)
             
             if not progress_data:
                 return (json.dumps({'success': False, 'message': 'Sessão não encontrada'}), 404, headers)
             
-            # Limpar dados antigos (> 1 hora)
-            if time.time() - progress_data.get('timestamp', 0) > 3600:
-                progress_cache.pop(session_id, None)
+            # Sessões expiradas que a varredura ainda não removeu
+            if time.time() - progress_data.get('timestamp', 0) > PROGRESSO_TTL_S:
+                progress_store.remover(session_id)
                 return (json.dumps({'success': False, 'message': 'Sessão expirada'}), 410, headers)
             
             response_data = {
@@ -450,6 +1210,7 @@ def upload_service(request):
                 'success': True,
                 'session_id': session_id,
                 'uploaded_files': processed_files,
+                'clients_built': client_manager.criados_desde(clients_before),
                 'message': 'Arquivos enviados com sucesso.'
             }
             headers['Content-Type'] = 'application/json'
@@ -463,64 +1224,190 @@ def upload_service(request):
     # Rota 4: Processar CSV com prompt
     elif request.method == 'POST' and 'process' in request.path:
         try:
-            if 'file' not in request.files:
-                return (json.dumps({'success': False, 'message': 'Nenhum arquivo CSV selecionado'}), 400, headers)
+            # Campos do formulário, da query ou de um corpo JSON (o modo gs:// não precisa de multipart)
+            parametros = {**(request.get_json(silent=True) or {}), **request.args, **request.form}
             
-            file = request.files['file']
-            if not file or file.filename == '':
-                return (json.dumps({'success': False, 'message': 'Nenhum arquivo CSV selecionado'}), 400, headers)
+            # Entrada já no Storage (upload direto pela URL assinada): o arquivo não passa pelo corpo da requisição
+            file = None
+            source_path = None
+            if parametros.get('gcs_path'):
+                try:
+                    source_path = caminho_entrada_gcs(parametros['gcs_path'])
+                except ValueError as e:
+                    return (json.dumps({'success': False, 'message': str(e)}), 400, headers)
+                source_blob = get_storage_client().bucket(BUCKET_NAME).blob(source_path)
+                if not source_blob.exists():
+                    return (json.dumps({'success': False, 'message': f"Objeto não encontrado: {parametros['gcs_path']}"}), 404, headers)
+                source_blob.reload()
+                filename = os.path.basename(source_path)
+                file_size_bytes = source_blob.size
+                limite_mb = MAX_GCS_MB
+            else:
+                if 'file' not in request.files:
+                    return (json.dumps({'success': False, 'message': 'Nenhum arquivo CSV selecionado'}), 400, headers)
+                
+                file = request.files['file']
+                if not file or file.filename == '':
+                    return (json.dumps({'success': False, 'message': 'Nenhum arquivo CSV selecionado'}), 400, headers)
+                
+                # Calcular tamanho do arquivo
+                filename = file.filename
+                file.seek(0, 2)  # Vai para o final do arquivo
+                file_size_bytes = file.tell()
+                file.seek(0)  # Volta para o início
+                limite_mb = MAX_UPLOAD_MB
             
-            if not file.filename.lower().endswith('.csv'):
-                return (json.dumps({'success': False, 'message': 'Apenas arquivos CSV são aceitos'}), 400, headers)
+            formato = detectar_formato(filename)
+            if not formato:
+                return (json.dumps({'success': False, 'message': 'Formatos aceitos: CSV, JSONL e Parquet (CSV e JSONL também com .gz)'}), 400, headers)
+            parquet = str(parametros.get('output_parquet', '1' if SAIDA_PARQUET else '0')).lower() in ('1', 'true')
+            if parquet and not parquet_disponivel():
+                # Recusar já: com checkpoint, o Parquet só seria gerado depois de classificar o arquivo inteiro
+                return (json.dumps({'success': False, 'message': 'Saída Parquet indisponível: o pacote pyarrow não está instalado'}), 400, headers)
+            tipo_conteudo = 'text/csv' if filename.lower().endswith('.csv') else 'application/octet-stream'
 
-            session_id = str(uuid.uuid4())
+            # A página pode gerar o session_id para acompanhar o progresso enquanto o POST está em andamento
+            try:
+                session_id = str(uuid.UUID(parametros.get('session_id', '')))
+            except ValueError:
+                session_id = str(uuid.uuid4())
             
-            # Calcular tamanho do arquivo e estimar tempo
-            file.seek(0, 2)  # Vai para o final do arquivo
-            file_size_bytes = file.tell()
-            file.seek(0)  # Volta para o início
+            # Verificar limite de tamanho (do arquivo como enviado: comprimido, se gzip/Parquet)
             file_size_mb = file_size_bytes / (1024 * 1024)
+            if file_size_mb > limite_mb:
+                return (json.dumps({'success': False, 'message': f'Arquivo muito grande ({file_size_mb:.1f}MB). Limite máximo: {limite_mb:g}MB'}), 400, headers)
             
-            # Verificar limite de tamanho (100MB)
-            if file_size_mb > 100:
-                return (json.dumps({'success': False, 'message': f'Arquivo muito grande ({file_size_mb:.1f}MB). Limite máximo: 100MB'}), 400, headers)
-            
-            time_estimate = estimate_processing_time(file_size_mb)
-            logger.info(f"Arquivo: {file.filename}, Tamanho: {file_size_mb:.2f}MB, Tempo estimado: {time_estimate['formatted']}")
+            # Pré-scan barato (linhas e tokens, sem chamar o modelo) para o ETA e o total de linhas;
+            # limitado a PRE_SCAN_MAX_MB para o 202 dos modos async e em massa não esperar a leitura do arquivo inteiro
+            try:
+                if file is not None:
+                    pre_scan = pre_escanear(file.stream, formato=formato, total_bytes=file_size_bytes)
+                else:
+                    with source_blob.open('rb') as source_stream:
+                        pre_scan = pre_escanear(source_stream, formato=formato, total_bytes=file_size_bytes)
+            except Exception as e:
+                logger.warning(f"ETA - Pré-scan falhou ({e}), usando estimativa por tamanho")
+                pre_scan = None
+            time_estimate = estimate_processing_time(file_size_mb, pre_scan)
+            logger.info(f"Arquivo: {filename}, Tamanho: {file_size_mb:.2f}MB, Tempo estimado: {time_estimate['formatted']} "
+                        f"({time_estimate['min_seconds']}-{time_estimate['max_seconds']}s, {time_estimate['source']})")
             
-            # Ler o conteúdo do CSV
-            csv_content = file.read().decode('utf-8')
+            # Modo em massa (batch prediction): pedido com bulk=1 ou automático acima do limiar de linhas.
+            # O job leva de minutos a horas, então sempre roda em segundo plano
+            modo_massa = usar_predicao_massa(parametros.get('bulk'), pre_scan)
             
-            # Processar o CSV com o prompt DIRETAMENTE (sem thread)
-            logger.info(f"Iniciando processamento do CSV: {file.filename}")
-            processed_csv, preview_data, column_names, stats = processar_csv_streaming(csv_content, session_id)
+            # Modo assíncrono: salva a entrada, enfileira o job e responde sem esperar o processamento
+            modo_async = (modo_massa or str(parametros.get('async', '')).lower() in ('1', 'true')
+                          or 'respond-async' in request.headers.get('Prefer', ''))
+            if modo_async:
+                pool = bulk_pool if modo_massa else job_pool
+                if pool.cheia():
+                    headers['Retry-After'] = '30'
+                    return (json.dumps({'success': False, 'message': 'Fila de processamento cheia, tente novamente em instantes'}), 503, headers)
+                
+                if file is not None:
+                    source_path = f"uploads/{session_id}/{secure_filename(filename)}"
+                    source_blob = get_storage_client().bucket(BUCKET_NAME).blob(source_path)
+                    with metricas_sessao(session_id).medir('upload_gcs'):
+                        source_blob.upload_from_file(file.stream, size=file_size_bytes, content_type=tipo_conteudo)
+                try:
+                    posicao = pool.submeter(
+                        session_id, lambda: processar_csv_async(source_path, session_id, filename, file_size_bytes, pre_scan,
+                                                                formato, parquet, massa=modo_massa)
+                    )
+                except FilaCheia as e:
+                    headers['Retry-After'] = '30'
+                    return (json.dumps({'success': False, 'message': str(e)}), 503, headers)
+                
+                response_data = {
+                    'success': True,
+                    'status': 'queued',
+                    'job_id': session_id,
+                    'session_id': session_id,
+                    'queue_position': posicao,
+                    'mode': 'bulk' if modo_massa else 'online',
+                    'original_filename': filename,
+                    'file_size_mb': round(file_size_mb, 2),
+                    'processing_time_estimate': time_estimate,
+                    'progress_url': f"/progress/{session_id}",
+                    'stream_url': f"/progress/{session_id}/stream",
+                    'clients_built': client_manager.criados_desde(clients_before),
+                    'message': 'Arquivo recebido e colocado na fila de processamento'
+                }
+                headers['Content-Type'] = 'application/json'
+                return (json.dumps(response_data), 202, headers)
             
-            # Salvar o CSV processado no Storage
-            processed_filename = f"processado_{file.filename}"
+            # Processar o CSV com o prompt DIRETAMENTE (sem thread), lendo o upload como stream
+            # e enviando a saída ao Storage em partes: a memória não cresce com o arquivo
+            logger.info(f"Iniciando processamento do arquivo ({formato}): {filename}")
+            processed_filename = f"processado_{nome_base(filename)}.csv"
             blob_path = f"processados/{session_id}/{processed_filename}"
+            prazo = calcular_prazo(request_start)
             
-            storage_client = get_storage_client()
-            if storage_client:
-                bucket = storage_client.bucket(BUCKET_NAME)
-                blob = bucket.blob(blob_path)
-                blob.upload_from_string(processed_csv, content_type='text/csv')
-                logger.info(f"CSV processado salvo em: {blob_path}")
-                
-                # Tornar o arquivo público para download
-                download_url = make_blob_public(BUCKET_NAME, blob_path)
+            if file is not None and CHECKPOINT_LINHAS > 0:
+                # Com checkpoint, a entrada é salva antes no Storage para que a sessão possa ser retomada
+                source_path = f"uploads/{session_id}/{secure_filename(filename)}"
+                source_blob = get_storage_client().bucket(BUCKET_NAME).blob(source_path)
+                with metricas_sessao(session_id).medir('upload_gcs'):
+                    source_blob.upload_from_file(file.stream, size=file_size_bytes, content_type=tipo_conteudo)
+            
+            if source_path:
+                # Entrada no Storage: lida em streaming direto do objeto (e retomável pelo checkpoint)
+                with source_blob.open('rb') as source_stream:
+                    preview_data, column_names, stats = processar_csv_para_storage(
+                        source_stream, session_id, blob_path, total_bytes=file_size_bytes,
+                        origem=source_path, prazo=prazo, pre_scan=pre_scan, formato=formato, parquet=parquet
+                    )
+            else:
+                preview_data, column_names, stats = processar_csv_para_storage(
+                    file.stream, session_id, blob_path, total_bytes=file_size_bytes, pre_scan=pre_scan,
+                    formato=formato, parquet=parquet
+                )
+            
+            if stats.get('interrupted'):
+                response_data = {
+                    'success': True,
+                    'status': 'interrupted',
+                    'session_id': session_id,
+                    'original_filename': filename,
+                    'next_row': stats['next_row'],
+                    'resume_url': f"/resume/{session_id}",
+                    'statistics': stats,
+                    'message': 'Tempo da função quase esgotado: o progresso foi salvo. Chame /resume/<session_id> para continuar.'
+                }
+                headers['Content-Type'] = 'application/json'
+                return (json.dumps(response_data), 202, headers)
+            
+            # Tornar o arquivo público para download
+            download_url = make_blob_public(BUCKET_NAME, blob_path, session_id)
+            parquet_url = make_blob_public(BUCKET_NAME, stats['parquet_path'], session_id) if stats.get('parquet_path') else None
+            
+            # Progresso final com o link e o preview (encerra o streaming de progresso)
+            update_progress(session_id, stats['total_rows'], stats['total_rows'], "completed", {
+                'download_url': download_url,
+                'parquet_url': parquet_url,
+                'processed_filename': processed_filename,
+                'preview_data': preview_data,
+                'column_names': column_names,
+                'statistics': stats,
+                'processed_count': stats['processed_rows'],
+                'total_time': round(time.time() - request_start, 1)
+            })
             
             response_data = {
                 'success': True,
                 'session_id': session_id,
-                'original_filename': file.filename,
+                'original_filename': filename,
                 'processed_filename': processed_filename,
                 'download_url': download_url,
+                'parquet_url': parquet_url,
                 'file_size_mb': round(file_size_mb, 2),
                 'processing_time_estimate': time_estimate,
                 'storage_path': f"gs://{BUCKET_NAME}/{blob_path}",
                 'preview_data': preview_data,
                 'column_names': column_names,
                 'statistics': stats,
+                'clients_built': client_manager.criados_desde(clients_before),
                 'message': 'CSV processado com sucesso!'
             }
             headers['Content-Type'] = 'application/json'
@@ -530,6 +1417,142 @@ def upload_service(request):
             logger.error(f"Erro durante processamento do CSV: {e}")
             logger.error(traceback.format_exc())
             return (json.dumps({'success': False, 'message': f'Erro durante processamento: {e}', 'traceback': traceback.format_exc()}), 500, headers)
+    
+    # Rota 5: Retomar uma sessão a partir do último checkpoint
+    elif request.method == 'POST' and '/resume/' in request.path:
+        try:
+            session_id = request.path.rstrip('/').split('/')[-1]
+            headers['Content-Type'] = 'application/json'
+            
+            # Sessão do modo em massa ainda sem saída: volta para a fila de jobs em massa, que continua a
+            # espera do job salvo no manifesto (ou só faz o join) em vez de depender da instância original
+            massa = carregar_predicao_massa(session_id)
+            if massa is not None and not massa.manifesto.get('juntado'):
+                if massa.ativa() or bulk_pool.posicao(session_id) is not None:
+                    return (json.dumps({'success': False, 'message': f"O job {massa.manifesto['job']} ainda está sendo acompanhado por outra instância"}), 409, headers)
+                try:
+                    posicao = bulk_pool.submeter(session_id, lambda: processar_csv_async(session_id=session_id, retomada=massa, **massa.manifesto['contexto']))
+                except FilaCheia as e:
+                    headers['Retry-After'] = '30'
+                    return (json.dumps({'success': False, 'message': str(e)}), 503, headers)
+                response_data = {
+                    'success': True,
+                    'status': 'queued',
+                    'session_id': session_id,
+                    'queue_position': posicao,
+                    'mode': 'bulk',
+                    'bulk_job': massa.manifesto['job'],
+                    'bulk_state': massa.manifesto['estado'],
+                    'progress_url': f"/progress/{session_id}",
+                    'stream_url': f"/progress/{session_id}/stream",
+                    'message': 'Sessão em massa retomada: acompanhe pelo progresso.'
+                }
+                return (json.dumps(response_data), 202, headers)
+            
+            resultado = retomar_processamento(session_id, calcular_prazo(request_start))
+            stats = resultado['stats']
+            
+            if stats.get('interrupted'):
+                response_data = {
+                    'success': True,
+                    'status': 'interrupted',
+                    'session_id': session_id,
+                    'next_row': stats.get('next_row'),
+                    'resume_url': f"/resume/{session_id}",
+                    'statistics': stats,
+                    'message': 'Tempo da função quase esgotado novamente: chame /resume/<session_id> para continuar.'
+                }
+                return (json.dumps(response_data), 202, headers)
+            
+            download_url = make_blob_public(BUCKET_NAME, resultado['blob_path'], session_id)
+            parquet_url = make_blob_public(BUCKET_NAME, stats['parquet_path'], session_id) if stats.get('parquet_path') else None
+            update_progress(session_id, stats['total_rows'], stats['total_rows'], "completed", {
+                'download_url': download_url,
+                'parquet_url': parquet_url,
+                'processed_filename': resultado['processed_filename'],
+                'preview_data': resultado['preview_data'],
+                'column_names': resultado['column_names'],
+                'statistics': stats,
+                'processed_count': stats.get('processed_rows', 0),
+                'total_time': round(time.time() - request_start, 1)
+            })
+            response_data = {
+                'success': True,
+                'status': 'completed',
+                'session_id': session_id,
+                'processed_filename': resultado['processed_filename'],
+                'download_url': download_url,
+                'parquet_url': parquet_url,
+                'storage_path': f"gs://{BUCKET_NAME}/{resultado['blob_path']}",
+                'preview_data': resultado['preview_data'],
+                'column_names': resultado['column_names'],
+                'statistics': stats,
+                'clients_built': client_manager.criados_desde(clients_before),
+                'message': 'CSV processado com sucesso!'
+            }
+            return (json.dumps(response_data), 200, headers)
+        
+        except Exception as e:
+            logger.error(f"Erro ao retomar processamento: {e}")
+            logger.error(traceback.format_exc())
+            return (json.dumps({'success': False, 'message': f'Erro ao retomar processamento: {e}', 'traceback': traceback.format_exc()}), 500, headers)
+    
+    # Rota 6: Métricas do processo (Prometheus) ou de uma sessão (JSON)
+    elif request.method == 'GET' and request.path.rstrip('/') == '/metrics':
+        session_id = request.args.get('session_id')
+        if session_id:
+            medidor = obter_metricas_sessao(session_id)
+            if medidor is None:
+                return (json.dumps({'success': False, 'message': 'Sessão sem métricas nesta instância'}), 404, headers)
+            headers['Content-Type'] = 'application/json'
+            return (json.dumps({'success': True, 'session_id': session_id, **medidor.como_dict()}), 200, headers)
+        headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return (metricas.exportar(), 200, headers)
+    
+    # Rota 7: Resultados paginados e filtrados de uma sessão, lidos por range com o índice
+    # (ex.: /results/<session_id>?classificacao_final=WoW&canal=chat,email&page=2&page_size=100)
+    elif request.method == 'GET' and request.path.startswith('/results/'):
+        session_id = request.path.rstrip('/').split('/')[-1]
+        headers['Content-Type'] = 'application/json'
+        try:
+            pagina = max(1, int(request.args.get('page', 1)))
+            por_pagina = min(RESULTADOS_MAX_POR_PAGINA, max(1, int(request.args.get('page_size', RESULTADOS_POR_PAGINA))))
+        except ValueError:
+            return (json.dumps({'success': False, 'message': 'page e page_size devem ser inteiros'}), 400, headers)
+        filtros = {coluna: [valor.strip() for valor in str(valores).split(',') if valor.strip()]
+                   for coluna, valores in request.args.items() if coluna not in ('page', 'page_size')}
+        
+        try:
+            bucket = bucket_principal()
+            indice = carregar_indice(bucket, session_id)
+            if indice is None:
+                return (json.dumps({'success': False, 'message': 'Sessão sem índice de resultados (ainda em processamento ou anterior ao índice)'}), 404, headers)
+            try:
+                linhas, total = indice.pagina(filtros, pagina, por_pagina)
+            except ValueError as e:
+                return (json.dumps({'success': False, 'message': str(e)}), 400, headers)
+            rows, bytes_lidos = indice.ler_linhas(bucket.blob(indice.objeto), linhas)
+            logger.info(f"RESULTADOS - Sessão {session_id}: página {pagina} ({len(rows)} linhas de {total}), {bytes_lidos} bytes lidos")
+            response_data = {
+                'success': True,
+                'session_id': session_id,
+                'page': pagina,
+                'page_size': por_pagina,
+                'total_rows': total,
+                'total_pages': (total + por_pagina - 1) // por_pagina,
+                'filters': filtros,
+                'column_names': indice.fieldnames,
+                'indexed_values': indice.valores(),
+                'row_numbers': linhas,
+                'rows': rows,
+                'bytes_read': bytes_lidos,
+                'storage_path': f"gs://{BUCKET_NAME}/{indice.objeto}"
+            }
+            return (json.dumps(response_data), 200, headers)
+        except Exception as e:
+            logger.error(f"Erro ao consultar resultados: {e}")
+            logger.error(traceback.format_exc())
+            return (json.dumps({'success': False, 'message': f'Erro ao consultar resultados: {e}'}), 500, headers)
             
     else:
         # Rota não encontrada
@@ -0,0 +1,210 @@
+import os
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+METRICAS_AMOSTRA_LOG = float(os.environ.get('METRICAS_AMOSTRA_LOG', '0.01'))  # fração das linhas com log de depuração
+METRICAS_MAX_SESSOES = int(os.environ.get('METRICAS_MAX_SESSOES', '200'))
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_TOKENS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+
+
+def amostrar(log: logging.Logger) -> bool:
+    """True para uma amostra das linhas quando o log de depuração está ligado (substitui o log INFO por linha)."""
+    return log.isEnabledFor(logging.DEBUG) and random.random() < METRICAS_AMOSTRA_LOG
+
+
+class Histograma:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.contagens = [0] * (len(buckets) + 1)  # último = acima do maior bucket (+Inf)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float, vezes: int = 1):
+        self.contagens[bisect_left(self.buckets, valor)] += vezes
+        self.soma += valor * vezes
+        self.total += vezes
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(rotulos: tuple) -> str:
+    if not rotulos:
+        return ''
+    return '{' + ','.join(f'{chave}="{_escapar(valor)}"' for chave, valor in rotulos) + '}'
+
+
+class RegistroMetricas:
+    """
+    Contadores e histogramas do processo, exportados no formato texto do Prometheus.
+    Medidores (gauges) vêm de funções registradas que devolvem dicts numéricos no momento da coleta
+    (ex.: estado do limitador e da fila de jobs).
+    """
+
+    def __init__(self, prefixo: str = 'wow'):
+        self.prefixo = prefixo
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._histogramas = {}
+        self._descricoes = {}
+        self._medidores = []
+
+    def descrever(self, nome: str, tipo: str, descricao: str):
+        self._descricoes[nome] = (tipo, descricao)
+
+    def incrementar(self, nome: str, valor: float = 1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, nome: str, valor: float, buckets: tuple = BUCKETS_SEGUNDOS, vezes: int = 1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                histograma = self._histogramas[chave] = Histograma(buckets)
+            histograma.observar(valor, vezes)
+
+    def registrar_medidor(self, funcao):
+        self._medidores.append(funcao)
+
+    def exportar(self) -> str:
+        linhas = []
+        cabecalhos = set()
+
+        def cabecalho(nome: str, tipo_padrao: str):
+            if nome not in cabecalhos:
+                cabecalhos.add(nome)
+                tipo, descricao = self._descricoes.get(nome, (tipo_padrao, nome))
+                linhas.append(f'# HELP {self.prefixo}_{nome} {descricao}')
+                linhas.append(f'# TYPE {self.prefixo}_{nome} {tipo}')
+
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((chave, (h.buckets, list(h.contagens), h.soma, h.total))
+                                 for chave, h in self._histogramas.items())
+
+        for (nome, rotulos), valor in contadores:
+            cabecalho(nome, 'counter')
+            linhas.append(f'{self.prefixo}_{nome}{_rotulos(rotulos)} {valor}')
+
+        for (nome, rotulos), (buckets, contagens, soma, total) in histogramas:
+            cabecalho(nome, 'histogram')
+            acumulado = 0
+            for limite, contagem in zip(buckets + ('+Inf',), contagens):
+                acumulado += contagem
+                linhas.append(f'{self.prefixo}_{nome}_bucket{_rotulos(rotulos + (("le", limite),))} {acumulado}')
+            linhas.append(f'{self.prefixo}_{nome}_sum{_rotulos(rotulos)} {round(soma, 6)}')
+            linhas.append(f'{self.prefixo}_{nome}_count{_rotulos(rotulos)} {total}')
+
+        for funcao in self._medidores:
+            try:
+                valores = funcao()
+            except Exception as e:
+                logger.warning(f"METRICAS - Falha ao coletar medidor: {e}")
+                continue
+            for nome, valor in valores.items():
+                if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                    continue
+                cabecalho(nome, 'gauge')
+                linhas.append(f'{self.prefixo}_{nome} {valor}')
+
+        return '\n'.join(linhas) + '\n'
+
+
+# Registro do processo (todas as sessões da instância)
+metricas = RegistroMetricas()
+metricas.descrever('etapa_segundos', 'histogram', 'Tempo por etapa (csv_parse por linha, fila, modelo, json_parse, upload_gcs, blob_publico)')
+metricas.descrever('tokens_por_linha', 'histogram', 'Tokens por interação classificada, segundo o usage_metadata do modelo')
+metricas.descrever('tokens_total', 'counter', 'Tokens consumidos no modelo')
+metricas.descrever('chamadas_modelo_total', 'counter', 'Chamadas ao modelo por resultado')
+metricas.descrever('respostas_modelo_total', 'counter', 'Respostas do modelo por tipo (valida, reparada, repedida, invalida)')
+metricas.descrever('linhas_nivel_total', 'counter', 'Linhas classificadas por nível da cascata (local, llm)')
+
+
+class MetricasSessao:
+    """Tempos por etapa e tokens de uma sessão; cada observação também alimenta o registro do processo."""
+
+    def __init__(self, registro: RegistroMetricas = None):
+        self.registro = registro or metricas
+        self._lock = threading.Lock()
+        self.etapas = {}      # etapa -> [contagem, soma, máximo]
+        self.tokens = {'prompt': 0, 'resposta': 0, 'total': 0}
+        self.chamadas = {'ok': 0, 'erro': 0}
+
+    def observar(self, etapa: str, segundos: float):
+        self.registro.observar('etapa_segundos', segundos, etapa=etapa)
+        with self._lock:
+            acumulado = self.etapas.setdefault(etapa, [0, 0.0, 0.0])
+            acumulado[0] += 1
+            acumulado[1] += segundos
+            acumulado[2] = max(acumulado[2], segundos)
+
+    @contextmanager
+    def medir(self, etapa: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(etapa, time.perf_counter() - inicio)
+
+    def registrar_chamada(self, ok: bool = True, uso=None, linhas: int = 1):
+        """Conta uma chamada ao modelo e os tokens do `usage_metadata` da resposta (divididos pelas linhas do lote)."""
+        resultado = 'ok' if ok else 'erro'
+        self.registro.incrementar('chamadas_modelo_total', resultado=resultado)
+        prompt = getattr(uso, 'prompt_token_count', 0) or 0
+        resposta = getattr(uso, 'candidates_token_count', 0) or 0
+        total = getattr(uso, 'total_token_count', 0) or (prompt + resposta)
+        if uso is not None:
+            self.registro.incrementar('tokens_total', prompt, tipo='prompt')
+            self.registro.incrementar('tokens_total', resposta, tipo='resposta')
+            linhas = max(1, linhas)
+            self.registro.observar('tokens_por_linha', total / linhas, buckets=BUCKETS_TOKENS, vezes=linhas)
+        with self._lock:
+            self.chamadas[resultado] += 1
+            self.tokens['prompt'] += prompt
+            self.tokens['resposta'] += resposta
+            self.tokens['total'] += total
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            etapas = {
+                etapa: {'count': n, 'total_s': round(soma, 4), 'avg_s': round(soma / n, 6) if n else 0, 'max_s': round(maximo, 4)}
+                for etapa, (n, soma, maximo) in self.etapas.items()
+            }
+            return {'stage_timings': etapas, 'token_usage': dict(self.tokens), 'model_calls': dict(self.chamadas)}
+
+
+# --- Métricas por sessão (as mais recentes ficam em memória) ---
+
+_sessoes = OrderedDict()
+_sessoes_lock = threading.Lock()
+
+
+def metricas_sessao(session_id: str) -> MetricasSessao:
+    """Métricas da sessão, criadas na primeira observação; as mais antigas saem acima de METRICAS_MAX_SESSOES."""
+    with _sessoes_lock:
+        sessao = _sessoes.get(session_id)
+        if sessao is None:
+            sessao = _sessoes[session_id] = MetricasSessao()
+            while len(_sessoes) > METRICAS_MAX_SESSOES:
+                _sessoes.popitem(last=False)
+        else:
+            _sessoes.move_to_end(session_id)
+        return sessao
+
+
+def obter_metricas_sessao(session_id: str):
+    with _sessoes_lock:
+        return _sessoes.get(session_id)
@@ -0,0 +1,61 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Número máximo de chamadas ao modelo em voo ao mesmo tempo
+MAX_CONCORRENCIA = int(os.environ.get('MAX_CONCORRENCIA', '8'))
+
+
+class MotorClassificacao:
+    """
+    Executa a classificação de várias interações em paralelo com concorrência limitada.
+    - No máximo `max_concorrencia` chamadas ficam em execução ao mesmo tempo.
+    - Os resultados são devolvidos na mesma ordem da entrada, mesmo que terminem fora de ordem.
+    - A janela de reordenação é limitada para que a memória não cresça com o tamanho do arquivo.
+    """
+
+    def __init__(self, max_concorrencia: int = None, janela: int = None):
+        self.max_concorrencia = max(1, max_concorrencia or MAX_CONCORRENCIA)
+        # Quantos itens (em voo + concluídos aguardando a vez) podem ficar pendentes
+        self.janela = max(self.max_concorrencia, janela or self.max_concorrencia * 4)
+
+    def mapear(self, funcao, itens, ao_concluir=None):
+        """
+        Aplica `funcao` a cada item e gera tuplas (item, resultado) na ordem de entrada.
+        `ao_concluir(item, resultado)` é chamado na thread do worker assim que cada chamada termina,
+        o que permite reportar progresso pela ordem de conclusão e não pela ordem de saída.
+        """
+        vagas = threading.BoundedSemaphore(self.max_concorrencia)
+        pendentes = deque()
+
+        def executar(item):
+            try:
+                resultado = funcao(item)
+                if ao_concluir:
+                    ao_concluir(item, resultado)
+                return resultado
+            finally:
+                vagas.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_concorrencia, thread_name_prefix='classificacao') as executor:
+            try:
+                for item in itens:
+                    vagas.acquire()
+                    pendentes.append((item, executor.submit(executar, item)))
+
+                    # Libera tudo que já está pronto no início da fila, ou espera se a janela encheu
+                    while pendentes and (pendentes[0][1].done() or len(pendentes) >= self.janela):
+                        item_pronto, futuro = pendentes.popleft()
+                        yield item_pronto, futuro.result()
+
+                while pendentes:
+                    item_pronto, futuro = pendentes.popleft()
+                    yield item_pronto, futuro.result()
+            finally:
+                # Se o consumidor parar no meio (erro ou gerador fechado), não inicia o que ficou na fila
+                for _, futuro in pendentes:
+                    futuro.cancel()
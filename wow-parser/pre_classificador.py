@@ -0,0 +1,313 @@
+"""
+Pré-classificador local: primeiro nível da cascata de classificação.
+
+Uma regressão logística sobre features léxicas (palavras e pares de palavras por falante, número de
+turnos e tamanho), treinada com as saídas `processado_*` de execuções anteriores, estima a
+probabilidade de uma conversa ser `Normal`. Só acima de PRE_CLASSIFICADOR_LIMIAR a linha é decidida
+localmente; o resto segue para o modelo. Sem modelo treinado a cascata fica desligada.
+
+Treino e avaliação offline (concordância com o LLM x chamadas economizadas por limiar):
+    python pre_classificador.py treinar processado_a.csv.gz processado_b.csv --saida modelo.json
+    python pre_classificador.py avaliar processado_c.csv.gz --modelo modelo.json --limiares 0.9,0.95,0.99
+Os arquivos podem ser locais ou `gs://bucket/objeto`. Para usar o modelo, grave-o em
+`gs://<BUCKET_NAME>/modelos/pre_classificador.json` (ou em PRE_CLASSIFICADOR_PATH com PRE_CLASSIFICADOR=local).
+"""
+import os
+import re
+import sys
+import json
+import math
+import zlib
+import random
+import logging
+import argparse
+import threading
+import unicodedata
+
+from compactacao import compactar_conversa, separar_turnos
+from resposta_modelo import ROTULOS_VALIDOS, normalizar_classificacao
+from streaming_csv import abrir_entrada, detectar_formato
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+PRE_CLASSIFICADOR = os.environ.get('PRE_CLASSIFICADOR', 'gcs')                                  # gcs | local | none
+PRE_CLASSIFICADOR_PATH = os.environ.get('PRE_CLASSIFICADOR_PATH', '/tmp/wow_pre_classificador.json')
+PRE_CLASSIFICADOR_BLOB = os.environ.get('PRE_CLASSIFICADOR_BLOB', 'modelos/pre_classificador.json')
+PRE_CLASSIFICADOR_LIMIAR = float(os.environ.get('PRE_CLASSIFICADOR_LIMIAR', '0.97'))        # P(Normal) mínima para decidir
+
+COLUNA_NIVEL = 'nivel_classificacao'
+NIVEL_LOCAL = 'local'
+NIVEL_LLM = 'llm'
+ROTULO_LOCAL = 'Normal'  # o único rótulo que o nível local decide
+
+BITS_PADRAO = 18  # 2^18 posições para as features (hash)
+LIMIARES_AVALIACAO = (0.8, 0.9, 0.95, 0.97, 0.99)
+_PREFIXO_FALANTE = {'Cliente': 'c', 'Agente': 'a', 'Atendente': 'a'}
+_PALAVRA = re.compile(r'[a-z0-9]+')
+
+
+def _normalizar(texto: str) -> str:
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def extrair_features(texto: str, bits: int = BITS_PADRAO) -> list:
+    """Índices (hash crc32, estável entre processos) das features do texto já compactado."""
+    nomes = set()
+    turnos = separar_turnos(texto)
+    palavras_total = 0
+    for falante, fala in turnos:
+        prefixo = _PREFIXO_FALANTE.get(falante, 'o')
+        palavras = _PALAVRA.findall(_normalizar(fala))
+        palavras_total += len(palavras)
+        nomes.update(f"{prefixo}:{palavra}" for palavra in palavras)
+        nomes.update(f"{prefixo}:{a}_{b}" for a, b in zip(palavras, palavras[1:]))
+    nomes.add(f"#turnos:{min(len(turnos), 12)}")
+    nomes.add(f"#palavras:{int(math.log2(palavras_total + 1))}")
+    mascara = (1 << bits) - 1
+    return sorted({zlib.crc32(nome.encode('utf-8')) & mascara for nome in nomes})
+
+
+def _sigmoide(z: float) -> float:
+    if z < -30:
+        return 0.0
+    if z > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class PreClassificador:
+    """Regressão logística binária (Normal x resto) com pesos esparsos; serializável em JSON."""
+
+    def __init__(self, dados: dict, limiar: float = None):
+        self.bits = dados.get('bits', BITS_PADRAO)
+        self.vies = dados.get('vies', 0.0)
+        self.pesos = {int(indice): peso for indice, peso in dados.get('pesos', {}).items()}
+        self.treino = dados.get('treino', {})
+        self.limiar = PRE_CLASSIFICADOR_LIMIAR if limiar is None else limiar
+
+    @classmethod
+    def treinar(cls, exemplos: list, epocas: int = 8, taxa: float = 0.3, l2: float = 1e-6, bits: int = BITS_PADRAO, semente: int = 0):
+        """
+        Treina com [(texto compactado, rótulo do LLM)] por SGD com AdaGrad.
+        O alvo é 1 para `Normal`; as features de cada exemplo têm peso 1/sqrt(n) (norma 1).
+        """
+        amostras = [(extrair_features(texto, bits), 1.0 if rotulo == ROTULO_LOCAL else 0.0) for texto, rotulo in exemplos]
+        pesos, acumulados = {}, {}
+        vies, acumulado_vies = 0.0, 0.0
+        sorteio = random.Random(semente)
+        for _ in range(epocas):
+            sorteio.shuffle(amostras)
+            for features, alvo in amostras:
+                valor = 1.0 / math.sqrt(len(features)) if features else 0.0
+                erro = _sigmoide(vies + valor * sum(pesos.get(f, 0.0) for f in features)) - alvo
+                for f in features:
+                    gradiente = erro * valor + l2 * pesos.get(f, 0.0)
+                    acumulados[f] = acumulados.get(f, 0.0) + gradiente * gradiente
+                    pesos[f] = pesos.get(f, 0.0) - taxa * gradiente / math.sqrt(acumulados[f] + 1e-8)
+                acumulado_vies += erro * erro
+                vies -= taxa * erro / math.sqrt(acumulado_vies + 1e-8)
+        positivos = sum(1 for _, alvo in amostras if alvo)
+        return cls({
+            'bits': bits,
+            'vies': vies,
+            'pesos': {str(f): round(p, 6) for f, p in pesos.items() if abs(p) >= 1e-5},
+            'treino': {'exemplos': len(amostras), 'normais': positivos, 'epocas': epocas}
+        })
+
+    def probabilidade(self, texto: str) -> float:
+        """P(Normal) para o texto compactado."""
+        features = extrair_features(texto, self.bits)
+        if not features:
+            return 0.0
+        return _sigmoide(self.vies + sum(self.pesos.get(f, 0.0) for f in features) / math.sqrt(len(features)))
+
+    def decidir(self, texto: str):
+        """Resultado do nível local, ou None quando a confiança não passa do limiar (a linha vai ao LLM)."""
+        if not texto:
+            return None
+        probabilidade = self.probabilidade(texto)
+        if probabilidade < self.limiar:
+            return None
+        return {
+            'raciocinio': f"Pré-classificador local: interação de rotina (confiança {probabilidade:.2f})",
+            'classificacao_final': ROTULO_LOCAL,
+            COLUNA_NIVEL: NIVEL_LOCAL
+        }
+
+    def como_dict(self) -> dict:
+        return {'bits': self.bits, 'vies': self.vies, 'pesos': {str(f): p for f, p in self.pesos.items()}, 'treino': self.treino}
+
+
+_pre_classificador = None
+_pre_classificador_carregado = False
+_pre_classificador_lock = threading.Lock()
+
+
+def carregar_pre_classificador(obter_bucket=None):
+    """Pré-classificador do processo (carregado uma vez do backend configurado); None sem modelo treinado."""
+    global _pre_classificador, _pre_classificador_carregado
+    if not _pre_classificador_carregado:
+        with _pre_classificador_lock:
+            if not _pre_classificador_carregado:
+                dados = None
+                try:
+                    if PRE_CLASSIFICADOR == 'gcs' and obter_bucket:
+                        dados = json.loads(obter_bucket().blob(PRE_CLASSIFICADOR_BLOB).download_as_bytes())
+                    elif PRE_CLASSIFICADOR == 'local' and os.path.exists(PRE_CLASSIFICADOR_PATH):
+                        with open(PRE_CLASSIFICADOR_PATH, encoding='utf-8') as arquivo:
+                            dados = json.load(arquivo)
+                except Exception as e:
+                    logger.info(f"CASCATA - Sem pré-classificador treinado ({e}), todas as linhas vão ao modelo")
+                if dados:
+                    _pre_classificador = PreClassificador(dados)
+                    logger.info(f"CASCATA - Pré-classificador carregado: {len(_pre_classificador.pesos)} pesos, "
+                                f"limiar {_pre_classificador.limiar}, treino {_pre_classificador.treino}")
+                _pre_classificador_carregado = True
+    return _pre_classificador
+
+
+class ContadorCascata:
+    """Linhas decididas por nível da cascata em uma execução."""
+
+    def __init__(self, pre_classificador: PreClassificador = None, ao_registrar=None):
+        self._lock = threading.Lock()
+        self.pre_classificador = pre_classificador
+        self.ao_registrar = ao_registrar  # ex.: contador de processo exportado em /metrics
+        self.contagens = {NIVEL_LOCAL: 0, NIVEL_LLM: 0}
+
+    def registrar(self, nivel: str):
+        with self._lock:
+            self.contagens[nivel] += 1
+        if self.ao_registrar:
+            self.ao_registrar(nivel)
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            local, llm = self.contagens[NIVEL_LOCAL], self.contagens[NIVEL_LLM]
+        return {
+            'cascade_enabled': self.pre_classificador is not None,
+            'cascade_threshold': self.pre_classificador.limiar if self.pre_classificador else None,
+            'cascade_local_rows': local,
+            'cascade_llm_rows': llm,
+            'cascade_local_pct': round(100 * local / (local + llm), 1) if local + llm else 0
+        }
+
+
+# --- Treino e avaliação offline ---
+
+def _abrir_binario(caminho: str):
+    if caminho.startswith('gs://'):
+        from google.cloud import storage
+        bucket, _, objeto = caminho[len('gs://'):].partition('/')
+        return storage.Client().bucket(bucket).blob(objeto).open('rb')
+    return open(caminho, 'rb')
+
+
+def ler_exemplos(caminhos: list) -> list:
+    """
+    [(texto compactado, rótulo)] das saídas processadas: só linhas com rótulo válido decididas pelo LLM
+    (saídas sem a coluna `nivel_classificacao` são todas do LLM), para o modelo não aprender consigo mesmo.
+    """
+    exemplos = []
+    for caminho in caminhos:
+        with _abrir_binario(caminho) as stream:
+            leitor, _ = abrir_entrada(stream, detectar_formato(caminho) or 'csv')
+            for row in leitor:
+                if (row.get(COLUNA_NIVEL) or NIVEL_LLM) != NIVEL_LLM:
+                    continue
+                rotulo = normalizar_classificacao(row.get('classificacao_final'))
+                texto = compactar_conversa(row.get('ordered_messages') or '')['texto']
+                if rotulo in ROTULOS_VALIDOS and texto:
+                    exemplos.append((texto, rotulo))
+    return exemplos
+
+
+def separar_validacao(exemplos: list, fracao: float) -> tuple:
+    """(treino, validação) pelo hash do texto: conversas repetidas caem sempre do mesmo lado."""
+    treino, validacao = [], []
+    for texto, rotulo in exemplos:
+        sorteio = (zlib.crc32(_normalizar(texto).encode('utf-8')) % 10000) / 10000
+        (validacao if sorteio < fracao else treino).append((texto, rotulo))
+    return treino, validacao
+
+
+def avaliar(pre_classificador: PreClassificador, exemplos: list, limiares=LIMIARES_AVALIACAO) -> dict:
+    """
+    Para cada limiar: linhas que o nível local decidiria (chamadas economizadas), concordância com o
+    rótulo do LLM nessas linhas e quantas delas o LLM tinha classificado como Bom/WoW.
+    """
+    probabilidades = [(pre_classificador.probabilidade(texto), rotulo) for texto, rotulo in exemplos]
+    total = len(probabilidades)
+    resultado = {
+        'linhas': total,
+        'normais_llm': sum(1 for _, rotulo in probabilidades if rotulo == ROTULO_LOCAL),
+        'limiares': []
+    }
+    for limiar in limiares:
+        decididas = [rotulo for probabilidade, rotulo in probabilidades if probabilidade >= limiar]
+        concordantes = sum(1 for rotulo in decididas if rotulo == ROTULO_LOCAL)
+        resultado['limiares'].append({
+            'limiar': limiar,
+            'decididas_local': len(decididas),
+            'chamadas_economizadas_pct': round(100 * len(decididas) / total, 1) if total else 0,
+            'concordancia_pct': round(100 * concordantes / len(decididas), 2) if decididas else None,
+            'divergentes': {rotulo: decididas.count(rotulo) for rotulo in ROTULOS_VALIDOS if rotulo != ROTULO_LOCAL}
+        })
+    return resultado
+
+
+def imprimir_avaliacao(avaliacao: dict):
+    print(f"{avaliacao['linhas']} linhas avaliadas, {avaliacao['normais_llm']} Normal pelo LLM")
+    print(f"{'limiar':>7} {'decididas':>10} {'economia %':>11} {'concordância %':>15}  divergentes")
+    for item in avaliacao['limiares']:
+        concordancia = '-' if item['concordancia_pct'] is None else f"{item['concordancia_pct']:.2f}"
+        divergentes = ', '.join(f"{rotulo} {n}" for rotulo, n in item['divergentes'].items())
+        print(f"{item['limiar']:7.2f} {item['decididas_local']:10} {item['chamadas_economizadas_pct']:11.1f} {concordancia:>15}  {divergentes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    treinar = comandos.add_parser('treinar', help='treina o modelo com saídas processadas')
+    treinar.add_argument('arquivos', nargs='+', help='processado_*.csv[.gz] (local ou gs://)')
+    treinar.add_argument('--saida', required=True, help='arquivo JSON do modelo')
+    treinar.add_argument('--validacao', type=float, default=0.2, help='fração separada para a avaliação (0 = sem avaliação)')
+    treinar.add_argument('--epocas', type=int, default=8)
+
+    avaliar_cmd = comandos.add_parser('avaliar', help='compara o modelo com os rótulos do LLM')
+    avaliar_cmd.add_argument('arquivos', nargs='+', help='processado_*.csv[.gz] (local ou gs://)')
+    avaliar_cmd.add_argument('--modelo', required=True, help='arquivo JSON do modelo')
+
+    for comando in (treinar, avaliar_cmd):
+        comando.add_argument('--limiares', default=','.join(str(l) for l in LIMIARES_AVALIACAO))
+        comando.add_argument('--relatorio', help='grava a avaliação em JSON')
+    args = parser.parse_args()
+    limiares = [float(l) for l in args.limiares.split(',') if l.strip()]
+
+    exemplos = ler_exemplos(args.arquivos)
+    if not exemplos:
+        sys.exit("Nenhuma linha classificada pelo LLM nos arquivos informados")
+    if args.comando == 'treinar':
+        treino, validacao = separar_validacao(exemplos, args.validacao)
+        pre_classificador = PreClassificador.treinar(treino, epocas=args.epocas)
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(pre_classificador.como_dict(), arquivo)
+        print(f"Modelo gravado em {args.saida}: {len(treino)} exemplos de treino, {len(pre_classificador.pesos)} pesos")
+        if not validacao:
+            return
+        exemplos = validacao
+    else:
+        with open(args.modelo, encoding='utf-8') as arquivo:
+            pre_classificador = PreClassificador(json.load(arquivo))
+
+    avaliacao = avaliar(pre_classificador, exemplos, limiares)
+    imprimir_avaliacao(avaliacao)
+    if args.relatorio:
+        with open(args.relatorio, 'w', encoding='utf-8') as arquivo:
+            json.dump(avaliacao, arquivo, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
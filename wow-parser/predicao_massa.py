@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from motor_classificacao import MAX_CONCORRENCIA
+from resposta_modelo import RespostaInvalida, config_geracao, interpretar_resposta
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+PREDICAO_MASSA_BACKEND = os.environ.get('PREDICAO_MASSA_BACKEND', 'vertex')                  # vertex | local
+PREDICAO_MASSA_LIMIAR_LINHAS = int(os.environ.get('PREDICAO_MASSA_LIMIAR_LINHAS', '100000'))  # 0 = só com bulk=1
+PREDICAO_MASSA_INTERVALO_S = float(os.environ.get('PREDICAO_MASSA_INTERVALO_S', '60'))         # entre consultas ao job
+PREDICAO_MASSA_TIMEOUT_S = int(os.environ.get('PREDICAO_MASSA_TIMEOUT_S', str(24 * 3600)))
+PREDICAO_MASSA_MAX_JOBS = int(os.environ.get('PREDICAO_MASSA_MAX_JOBS', '4'))                # jobs em massa simultâneos por instância
+
+ESTADOS_FINAIS = {'concluido', 'falhou'}
+
+
+def caminho_massa(session_id: str) -> str:
+    return f"processados/{session_id}/massa"
+
+
+def usar_predicao_massa(pedido, pre_scan: dict = None) -> bool:
+    """`bulk=1`/`bulk=0` na requisição decide; sem pedido, liga acima de PREDICAO_MASSA_LIMIAR_LINHAS linhas do pré-scan."""
+    if pedido not in (None, ''):
+        return str(pedido).lower() in ('1', 'true')
+    return bool(PREDICAO_MASSA_LIMIAR_LINHAS and pre_scan and pre_scan.get('rows', 0) >= PREDICAO_MASSA_LIMIAR_LINHAS)
+
+
+def id_requisicao(chave: str) -> str:
+    """Id da linha no arquivo de requisições: prefixo da chave do cache (conversas iguais viram uma requisição só)."""
+    return chave[:32]
+
+
+def _esquema_rest(esquema):
+    """Esquema no formato da API REST (tipos em maiúsculas), como o SDK converte nas chamadas online."""
+    if isinstance(esquema, dict):
+        return {chave: valor.upper() if chave == 'type' else _esquema_rest(valor) for chave, valor in esquema.items()}
+    if isinstance(esquema, list):
+        return [_esquema_rest(valor) for valor in esquema]
+    return esquema
+
+
+def linha_requisicao(id_item: str, conteudo: str, prompt: str) -> str:
+    """Uma linha do JSONL de entrada no formato do batch prediction do Gemini; o id também vai em `labels`."""
+    config = config_geracao()
+    geracao = {'responseMimeType': config['response_mime_type']}
+    if 'response_schema' in config:
+        geracao['responseSchema'] = _esquema_rest(config['response_schema'])
+    return json.dumps({
+        'id': id_item,
+        'request': {
+            'contents': [{'role': 'user', 'parts': [{'text': conteudo}]}],
+            'systemInstruction': {'parts': [{'text': prompt}]},
+            'generationConfig': geracao,
+            'labels': {'id': id_item}
+        }
+    }, ensure_ascii=False) + '\n'
+
+
+def interpretar_linha_saida(linha: dict) -> tuple:
+    """(id, resultado canônico ou None, usage) de uma linha do JSONL de saída; None = falhou ou veio inválida."""
+    id_item = linha.get('id') or linha.get('request', {}).get('labels', {}).get('id')
+    resposta = linha.get('response') or {}
+    uso = resposta.get('usageMetadata') or {}
+    uso = SimpleNamespace(
+        prompt_token_count=uso.get('promptTokenCount', 0),
+        candidates_token_count=uso.get('candidatesTokenCount', 0),
+        total_token_count=uso.get('totalTokenCount', 0)
+    ) if uso else None
+    try:
+        resultado, _ = interpretar_resposta(resposta['candidates'][0]['content']['parts'][0]['text'])
+    except (KeyError, IndexError, TypeError, RespostaInvalida):
+        return id_item, None, uso
+    return id_item, resultado, uso
+
+
+def ler_saida(bucket, prefixo: str):
+    """Gera as linhas de todos os .jsonl de saída sob `prefixo`."""
+    for blob in bucket.list_blobs(prefix=prefixo.rstrip('/') + '/'):
+        if not blob.name.endswith('.jsonl'):
+            continue
+        with blob.open('r', encoding='utf-8') as arquivo:
+            for linha in arquivo:
+                if linha.strip():
+                    yield json.loads(linha)
+
+
+def prefixo_de_uri(uri: str, bucket_nome: str) -> str:
+    """Objeto/prefixo de um `gs://bucket/caminho` do bucket da função."""
+    prefixo = f"gs://{bucket_nome}/"
+    if not uri.startswith(prefixo):
+        raise ValueError(f"Saída do job fora do bucket {bucket_nome}: {uri}")
+    return uri[len(prefixo):]
+
+
+# --- Backends ---
+# Cada backend recebe o arquivo de requisições e um prefixo de saída no bucket e devolve o nome do job;
+# `consultar(nome)` retorna {'estado': 'executando' | 'concluido' | 'falhou', 'detalhe', 'saida'}, onde
+# `saida` é o prefixo com os .jsonl de resultado quando o job termina.
+
+class BackendVertex:
+    """Batch prediction do Vertex AI: o job roda fora da função, sem cota de requisições online."""
+
+    nome = 'vertex'
+
+    def __init__(self, bucket, modelo: str, project: str, location: str):
+        self.bucket = bucket
+        self.modelo = modelo
+        self.project = project
+        self.location = location
+
+    def _job(self):
+        import vertexai
+        from vertexai.batch_prediction import BatchPredictionJob
+        vertexai.init(project=self.project, location=self.location)
+        return BatchPredictionJob
+
+    def submeter(self, caminho_entrada: str, prefixo_saida: str) -> str:
+        job = self._job().submit(
+            source_model=self.modelo,
+            input_dataset=f"gs://{self.bucket.name}/{caminho_entrada}",
+            output_uri_prefix=f"gs://{self.bucket.name}/{prefixo_saida}"
+        )
+        return job.resource_name
+
+    def consultar(self, nome: str) -> dict:
+        job = self._job()(nome)
+        if not job.has_ended:
+            return {'estado': 'executando', 'detalhe': str(job.state)}
+        if not job.has_succeeded:
+            return {'estado': 'falhou', 'detalhe': str(job.error or job.state)}
+        return {'estado': 'concluido', 'detalhe': str(job.state), 'saida': prefixo_de_uri(job.output_location, self.bucket.name)}
+
+
+class BackendLocal:
+    """
+    Executa o arquivo de requisições na própria instância com `gerar(conteudo, prompt)` (que devolve a
+    resposta do modelo) e grava a saída no mesmo formato do Vertex. Para testes e para o benchmark.
+    """
+
+    nome = 'local'
+
+    def __init__(self, bucket, gerar, max_concorrencia: int = None):
+        self.bucket = bucket
+        self.gerar = gerar
+        self.max_concorrencia = max_concorrencia or MAX_CONCORRENCIA
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _executar_linha(self, linha: str) -> dict:
+        item = json.loads(linha)
+        pedido = item['request']
+        try:
+            resposta = self.gerar(pedido['contents'][0]['parts'][0]['text'], pedido['systemInstruction']['parts'][0]['text'])
+        except Exception as e:
+            return {**item, 'status': str(e)}
+        uso = getattr(resposta, 'usage_metadata', None)
+        return {**item, 'status': '', 'response': {
+            'candidates': [{'content': {'role': 'model', 'parts': [{'text': resposta.text}]}}],
+            'usageMetadata': {
+                'promptTokenCount': getattr(uso, 'prompt_token_count', 0) or 0,
+                'candidatesTokenCount': getattr(uso, 'candidates_token_count', 0) or 0,
+                'totalTokenCount': getattr(uso, 'total_token_count', 0) or 0
+            }
+        }}
+
+    def _executar(self, nome: str, caminho_entrada: str, prefixo_saida: str):
+        try:
+            with self.bucket.blob(caminho_entrada).open('r', encoding='utf-8') as entrada, \
+                    self.bucket.blob(f"{prefixo_saida}/predictions.jsonl").open('w', encoding='utf-8') as saida, \
+                    ThreadPoolExecutor(max_workers=self.max_concorrencia) as executor:
+                for resultado in executor.map(self._executar_linha, (linha for linha in entrada if linha.strip())):
+                    saida.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+            estado = {'estado': 'concluido', 'detalhe': 'ok', 'saida': prefixo_saida}
+        except Exception as e:
+            logger.error(f"MASSA - Job local {nome} falhou: {e}")
+            estado = {'estado': 'falhou', 'detalhe': str(e)}
+        with self._lock:
+            self._jobs[nome] = estado
+
+    def submeter(self, caminho_entrada: str, prefixo_saida: str) -> str:
+        nome = f"local-{uuid.uuid4()}"
+        with self._lock:
+            self._jobs[nome] = {'estado': 'executando', 'detalhe': 'em execução na instância'}
+        threading.Thread(target=self._executar, args=(nome, caminho_entrada, prefixo_saida), name=nome, daemon=True).start()
+        return nome
+
+    def consultar(self, nome: str) -> dict:
+        with self._lock:
+            return dict(self._jobs.get(nome) or {'estado': 'falhou', 'detalhe': 'job desconhecido nesta instância'})
+
+
+def criar_backend(bucket, modelo: str, project: str, location: str, gerar=None):
+    """Backend escolhido por PREDICAO_MASSA_BACKEND."""
+    if PREDICAO_MASSA_BACKEND == 'local':
+        return BackendLocal(bucket, gerar)
+    if PREDICAO_MASSA_BACKEND == 'vertex':
+        return BackendVertex(bucket, modelo, project, location)
+    raise ValueError(f"PREDICAO_MASSA_BACKEND inválido: {PREDICAO_MASSA_BACKEND}")
+
+
+# --- Execução ---
+
+class PredicaoMassa:
+    """
+    Uma execução do modo em massa para uma sessão:
+    1. `adicionar(chave, conteudo)` grava as requisições (uma por conversa distinta) no JSONL de entrada;
+    2. `executar()` submete o job ao backend e consulta até ele terminar;
+    3. `resultados()` lê a saída e devolve {id: resultado} para o join com as linhas originais.
+    O manifesto (`massa/manifesto.json`) guarda o nome do job, o estado e o `contexto` da sessão (origem,
+    formato, saídas pedidas): com ele, `carregar()` retoma a espera e o join em outra instância se a
+    que submeteu o job for reciclada.
+    """
+
+    def __init__(self, bucket, session_id: str, backend, prompt: str, contexto: dict = None, manifesto: dict = None):
+        self.bucket = bucket
+        self.session_id = session_id
+        self.backend = backend
+        self.prompt = prompt
+        self.pasta = caminho_massa(session_id)
+        self.caminho_entrada = f"{self.pasta}/entrada.jsonl"
+        self.manifesto = manifesto or {'session_id': session_id, 'backend': backend.nome, 'requisicoes': 0, 'job': None,
+                                       'estado': 'preparando', 'contexto': contexto or {}}
+        # Na retomada os ids vêm só da saída do próprio job (o JSONL de entrada não é relido)
+        self._ids = set() if manifesto is None else None
+        self._entrada = None
+
+    @classmethod
+    def carregar(cls, bucket, session_id: str, backend, prompt: str):
+        """Execução salva de uma sessão; None se a sessão não usou o modo em massa."""
+        blob = bucket.blob(f"{caminho_massa(session_id)}/manifesto.json")
+        try:
+            manifesto = json.loads(blob.download_as_bytes())
+        except Exception:
+            return None
+        return cls(bucket, session_id, backend, prompt, manifesto=manifesto)
+
+    def ativa(self) -> bool:
+        """Se outra instância ainda consulta o job (consultas recentes no manifesto)."""
+        consultado = self.manifesto.get('consultado_em')
+        return (self.manifesto['estado'] == 'executando' and consultado is not None
+                and time.time() - consultado < 3 * PREDICAO_MASSA_INTERVALO_S)
+
+    def iniciar(self):
+        """Grava o manifesto antes de ler a entrada: a sessão fica retomável desde o início."""
+        self._salvar_manifesto()
+
+    def marcar_juntado(self):
+        """Registra que a saída da sessão foi montada: a partir daí não há o que retomar."""
+        self.manifesto['juntado'] = True
+        self._salvar_manifesto()
+
+    def _salvar_manifesto(self):
+        self.bucket.blob(f"{self.pasta}/manifesto.json").upload_from_string(
+            json.dumps(self.manifesto, ensure_ascii=False), content_type='application/json'
+        )
+
+    def adicionar(self, chave: str, conteudo: str) -> str:
+        """Grava a requisição da conversa (se ainda não gravada) e devolve o id usado no join."""
+        id_item = id_requisicao(chave)
+        if id_item not in self._ids:
+            if self._entrada is None:
+                self._entrada = self.bucket.blob(self.caminho_entrada).open('w', encoding='utf-8')
+            self._entrada.write(linha_requisicao(id_item, conteudo, self.prompt))
+            self._ids.add(id_item)
+        return id_item
+
+    def executar(self, ao_consultar=None, intervalo: float = None, timeout: int = None) -> dict:
+        """
+        Submete e espera o job; `ao_consultar(estado, segundos)` é chamado a cada consulta.
+        Numa execução carregada do manifesto, só continua a espera do job já submetido (ou não faz nada se já terminou).
+        """
+        intervalo = PREDICAO_MASSA_INTERVALO_S if intervalo is None else intervalo
+        timeout = timeout or PREDICAO_MASSA_TIMEOUT_S
+        if self.manifesto['estado'] == 'concluido':
+            return self.manifesto
+        if self.manifesto['job'] is None:
+            if self._entrada is None:
+                # Tudo veio do cache (ou não há conversas): não há job a submeter
+                self.manifesto.update({'estado': 'concluido', 'saida': None})
+                self._salvar_manifesto()
+                return self.manifesto
+            self._entrada.close()
+            self.manifesto['requisicoes'] = len(self._ids)
+            self.manifesto['job'] = self.backend.submeter(self.caminho_entrada, f"{self.pasta}/saida")
+            self.manifesto.update({'estado': 'executando', 'submetido_em': time.time()})
+            self._salvar_manifesto()
+            logger.info(f"MASSA - Sessão {self.session_id}: job {self.manifesto['job']} submetido ({len(self._ids)} requisições, backend {self.backend.nome})")
+        else:
+            logger.info(f"MASSA - Sessão {self.session_id}: retomando a espera do job {self.manifesto['job']}")
+
+        # O prazo conta desde a submissão, mesmo que a espera tenha começado em outra instância
+        inicio = self.manifesto.get('submetido_em') or time.time()
+        while True:
+            estado = self.backend.consultar(self.manifesto['job'])
+            decorrido = time.time() - inicio
+            if ao_consultar:
+                ao_consultar(estado, decorrido)
+            if estado['estado'] in ESTADOS_FINAIS:
+                break
+            if decorrido > timeout:
+                estado = {'estado': 'falhou', 'detalhe': f'job não terminou em {timeout}s'}
+                break
+            self.manifesto['consultado_em'] = time.time()
+            self._salvar_manifesto()
+            time.sleep(intervalo)
+
+        self.manifesto.update({'estado': estado['estado'], 'detalhe': estado.get('detalhe'), 'saida': estado.get('saida'),
+                               'duracao_s': round(time.time() - inicio, 1)})
+        self._salvar_manifesto()
+        logger.info(f"MASSA - Sessão {self.session_id}: job {self.manifesto['job']} {estado['estado']} em {self.manifesto['duracao_s']}s")
+        if estado['estado'] != 'concluido':
+            raise Exception(f"Job de predição em massa {self.manifesto['job']} falhou: {estado.get('detalhe')}")
+        return self.manifesto
+
+    def resultados(self, medidor=None) -> dict:
+        """{id: resultado} das requisições bem-sucedidas; os tokens de cada uma vão para `medidor`."""
+        resultados = {}
+        if not self.manifesto.get('saida'):
+            return resultados
+        falhas = 0
+        for linha in ler_saida(self.bucket, self.manifesto['saida']):
+            id_item, resultado, uso = interpretar_linha_saida(linha)
+            if medidor is not None:
+                medidor.registrar_chamada(ok=resultado is not None, uso=uso)
+            if (self._ids is None or id_item in self._ids) and resultado is not None:
+                resultados[id_item] = resultado
+            else:
+                falhas += 1
+        logger.info(f"MASSA - Sessão {self.session_id}: {len(resultados)} resultados, {falhas} requisições sem resultado válido")
+        return resultados
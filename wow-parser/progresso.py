@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+# memoria | gcs | redis; sem valor, gcs quando a função tem BUCKET_NAME (progresso visto por todas as instâncias)
+PROGRESSO_BACKEND = os.environ.get('PROGRESSO_BACKEND') or ('gcs' if os.environ.get('BUCKET_NAME') else 'memoria')
+PROGRESSO_TTL_S = int(os.environ.get('PROGRESSO_TTL_S', '3600'))
+PROGRESSO_MAX_SESSOES = int(os.environ.get('PROGRESSO_MAX_SESSOES', '200'))
+PROGRESSO_INTERVALO_S = float(os.environ.get('PROGRESSO_INTERVALO_S', '2'))  # escrita mínima entre gravações no backend
+PROGRESSO_PREFIXO = os.environ.get('PROGRESSO_PREFIXO', 'progresso')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Status finais: gravados no backend imediatamente, sem coalescer
+STATUS_FINAIS = {'completed', 'error', 'interrupted', 'failed'}
+
+
+# --- Backends ---
+
+class ProgressoMemoria:
+    """Progresso em memória do processo, com TTL e limite de sessões (despeja as menos recentes)."""
+
+    def __init__(self, ttl: int = None, max_sessoes: int = None):
+        self.ttl = ttl or PROGRESSO_TTL_S
+        self.max_sessoes = max_sessoes or PROGRESSO_MAX_SESSOES
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def gravar(self, session_id: str, dados: dict):
+        with self._lock:
+            self._dados.pop(session_id, None)
+            self._dados[session_id] = dados
+            while len(self._dados) > self.max_sessoes:
+                removida, _ = self._dados.popitem(last=False)
+                logger.info(f"PROGRESSO - Sessão {removida} despejada (limite de {self.max_sessoes} sessões)")
+
+    def obter(self, session_id: str):
+        with self._lock:
+            return self._dados.get(session_id)
+
+    def remover(self, session_id: str):
+        with self._lock:
+            self._dados.pop(session_id, None)
+
+    def varrer(self) -> int:
+        limite = time.time() - self.ttl
+        with self._lock:
+            expiradas = [sid for sid, dados in self._dados.items() if dados.get('timestamp', 0) < limite]
+            for sid in expiradas:
+                del self._dados[sid]
+        return len(expiradas)
+
+
+class ProgressoGCS:
+    """Progresso compartilhado entre instâncias: um objeto JSON por sessão em `{prefixo}/{session_id}.json`."""
+
+    def __init__(self, bucket, prefixo: str = None, ttl: int = None):
+        # `bucket` também pode ser uma função: o cliente do Storage só é criado na primeira gravação/leitura
+        self._bucket = bucket
+        self._bucket_lock = threading.Lock()
+        self.prefixo = (prefixo or PROGRESSO_PREFIXO).strip('/')
+        self.ttl = ttl or PROGRESSO_TTL_S
+
+    @property
+    def bucket(self):
+        bucket = self._bucket
+        if callable(bucket):
+            with self._bucket_lock:
+                if callable(self._bucket):
+                    self._bucket = self._bucket()
+                bucket = self._bucket
+        return bucket
+
+    def _nome(self, session_id: str) -> str:
+        return f"{self.prefixo}/{session_id}.json"
+
+    def gravar(self, session_id: str, dados: dict):
+        blob = self.bucket.blob(self._nome(session_id))
+        blob.cache_control = 'no-store'
+        blob.upload_from_string(json.dumps(dados, ensure_ascii=False), content_type='application/json')
+
+    def obter(self, session_id: str):
+        try:
+            return json.loads(self.bucket.blob(self._nome(session_id)).download_as_bytes())
+        except Exception as e:
+            if type(e).__name__ != 'NotFound':
+                logger.warning(f"PROGRESSO - Erro ao ler progresso da sessão {session_id}: {e}")
+            return None
+
+    def remover(self, session_id: str):
+        try:
+            self.bucket.blob(self._nome(session_id)).delete()
+        except Exception:
+            pass
+
+    def varrer(self) -> int:
+        # Complementa a regra de ciclo de vida do bucket (que trabalha em dias, não em horas)
+        limite = time.time() - self.ttl
+        removidas = 0
+        for blob in self.bucket.list_blobs(prefix=f"{self.prefixo}/"):
+            atualizado = getattr(blob, 'updated', None)
+            if atualizado and atualizado.timestamp() < limite:
+                try:
+                    blob.delete()
+                    removidas += 1
+                except Exception:
+                    pass
+        return removidas
+
+
+class ProgressoRedis:
+    """Progresso compartilhado em um servidor compatível com Redis; o TTL fica a cargo do próprio servidor."""
+
+    def __init__(self, url: str = None, ttl: int = None, prefixo: str = None):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("PROGRESSO_BACKEND=redis requer o pacote 'redis' no requirements.txt")
+        self._redis = redis.Redis.from_url(url or REDIS_URL)
+        self.ttl = ttl or PROGRESSO_TTL_S
+        self.prefixo = prefixo or PROGRESSO_PREFIXO
+
+    def gravar(self, session_id: str, dados: dict):
+        self._redis.setex(f"{self.prefixo}:{session_id}", self.ttl, json.dumps(dados, ensure_ascii=False))
+
+    def obter(self, session_id: str):
+        valor = self._redis.get(f"{self.prefixo}:{session_id}")
+        return json.loads(valor) if valor else None
+
+    def remover(self, session_id: str):
+        self._redis.delete(f"{self.prefixo}:{session_id}")
+
+    def varrer(self) -> int:
+        return 0
+
+
+# --- Fachada usada pelo serviço ---
+
+class ArmazenamentoProgresso:
+    """
+    Fachada do progresso das sessões.
+    - Guarda uma cópia local (com TTL e limite de memória) para leituras rápidas na mesma instância.
+    - Escreve no backend compartilhado no máximo uma vez a cada `intervalo` segundos por sessão;
+      a última versão pendente é enviada pela thread de varredura. Status finais são gravados na hora.
+    - A thread de varredura também remove sessões expiradas, mesmo que ninguém consulte o progresso.
+    - Cada gravação recebe um número de sequência (`seq`) por sessão; `aguardar` bloqueia até a
+      sequência mudar, para o streaming de progresso só enviar algo quando houver novidade.
+    """
+
+    def __init__(self, compartilhado=None, intervalo: float = None, ttl: int = None, max_sessoes: int = None):
+        self.local = ProgressoMemoria(ttl, max_sessoes)
+        self.compartilhado = compartilhado
+        self.intervalo = PROGRESSO_INTERVALO_S if intervalo is None else intervalo
+        self._ultima_escrita = {}
+        self._pendentes = {}
+        self._lock = threading.Lock()
+        self._mudou = threading.Condition()
+        self._thread = None
+
+    def _iniciar_varredura(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop_varredura, name='progresso-varredura', daemon=True)
+                    self._thread.start()
+
+    def _loop_varredura(self):
+        ultima_varredura = 0.0
+        while True:
+            time.sleep(max(0.5, min(self.intervalo, 5.0)))
+            try:
+                self.descarregar()
+                if time.time() - ultima_varredura >= 60:
+                    ultima_varredura = time.time()
+                    removidas = self.local.varrer()
+                    if self.compartilhado is not None:
+                        removidas += self.compartilhado.varrer()
+                    with self._lock:
+                        for sid in list(self._ultima_escrita):
+                            if self.local.obter(sid) is None and sid not in self._pendentes:
+                                del self._ultima_escrita[sid]
+                    if removidas:
+                        logger.info(f"PROGRESSO - {removidas} sessões expiradas removidas")
+            except Exception as e:
+                logger.error(f"PROGRESSO - Erro na varredura: {e}")
+
+    def _escrever_compartilhado(self, session_id: str, dados: dict):
+        try:
+            self.compartilhado.gravar(session_id, dados)
+        except Exception as e:
+            logger.error(f"PROGRESSO - Falha ao gravar progresso da sessão {session_id}: {e}")
+
+    def gravar(self, session_id: str, dados: dict):
+        with self._mudou:
+            anterior = self.local.obter(session_id)
+            dados['seq'] = (anterior.get('seq', 0) if anterior else 0) + 1
+            self.local.gravar(session_id, dados)
+            self._mudou.notify_all()
+        self._iniciar_varredura()
+        if self.compartilhado is None:
+            return
+
+        agora = time.time()
+        with self._lock:
+            final = dados.get('status') in STATUS_FINAIS
+            if not final and agora - self._ultima_escrita.get(session_id, 0) < self.intervalo:
+                # Coalescer: só a versão mais recente será enviada
+                self._pendentes[session_id] = dados
+                return
+            self._pendentes.pop(session_id, None)
+            self._ultima_escrita[session_id] = agora
+        self._escrever_compartilhado(session_id, dados)
+
+    def descarregar(self):
+        """Envia ao backend as versões pendentes cujo intervalo já passou."""
+        if self.compartilhado is None:
+            return
+        agora = time.time()
+        with self._lock:
+            prontas = {sid: dados for sid, dados in self._pendentes.items()
+                       if agora - self._ultima_escrita.get(sid, 0) >= self.intervalo}
+            for sid in prontas:
+                del self._pendentes[sid]
+                self._ultima_escrita[sid] = agora
+        for sid, dados in prontas.items():
+            self._escrever_compartilhado(sid, dados)
+
+    def obter(self, session_id: str):
+        dados = self.local.obter(session_id)
+        if dados is None and self.compartilhado is not None:
+            dados = self.compartilhado.obter(session_id)
+        return dados
+
+    def aguardar(self, session_id: str, seq: int = None, timeout: float = 15.0):
+        """
+        Espera até o progresso da sessão ter `seq` diferente do informado (ou o timeout acabar)
+        e retorna o progresso atual (None se a sessão não existir).
+        Sessões que estão em outra instância são consultadas no backend compartilhado a cada `intervalo`.
+        """
+        limite = time.time() + timeout
+        with self._mudou:
+            while self.local.obter(session_id) is not None or self.compartilhado is None:
+                dados = self.local.obter(session_id)
+                restante = limite - time.time()
+                if (dados is not None and dados.get('seq') != seq) or restante <= 0:
+                    return dados
+                self._mudou.wait(restante)
+
+        while True:
+            dados = self.compartilhado.obter(session_id)
+            restante = limite - time.time()
+            if (dados is not None and dados.get('seq') != seq) or restante <= 0:
+                return dados
+            time.sleep(min(max(self.intervalo, 0.5), restante))
+
+    def remover(self, session_id: str):
+        self.local.remover(session_id)
+        with self._lock:
+            self._pendentes.pop(session_id, None)
+            self._ultima_escrita.pop(session_id, None)
+        if self.compartilhado is not None:
+            self.compartilhado.remover(session_id)
+
+
+def criar_armazenamento_progresso(obter_bucket=None) -> ArmazenamentoProgresso:
+    """Monta o armazenamento de progresso a partir das variáveis de ambiente."""
+    compartilhado = None
+    try:
+        if PROGRESSO_BACKEND == 'redis':
+            compartilhado = ProgressoRedis()
+        elif PROGRESSO_BACKEND == 'gcs' and obter_bucket:
+            compartilhado = ProgressoGCS(obter_bucket)
+    except Exception as e:
+        logger.error(f"PROGRESSO - Backend '{PROGRESSO_BACKEND}' indisponível, usando só memória: {e}")
+    if compartilhado is None:
+        logger.warning("PROGRESSO - Progresso só em memória: com mais de uma instância, /progress e o stream de uma "
+                       "sessão processada em outra instância respondem 404 (use PROGRESSO_BACKEND=gcs ou redis)")
+    return ArmazenamentoProgresso(compartilhado)
@@ -0,0 +1,311 @@
+import io
+import os
+import csv
+import gzip
+import json
+import importlib.util
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Tamanho de cada parte do upload resumível (múltiplo de 256KB, exigência do GCS)
+UPLOAD_CHUNK_MB = int(os.environ.get('UPLOAD_CHUNK_MB', '8'))
+SAIDA_GZIP = os.environ.get('SAIDA_GZIP', '1') == '1'                       # CSV de saída com Content-Encoding: gzip
+SAIDA_PARQUET = os.environ.get('SAIDA_PARQUET', '0') == '1'                  # também gerar .parquet (exige pyarrow)
+PARQUET_LINHAS_GRUPO = int(os.environ.get('PARQUET_LINHAS_GRUPO', '10000'))  # linhas por row group (memória da escrita)
+
+# Formatos de entrada aceitos, pela extensão do arquivo
+EXTENSOES_ENTRADA = {
+    '.csv': 'csv',
+    '.csv.gz': 'csv',
+    '.jsonl': 'jsonl',
+    '.jsonl.gz': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.ndjson.gz': 'jsonl',
+    '.parquet': 'parquet',
+}
+
+
+def parquet_disponivel() -> bool:
+    """Se o pyarrow está instalado (sem importá-lo): a saída e a entrada Parquet dependem dele."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+class LeitorContador(io.RawIOBase):
+    """Envolve um stream binário e conta quantos bytes já foram consumidos (para estimar o progresso)."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self.bytes_lidos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        dados = self._stream.read(len(buffer))
+        if not dados:
+            return 0
+        tamanho = len(dados)
+        buffer[:tamanho] = dados
+        with self._lock:
+            self.bytes_lidos += tamanho
+        return tamanho
+
+
+def detectar_formato(nome_arquivo: str):
+    """Formato de entrada ('csv', 'jsonl' ou 'parquet') pela extensão; None se não for suportado."""
+    nome = (nome_arquivo or '').lower()
+    for extensao in sorted(EXTENSOES_ENTRADA, key=len, reverse=True):
+        if nome.endswith(extensao):
+            return EXTENSOES_ENTRADA[extensao]
+    return None
+
+
+def nome_base(nome_arquivo: str) -> str:
+    """Nome sem a extensão de entrada (ex.: 'dados.csv.gz' -> 'dados')."""
+    for extensao in sorted(EXTENSOES_ENTRADA, key=len, reverse=True):
+        if nome_arquivo.lower().endswith(extensao):
+            return nome_arquivo[:-len(extensao)]
+    return nome_arquivo
+
+
+def _descomprimir_se_gzip(stream):
+    """Envolve o stream em GzipFile se ele começar com a assinatura do gzip (sem depender da extensão)."""
+    buffer = io.BufferedReader(stream, buffer_size=256 * 1024)
+    if buffer.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=buffer, mode='rb')
+    return buffer
+
+
+def _texto_celula(valor) -> str:
+    if valor is None:
+        return ''
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False)
+    return str(valor)
+
+
+class LeitorRegistros:
+    """
+    Mesma interface do csv.DictReader (`fieldnames` + iteração de dicts de str) para JSONL e Parquet.
+    `total_linhas` é conhecido de antemão no Parquet (metadados do arquivo).
+    """
+
+    def __init__(self, fieldnames: list, registros, total_linhas: int = None):
+        self.fieldnames = fieldnames
+        self.total_linhas = total_linhas
+        self._registros = registros
+
+    def __iter__(self):
+        for registro in self._registros:
+            # Colunas fora do cabeçalho são ignoradas e as que faltam ficam vazias, como no CSV
+            yield {campo: _texto_celula(registro.get(campo)) for campo in self.fieldnames}
+
+
+def _abrir_jsonl(texto) -> LeitorRegistros:
+    def registros():
+        for linha in texto:
+            if linha.strip():
+                yield json.loads(linha)
+
+    iterador = registros()
+    primeiro = next(iterador, None)
+    if primeiro is None:
+        return LeitorRegistros([], iter(()))
+    if not isinstance(primeiro, dict):
+        raise ValueError("Cada linha do JSONL deve ser um objeto JSON")
+
+    def todos():
+        yield primeiro
+        yield from iterador
+    # As colunas vêm do primeiro registro (como o cabeçalho de um CSV)
+    return LeitorRegistros(list(primeiro.keys()), todos())
+
+
+def _abrir_parquet(stream) -> LeitorRegistros:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Entrada Parquet requer o pacote pyarrow") from e
+
+    arquivo = pq.ParquetFile(stream)
+
+    def registros():
+        # Um lote por vez: a memória fica limitada ao tamanho do lote, não ao do arquivo
+        for lote in arquivo.iter_batches(batch_size=PARQUET_LINHAS_GRUPO):
+            yield from lote.to_pylist()
+    return LeitorRegistros(list(arquivo.schema_arrow.names), registros(), arquivo.metadata.num_rows)
+
+
+def abrir_entrada(origem, formato: str = 'csv'):
+    """
+    Abre a entrada como um leitor incremental de dicts (CSV, JSONL ou Parquet), sem carregar o arquivo inteiro.
+    CSV e JSONL comprimidos com gzip são detectados pela assinatura e descomprimidos em streaming;
+    o contador conta os bytes comprimidos, a mesma medida do tamanho do upload.
+    Retorna (leitor, contador) — `contador` é None quando a entrada é `str`.
+    """
+    if formato == 'csv':
+        return abrir_csv_entrada(origem)
+    if isinstance(origem, str):
+        return _abrir_jsonl(io.StringIO(origem)), None
+
+    contador = LeitorContador(origem)
+    if formato == 'parquet':
+        # O Parquet precisa de acesso aleatório (rodapé com os metadados): lê direto do stream posicionável
+        return _abrir_parquet(origem), None
+    texto = io.TextIOWrapper(_descomprimir_se_gzip(contador), encoding='utf-8-sig')
+    return _abrir_jsonl(texto), contador
+
+
+def abrir_csv_entrada(origem):
+    """
+    Abre a entrada como um csv.DictReader incremental, sem carregar o arquivo inteiro.
+    `origem` pode ser um stream binário (upload, blob.open('rb')) ou um `str` já decodificado.
+    Retorna (leitor, contador) — `contador` é None quando a entrada é `str`.
+    """
+    if isinstance(origem, str):
+        return csv.DictReader(io.StringIO(origem)), None
+
+    contador = LeitorContador(origem)
+    # Decodificador incremental: lê blocos de bytes e entrega texto sob demanda ao csv
+    texto = io.TextIOWrapper(_descomprimir_se_gzip(contador), encoding='utf-8-sig', newline='')
+    return csv.DictReader(texto), contador
+
+
+class EscritorContador(io.RawIOBase):
+    """Envolve um stream binário de escrita e conta quantos bytes já foram gravados."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes_escritos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._stream.write(dados)
+        self.bytes_escritos += len(dados)
+        return len(dados)
+
+
+class _MembrosGzip(io.RawIOBase):
+    """Stream gzip que pode fechar o membro atual e abrir outro no mesmo destino (a concatenação é um gzip válido)."""
+
+    def __init__(self, destino: EscritorContador):
+        self._destino = destino
+        self._membro = gzip.GzipFile(fileobj=destino, mode='wb')
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        return self._membro.write(dados)
+
+    def novo_membro(self) -> int:
+        """Fecha o membro atual e abre outro; devolve o offset (bytes gravados) em que o novo começa."""
+        self._membro.close()  # grava o rodapé do membro; o GzipFile não fecha o destino
+        offset = self._destino.bytes_escritos
+        self._membro = gzip.GzipFile(fileobj=self._destino, mode='wb')  # já grava o cabeçalho do novo membro
+        return offset
+
+    def close(self):
+        if not self.closed:
+            self._membro.close()
+        super().close()
+
+
+class SaidaGzip(io.TextIOWrapper):
+    """
+    Writer de texto comprimido com gzip; fechar conclui o gzip e o upload de baixo.
+    `novo_membro()` começa um membro gzip novo e devolve o offset dele no objeto: cada membro pode
+    ser baixado por range e descomprimido sozinho (usado pelo índice de resultados).
+    """
+
+    def __init__(self, destino):
+        self._destino = destino
+        self._contador = EscritorContador(destino)
+        self._membros = _MembrosGzip(self._contador)
+        super().__init__(self._membros, encoding='utf-8', newline='')
+
+    def novo_membro(self) -> int:
+        self.flush()
+        return self._membros.novo_membro()
+
+    def close(self):
+        if not self.closed:
+            super().close()  # fecha o membro gzip atual (grava o rodapé), que não fecha o destino
+            self._destino.close()
+
+
+def abrir_csv_saida_gcs(bucket, blob_path: str, comprimir: bool = None):
+    """
+    Abre um writer de texto que envia o CSV para o GCS em partes, via upload resumível.
+    A memória usada fica limitada ao tamanho de uma parte, independente do tamanho do arquivo.
+    O arquivo só passa a existir no bucket quando o writer é fechado (`close()`).
+    Com `comprimir` (padrão SAIDA_GZIP), o objeto é gravado com gzip e `Content-Encoding: gzip`:
+    o GCS entrega descomprimido a quem não aceita gzip, então o link de download continua um CSV.
+    """
+    comprimir = SAIDA_GZIP if comprimir is None else comprimir
+    blob = bucket.blob(blob_path)
+    if not comprimir:
+        return blob.open(
+            'w',
+            content_type='text/csv',
+            chunk_size=UPLOAD_CHUNK_MB * 1024 * 1024,
+            encoding='utf-8',
+            newline=''
+        )
+    blob.content_encoding = 'gzip'
+    return SaidaGzip(blob.open('wb', content_type='text/csv', chunk_size=UPLOAD_CHUNK_MB * 1024 * 1024))
+
+
+class EscritorParquet:
+    """
+    Escreve linhas (dicts) em Parquet com a interface do csv.DictWriter (`writerow`), em row groups de
+    PARQUET_LINHAS_GRUPO linhas: só um grupo fica em memória. Todas as colunas são texto, como no CSV.
+    """
+
+    def __init__(self, destino, fieldnames: list, linhas_por_grupo: int = None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Saída Parquet requer o pacote pyarrow") from e
+        self._pa = pa
+        self.fieldnames = fieldnames
+        self.linhas_por_grupo = linhas_por_grupo or PARQUET_LINHAS_GRUPO
+        self._schema = pa.schema([(campo, pa.string()) for campo in fieldnames])
+        self._writer = pq.ParquetWriter(destino, self._schema, compression='snappy')
+        self._destino = destino
+        self._grupo = []
+
+    def writerow(self, row: dict):
+        self._grupo.append(row)
+        if len(self._grupo) >= self.linhas_por_grupo:
+            self._gravar_grupo()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _gravar_grupo(self):
+        if not self._grupo:
+            return
+        colunas = {campo: [_texto_celula(row.get(campo)) for row in self._grupo] for campo in self.fieldnames}
+        self._writer.write_table(self._pa.table(colunas, schema=self._schema))
+        self._grupo = []
+
+    def close(self):
+        self._gravar_grupo()
+        self._writer.close()
+        if not getattr(self._destino, 'closed', False):
+            self._destino.close()
+
+
+def abrir_parquet_saida_gcs(bucket, blob_path: str, fieldnames: list) -> EscritorParquet:
+    """Writer Parquet que envia o arquivo ao GCS por upload resumível, um row group por vez."""
+    blob = bucket.blob(blob_path)
+    destino = blob.open('wb', content_type='application/vnd.apache.parquet', chunk_size=UPLOAD_CHUNK_MB * 1024 * 1024)
+    return EscritorParquet(destino, fieldnames)
@@ -0,0 +1,100 @@
+import os
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de Configuração
+JOBS_MAX_SIMULTANEOS = int(os.environ.get('JOBS_MAX_SIMULTANEOS', '2'))  # jobs processando ao mesmo tempo por instância
+JOBS_MAX_FILA = int(os.environ.get('JOBS_MAX_FILA', '20'))                # jobs esperando; acima disso a submissão é recusada
+
+
+class FilaCheia(Exception):
+    """A fila de jobs da instância atingiu `JOBS_MAX_FILA`."""
+
+
+class PoolTarefas:
+    """
+    Executa jobs longos em segundo plano com no máximo `max_simultaneos` ao mesmo tempo;
+    os demais esperam em uma fila FIFO.
+    `ao_mudar_posicao(job_id, posicao, na_fila)` é chamado na submissão e sempre que a fila anda,
+    para cada job que continua esperando (posição 1 = o próximo a rodar).
+    """
+
+    def __init__(self, max_simultaneos: int = None, max_fila: int = None, ao_mudar_posicao=None):
+        self.max_simultaneos = max_simultaneos or JOBS_MAX_SIMULTANEOS
+        self.max_fila = max_fila or JOBS_MAX_FILA
+        self.ao_mudar_posicao = ao_mudar_posicao
+        self._fila = deque()
+        self._em_execucao = set()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _avisar_posicoes(self):
+        # Chamado com o lock: garante que o aviso de "na fila" nunca chega depois do início do job
+        if not self.ao_mudar_posicao:
+            return
+        for posicao, (job_id, _) in enumerate(self._fila, 1):
+            try:
+                self.ao_mudar_posicao(job_id, posicao, len(self._fila))
+            except Exception as e:
+                logger.error(f"JOBS - Erro ao avisar posição do job {job_id}: {e}")
+
+    def _iniciar_threads(self):
+        while len(self._threads) < self.max_simultaneos:
+            thread = threading.Thread(target=self._trabalhar, name=f"job-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def cheia(self) -> bool:
+        with self._cond:
+            return len(self._fila) >= self.max_fila
+
+    def submeter(self, job_id: str, funcao) -> int:
+        """Enfileira `funcao()` como o job `job_id`; retorna a posição na fila."""
+        with self._cond:
+            if len(self._fila) >= self.max_fila:
+                raise FilaCheia(f"Fila de jobs cheia ({self.max_fila} aguardando)")
+            self._fila.append((job_id, funcao))
+            posicao = len(self._fila)
+            self._avisar_posicoes()
+            self._iniciar_threads()
+            self._cond.notify()
+        logger.info(f"JOBS - Job {job_id} enfileirado na posição {posicao}")
+        return posicao
+
+    def posicao(self, job_id: str):
+        """Posição do job na fila (0 se já está rodando, None se não é conhecido)."""
+        with self._cond:
+            if job_id in self._em_execucao:
+                return 0
+            for posicao, (id_fila, _) in enumerate(self._fila, 1):
+                if id_fila == job_id:
+                    return posicao
+        return None
+
+    def _trabalhar(self):
+        while True:
+            with self._cond:
+                while not self._fila:
+                    self._cond.wait()
+                job_id, funcao = self._fila.popleft()
+                self._em_execucao.add(job_id)
+                self._avisar_posicoes()
+            logger.info(f"JOBS - Iniciando job {job_id}")
+            try:
+                funcao()
+            except Exception as e:
+                logger.error(f"JOBS - Job {job_id} terminou com erro: {e}")
+            finally:
+                with self._cond:
+                    self._em_execucao.discard(job_id)
+
+    def estado(self) -> dict:
+        with self._cond:
+            return {
+                'jobs_running': len(self._em_execucao),
+                'jobs_queued': len(self._fila),
+                'max_concurrent_jobs': self.max_simultaneos
+            }
@@ -0,0 +1,37 @@
+"""Os módulos compartilhados são copiados para cada função (o deploy só leva a própria pasta): as cópias não podem divergir."""
+import os
+import unittest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORIGINAL = os.path.join(RAIZ, 'wow-parser')
+
+# Módulo de wow-parser/ -> funções que levam uma cópia dele (a mesma tabela está no README)
+COPIAS = {
+    'clientes.py': ['funcao-processadora', 'funcao-classificadora', 'funcao-geradora-url'],
+    'limitador.py': ['funcao-processadora', 'funcao-classificadora'],
+    'motor_classificacao.py': ['funcao-processadora', 'funcao-classificadora'],
+    'resposta_modelo.py': ['funcao-processadora', 'funcao-classificadora'],
+    'cache_classificacao.py': ['funcao-processadora'],
+    'lote_classificacao.py': ['funcao-classificadora'],
+}
+
+
+def ler(caminho: str) -> bytes:
+    with open(caminho, 'rb') as f:
+        return f.read()
+
+
+class CopiasTest(unittest.TestCase):
+
+    def test_copias_identicas_ao_original(self):
+        for modulo, funcoes in COPIAS.items():
+            original = ler(os.path.join(ORIGINAL, modulo))
+            for funcao in funcoes:
+                with self.subTest(modulo=modulo, funcao=funcao):
+                    copia = os.path.join(RAIZ, funcao, modulo)
+                    self.assertTrue(os.path.exists(copia), f"{funcao}/{modulo} não existe")
+                    self.assertTrue(ler(copia) == original, f"{funcao}/{modulo} divergiu de wow-parser/{modulo}: copie o original de novo")
+
+
+if __name__ == '__main__':
+    unittest.main()